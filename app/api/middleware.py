@@ -0,0 +1,149 @@
+import hmac
+import time
+
+from loguru import logger
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config.config import (PROFILING_INTERVAL, PROFILING_TOKEN,
+                               SLOW_REQUEST_THRESHOLD_MS)
+from app.utils.metrics import REQUEST_LATENCY
+from app.utils.request_timing import request_timings, server_timing
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+
+class MetricsMiddleware:
+    """
+    Time each HTTP request until its body is fully sent, labelled by the
+    matched route template (`/api/v1/transaction/{id}`), never the raw path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status),
+            ).observe(time.perf_counter() - started)
+
+
+def profiling_requested(scope) -> bool:
+    token = str(PROFILING_TOKEN)
+    header = Headers(scope=scope).get("x-profile")
+    # Compared as bytes: compare_digest rejects non-ASCII str, and headers
+    # are decoded as latin-1, which encodes back to the bytes as sent
+    return bool(token and header) and hmac.compare_digest(
+        header.encode("latin-1"), token.encode()
+    )
+
+
+class TimingMiddleware:
+    """
+    Break each request's time down by category (see app/utils/request_timing)
+    in a `Server-Timing` header, and log requests slower than
+    SLOW_REQUEST_THRESHOLD_MS with the same breakdown.
+
+    A request carrying the `X-Profile` token is answered with a sampling
+    profiler report of itself instead of its own body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+        elif profiling_requested(scope):
+            await self.profile(scope, receive, send)
+        else:
+            await self.timed(scope, receive, send)
+
+    async def timed(self, scope, receive, send):
+        timings = {}
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    server_timing(timings, time.perf_counter() - started),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_timings.reset(token)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= SLOW_REQUEST_THRESHOLD_MS:
+                breakdown = {
+                    f"{name}_ms": round(seconds * 1000, 2)
+                    for name, seconds in timings.items()
+                }
+                logger.bind(**breakdown).warning(
+                    "Slow request: {} {} took {:.1f} ms {}",
+                    scope["method"],
+                    scope["path"],
+                    elapsed_ms,
+                    breakdown,
+                )
+
+    async def profile(self, scope, receive, send):
+        if Profiler is None:
+            logger.warning("Profiling was requested but pyinstrument is not installed")
+            await self.timed(scope, receive, send)
+            return
+
+        response = {}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response.update(message)
+
+        profiler = Profiler(interval=PROFILING_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.timed(scope, receive, capture)
+        finally:
+            profiler.stop()
+
+        logger.info("Profiled request: {} {}", scope["method"], scope["path"])
+        body = profiler.output_html().encode()
+        headers = MutableHeaders(
+            {
+                "content-type": "text/html; charset=utf-8",
+                "content-length": str(len(body)),
+                "x-profiled-status": str(response.get("status", 500)),
+            }
+        )
+        server_timing_header = MutableHeaders(scope=response).get("server-timing")
+        if server_timing_header:
+            headers["server-timing"] = server_timing_header
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": headers.raw}
+        )
+        await send({"type": "http.response.body", "body": body})
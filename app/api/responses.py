@@ -0,0 +1,14 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from app.utils.request_timing import timed
+from app.utils.serialization import dumps
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered by the configured serializer (orjson by default)."""
+
+    def render(self, content: Any) -> bytes:
+        with timed("serialization"):
+            return dumps(content)
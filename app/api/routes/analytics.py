@@ -1,25 +1,49 @@
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Query, status
+from fastapi import APIRouter, Body, Query, status
 from loguru import logger
 
-from app.crud.analytics_service import (retrieve_live_transaction_analytics,
-                                        retrieve_transaction_analytics)
+from app.config.logging import sampled
+from app.crud.analytics_service import (retrieve_analytics_series,
+                                        retrieve_live_transaction_analytics,
+                                        retrieve_transaction_analytics,
+                                        retrieve_transaction_analytics_many)
 from app.exceptions.exceptions import EntityDoesNotExistError, ServiceError
-from app.models.analytics_model import ResponseModel
+from app.models.analytics_model import BatchAnalyticsRequest, ResponseModel
 
 router = APIRouter()
 
+
+@router.post(
+    "/batch",
+    response_description="Analytics for several users, keyed by user ID",
+    response_model=ResponseModel,
+)
+async def get_transaction_analytics_batch(request: BatchAnalyticsRequest = Body(...)):
+    sampled().info(
+        "Retrieving transaction analytics for {} users", len(request.user_ids)
+    )
+    analytics = await retrieve_transaction_analytics_many(request.user_ids)
+    found = sum(entry["status"] == "found" for entry in analytics.values())
+    sampled().info(
+        "Transaction analytics retrieved for {} of {} users", found, len(analytics)
+    )
+    return ResponseModel(
+        analytics,
+        "Transaction analytics retrieved successfully",
+        status.HTTP_200_OK,
+    )
+
 @router.get(
     "/{user_id}",
     response_description="User analytics retrieved",
     response_model=ResponseModel,
 )
 async def get_transaction_analytics(user_id: str):
-    logger.info(f"Retrieving transaction analytics for user ID: {user_id}")
+    sampled().info("Retrieving transaction analytics for user ID: {}", user_id)
     analytics = await retrieve_transaction_analytics(user_id)
-    logger.info(f"Transaction analytics retrieved for user ID: {user_id}")
+    sampled().info("Transaction analytics retrieved for user ID: {}", user_id)
     return ResponseModel(
         analytics,
         "Transaction analytics retrieved successfully",
@@ -40,13 +64,45 @@ async def get_range_transaction_analytics(
         None, description="End date for the period e.g 2024-11-08T01:05:37.574299"
     ),
 ):
-    logger.info(f"Retrieving transaction analytics for user ID: {user_id}")
+    sampled().info("Retrieving transaction analytics for user ID: {}", user_id)
     analytics = await retrieve_live_transaction_analytics(
         user_id, start_date, end_date
     )
-    logger.info(f"Transaction analytics retrieved for user ID: {user_id}")
+    sampled().info("Transaction analytics retrieved for user ID: {}", user_id)
     return ResponseModel(
         analytics,
         "Transaction analytics retrieved successfully",
         status.HTTP_200_OK,
-    )
\ No newline at end of file
+    )
+
+
+@router.get(
+    "/series/{user_id}",
+    response_description="User analytics per time bucket",
+    response_model=ResponseModel,
+)
+async def get_transaction_analytics_series(
+    user_id: str,
+    start_date: datetime = Query(
+        ..., description="Start of the series e.g 2024-10-08T00:00:00"
+    ),
+    end_date: datetime = Query(
+        ..., description="End of the series e.g 2024-11-08T00:00:00"
+    ),
+    granularity: str = Query("day", pattern="^(hour|day|week|month)$"),
+    tz: str = Query(
+        "UTC", description="IANA time zone of the buckets e.g Europe/Paris"
+    ),
+):
+    sampled().info(
+        "Retrieving {} analytics series for user ID: {}", granularity, user_id
+    )
+    series = await retrieve_analytics_series(
+        user_id, start_date, end_date, granularity, tz
+    )
+    sampled().info("Analytics series retrieved for user ID: {}", user_id)
+    return ResponseModel(
+        series,
+        "Transaction analytics series retrieved successfully",
+        status.HTTP_200_OK,
+    )
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, status
+
+from app.models.analytics_model import ResponseModel
+from app.utils.cache_utils import cache_stats
+
+router = APIRouter()
+
+
+@router.get(
+    "/stats",
+    response_description="Cache hit and miss counters for this worker",
+    response_model=ResponseModel,
+)
+async def get_cache_stats():
+    return ResponseModel(
+        cache_stats(), "Cache statistics retrieved successfully", status.HTTP_200_OK
+    )
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from . import analytics, transactions
+from . import analytics, cache, scheduler, transactions
 
 base_router = APIRouter()
 
@@ -9,3 +9,9 @@ base_router.include_router(
 )
 
 base_router.include_router(analytics.router, tags=["analytics"], prefix="/v1/analytics")
+
+base_router.include_router(cache.router, tags=["cache"], prefix="/v1/cache")
+
+base_router.include_router(
+    scheduler.router, tags=["scheduler"], prefix="/v1/scheduler"
+)
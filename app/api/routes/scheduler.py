@@ -0,0 +1,19 @@
+from fastapi import APIRouter, status
+
+from app.models.analytics_model import ResponseModel
+from app.tasks.leader_election import scheduler_status
+
+router = APIRouter()
+
+
+@router.get(
+    "/status",
+    response_description="Current scheduler leader and last run of each job",
+    response_model=ResponseModel,
+)
+async def get_scheduler_status():
+    return ResponseModel(
+        await scheduler_status(),
+        "Scheduler status retrieved successfully",
+        status.HTTP_200_OK,
+    )
@@ -1,17 +1,37 @@
-from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, status
-from fastapi.encoders import jsonable_encoder
+import csv
+import io
+import json
+import zlib
+from contextlib import aclosing
+from datetime import datetime
+from typing import Optional
+
+from fastapi import (APIRouter, Body, HTTPException, Query, Request, Response,
+                     status)
+from fastapi.responses import StreamingResponse
 from loguru import logger
+from starlette.background import BackgroundTask
 
-from app.crud.transactions_service import (add_transaction, delete_transaction,
+from app.config.config import (BULK_INGEST_CHUNK_SIZE, HISTORY_MAX_PAGE_SIZE,
+                               HISTORY_PAGE_SIZE)
+from app.config.logging import sampled
+from app.crud.transactions_service import (add_transaction,
+                                           add_transactions_bulk,
+                                           delete_transaction,
+                                           iter_transaction_export,
                                            retrieve_transaction,
                                            retrieve_transaction_history,
+                                           transaction_document,
                                            update_transaction)
-from app.exceptions.exceptions import EntityDoesNotExistError, ServiceError
+from app.exceptions.exceptions import (EntityDoesNotExistError,
+                                       InvalidOperationError, ServiceError)
 from app.models.transaction_model import (ResponseModel, TransactionModel,
                                           UpdateTransactionModel)
 from app.tasks.background_tasks import (alert_relevant_systems,
                                         recalculate_credit_scores,
                                         update_user_statistics)
+from app.tasks.task_queue import check_capacity, enqueue_many
+from app.utils.serialization import dumps
 
 router = APIRouter()
 
@@ -22,25 +42,22 @@ router = APIRouter()
     response_model=ResponseModel,
     status_code=status.HTTP_201_CREATED,
 )
-async def add_transaction_record(
-    background_tasks: BackgroundTasks, transaction: TransactionModel = Body(...)
-):
-    logger.info("Adding a transaction record")
-    transaction = jsonable_encoder(transaction)
+async def add_transaction_record(transaction: TransactionModel = Body(...)):
+    sampled().info("Adding a transaction record")
+    await check_capacity()
+    transaction = transaction_document(transaction)
     try:
         new_transaction = await add_transaction(transaction)
-        logger.info("Added a transaction record")
-
-        """
-        Simutation of handling asynchronous tasks with backgraound non-blocking processing
+        sampled().info("Added a transaction record")
 
-        This and other strategies like implementing an event driven architecture can be beneficial
-
-        """
-
-        background_tasks.add_task(update_user_statistics, transaction["user_id"])
-        background_tasks.add_task(alert_relevant_systems, transaction)
-        background_tasks.add_task(recalculate_credit_scores, transaction["user_id"])
+        # Side effects run on the task workers, off the request path
+        await enqueue_many(
+            [
+                (update_user_statistics, transaction["user_id"]),
+                (alert_relevant_systems, new_transaction),
+                (recalculate_credit_scores, transaction["user_id"]),
+            ]
+        )
 
         return ResponseModel(
             new_transaction, "Transaction added successfully.", status.HTTP_201_CREATED
@@ -53,6 +70,103 @@ async def add_transaction_record(
         raise ServiceError("An error occurred while adding the transaction")
 
 
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+
+
+async def iter_bulk_records(request: Request):
+    """
+    Yield `(index, record)` pairs from a JSON array body, or raw lines from an
+    NDJSON body as they stream in.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_CONTENT_TYPES):
+        index = 0
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+        if buffer.strip():
+            yield index, buffer
+        return
+
+    try:
+        records = json.loads(await request.body())
+    except ValueError:
+        raise InvalidOperationError("Request body is not valid JSON")
+    if not isinstance(records, list):
+        raise InvalidOperationError("Request body must be a JSON array or NDJSON")
+    for index, record in enumerate(records):
+        yield index, record
+
+
+async def ingest_chunk(chunk: list) -> list:
+    """
+    Store one chunk of bulk records, reporting every record in it as failed
+    when the chunk cannot be stored, so the chunks already committed are still
+    reported to the caller.
+    """
+    try:
+        return await add_transactions_bulk(chunk)
+    except Exception as e:
+        logger.error(f"Failed to store a chunk of {len(chunk)} bulk records: {e}")
+        return [
+            {
+                "index": index,
+                "status": "failed",
+                "error": "An error occurred while storing the record",
+            }
+            for index, _ in chunk
+        ]
+
+
+@router.post(
+    "/bulk",
+    response_description="Transaction records ingested in bulk",
+    response_model=ResponseModel,
+    status_code=status.HTTP_201_CREATED,
+)
+async def add_transaction_records_bulk(request: Request, response: Response):
+    logger.info("Adding transaction records in bulk")
+    await check_capacity()
+    results = []
+    chunk = []
+    async for record in iter_bulk_records(request):
+        chunk.append(record)
+        if len(chunk) >= BULK_INGEST_CHUNK_SIZE:
+            results.extend(await ingest_chunk(chunk))
+            chunk = []
+    if chunk:
+        results.extend(await ingest_chunk(chunk))
+
+    # Caches and analytics were already flagged chunk by chunk
+    created = [result for result in results if result["status"] == "created"]
+    user_ids = {result["user_id"] for result in created}
+
+    tasks = []
+    for user_id in user_ids:
+        tasks.append((update_user_statistics, user_id))
+        tasks.append((recalculate_credit_scores, user_id))
+    if created:
+        tasks.append((alert_relevant_systems, [result["id"] for result in created]))
+    await enqueue_many(tasks)
+
+    failed = len(results) - len(created)
+    logger.info(f"Bulk ingest finished: {len(created)} created, {failed} failed")
+
+    response.status_code = (
+        status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED
+    )
+    return ResponseModel(
+        {"created": len(created), "failed": failed, "results": results},
+        "Bulk transactions processed",
+        response.status_code,
+    )
+
+
 @router.get(
     "/{id}",
     response_description="Transaction data retrieved",
@@ -60,7 +174,7 @@ async def add_transaction_record(
     status_code=status.HTTP_200_OK,
 )
 async def get_transaction_data(id: str):
-    logger.info(f"Retrieving transaction data for ID: {id}")
+    sampled().info("Retrieving transaction data for ID: {}", id)
     try:
         transaction = await retrieve_transaction(id)
         return ResponseModel(
@@ -81,13 +195,27 @@ async def get_transaction_data(id: str):
     response_description="User transaction history retrieved",
     response_model=ResponseModel,
 )
-async def get_transaction_history(user_id: str):
-    logger.info(f"Retrieving transaction history for user ID: {user_id}")
+async def get_transaction_history(
+    user_id: str,
+    response: Response,
+    cursor: Optional[str] = Query(
+        None, description="Opaque cursor from the X-Next-Cursor header"
+    ),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    include_full_name: bool = Query(
+        False, description="Decrypt and include the full name on each row"
+    ),
+):
+    sampled().info("Retrieving transaction history for user ID: {}", user_id)
     try:
-        transaction_history = await retrieve_transaction_history(user_id)
-        logger.info(f"Transaction history retrieved for user ID: {user_id}")
+        transaction_history = await retrieve_transaction_history(
+            user_id, cursor=cursor, limit=limit, include_full_name=include_full_name
+        )
+        sampled().info("Transaction history retrieved for user ID: {}", user_id)
+        if transaction_history["next_cursor"]:
+            response.headers["X-Next-Cursor"] = transaction_history["next_cursor"]
         return ResponseModel(
-            transaction_history,
+            transaction_history["transactions"],
             "Transaction history retrieved successfully",
             status.HTTP_200_OK,
         )
@@ -96,6 +224,8 @@ async def get_transaction_history(user_id: str):
         raise EntityDoesNotExistError(
             f"Transaction history not found for user ID {user_id}"
         )
+    except InvalidOperationError:
+        raise
     except Exception as e:
         logger.error(
             f"An error occurred while retrieving transaction history for user ID: {user_id}",
@@ -104,18 +234,106 @@ async def get_transaction_history(user_id: str):
         raise ServiceError()
 
 
+EXPORT_FIELDS = ["id", "transaction_date", "transaction_amount", "transaction_type"]
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_row(transaction: dict) -> list:
+    transaction_date = transaction["transaction_date"]
+    if isinstance(transaction_date, datetime):
+        transaction_date = transaction_date.isoformat()
+    return [
+        str(transaction["_id"]),
+        transaction_date,
+        transaction["transaction_amount"],
+        transaction["transaction_type"],
+    ]
+
+
+def format_ndjson(batch: list) -> bytes:
+    return b"".join(
+        dumps(dict(zip(EXPORT_FIELDS, export_row(transaction)))) + b"\n"
+        for transaction in batch
+    )
+
+
+def format_csv(batch: list) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(export_row(transaction) for transaction in batch)
+    return buffer.getvalue().encode()
+
+
+async def stream_export(
+    user_id: str, format: str, start_date, end_date, compress: bool
+):
+    """Encode export batches as they arrive; memory stays at one batch."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    formatter = format_csv if format == "csv" else format_ndjson
+
+    def encode(chunk: bytes) -> bytes:
+        return compressor.compress(chunk) if compressor else chunk
+
+    if format == "csv":
+        yield encode((",".join(EXPORT_FIELDS) + "\r\n").encode())
+    async with aclosing(
+        iter_transaction_export(user_id, start_date, end_date)
+    ) as batches:
+        async for batch in batches:
+            chunk = encode(formatter(batch))
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
+@router.get(
+    "/history/{user_id}/export",
+    response_description="User's full transaction history as NDJSON or CSV",
+    response_class=StreamingResponse,
+)
+async def export_transaction_history(
+    user_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start_date: Optional[datetime] = Query(None, alias="from"),
+    end_date: Optional[datetime] = Query(None, alias="to"),
+    gzip: bool = Query(False, description="gzip the body (Content-Encoding)"),
+):
+    sampled().info(
+        "Exporting transaction history for user ID: {} as {}", user_id, format
+    )
+    rows = stream_export(user_id, format, start_date, end_date, gzip)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{user_id}-transactions.{format}"'
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    # Starlette cancels the stream when the client disconnects but leaves the
+    # generator suspended; closing it in the background task (which still runs)
+    # closes the Mongo cursor right away instead of at garbage collection.
+    # A coroutine function, as BackgroundTask would run a bare `aclose` in a thread
+    async def close_export():
+        await rows.aclose()
+
+    return StreamingResponse(
+        rows,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers,
+        background=BackgroundTask(close_export),
+    )
+
+
 @router.put(
     "/{id}",
     response_description="Transaction data updated",
     response_model=ResponseModel,
 )
 async def update_transaction_data(id: str, req: UpdateTransactionModel = Body(...)):
-    logger.info(f"Updating transaction data for ID: {id}")
+    sampled().info("Updating transaction data for ID: {}", id)
     req = {k: v for k, v in req.dict().items() if v is not None}
     try:
         updated_transaction = await update_transaction(id, req)
         if updated_transaction:
-            logger.info(f"Transaction with ID: {id} updated")
+            sampled().info("Transaction with ID: {} updated", id)
             return ResponseModel(
                 f"Transaction with ID: {id} update is successful",
                 "Transaction updated successfully",
@@ -137,11 +355,11 @@ async def update_transaction_data(id: str, req: UpdateTransactionModel = Body(..
     response_model=ResponseModel,
 )
 async def delete_transaction_data(id: str):
-    logger.info(f"Deleting transaction data for ID: {id}")
+    sampled().info("Deleting transaction data for ID: {}", id)
     try:
         deleted_transaction = await delete_transaction(id)
         if deleted_transaction:
-            logger.info(f"Transaction with ID: {id} deleted")
+            sampled().info("Transaction with ID: {} deleted", id)
             return ResponseModel(
                 f"Transaction with ID: {id} removed",
                 "Transaction deleted successfully",
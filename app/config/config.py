@@ -1,11 +1,7 @@
-import logging
-import sys
-
-from loguru import logger
 from starlette.config import Config
-from starlette.datastructures import Secret
+from starlette.datastructures import CommaSeparatedStrings, Secret
 
-from app.config.logging import InterceptHandler
+from app.config.logging import configure_logging
 
 config = Config(".env")
 
@@ -13,6 +9,11 @@ API_PREFIX = "/api"
 VERSION = "0.1.0"
 DEBUG: bool = config("DEBUG", cast=bool, default=False)
 SECRET_KEY: Secret = config("SECRET_KEY", cast=Secret, default="")
+# Comma-separated `kid:fernet-key` entries, newest first; new values are
+# encrypted with the first key, older keys stay readable for rotation
+ENCRYPTION_KEYS: CommaSeparatedStrings = config(
+    "ENCRYPTION_KEYS", cast=CommaSeparatedStrings, default=""
+)
 
 PROJECT_NAME: str = config("PROJECT_NAME", default="fido-transactions-api")
 
@@ -21,16 +22,178 @@ MONGO_DB_NAME: str = config("MONGO_DB_NAME", default="fido_transactions_db")
 MONGO_INITDB_ROOT_USERNAME: str = config("MONGO_INITDB_ROOT_USERNAME", default="myuser")
 MONGO_INITDB_ROOT_PASSWORD: str = config("MONGO_INITDB_ROOT_USERNAME", default="mypass")
 
+RUN_MIGRATIONS_ON_STARTUP: bool = config(
+    "RUN_MIGRATIONS_ON_STARTUP", cast=bool, default=True
+)
+BACKFILL_BATCH_SIZE: int = config("BACKFILL_BATCH_SIZE", cast=int, default=1000)
+# A running migration refreshes its claim this often; a claim left untouched for
+# MIGRATION_STALE_AFTER seconds (its process died) is taken over and resumed
+MIGRATION_HEARTBEAT_INTERVAL: float = config(
+    "MIGRATION_HEARTBEAT_INTERVAL", cast=float, default=10.0
+)
+MIGRATION_STALE_AFTER: float = config(
+    "MIGRATION_STALE_AFTER", cast=float, default=60.0
+)
+
 FIDO_TRANSACTIONS_COLLECTION: str = config(
     "FIDO_TRANSACTIONS_COLLECTION", default="transactions"
 )
 FIDO_ANALYTICS_COLLECTION: str = config(
     "FIDO_ANALYTICS_COLLECTION", default="analytics"
 )
-CACHE_EXPIRATION: int = config("CACHE_EXPIRATION", cast=int, default=300)
+FIDO_DAILY_ROLLUP_COLLECTION: str = config(
+    "FIDO_DAILY_ROLLUP_COLLECTION", default="daily_rollups"
+)
+REDIS_HOST: str = config("REDIS_HOST", default="redis")
+REDIS_PORT: int = config("REDIS_PORT", cast=int, default=6379)
+REDIS_DB: int = config("REDIS_DB", cast=int, default=0)
+REDIS_MAX_CONNECTIONS: int = config("REDIS_MAX_CONNECTIONS", cast=int, default=50)
+REDIS_SOCKET_TIMEOUT: float = config("REDIS_SOCKET_TIMEOUT", cast=float, default=2.0)
+REDIS_CONNECT_TIMEOUT: float = config(
+    "REDIS_CONNECT_TIMEOUT", cast=float, default=2.0
+)
+
+# Cache keys embed a per-user generation bumped on every write, so entries can
+# live long without going stale
+CACHE_EXPIRATION: int = config("CACHE_EXPIRATION", cast=int, default=6 * 60 * 60)
+# How long past expiry a value may still be served while it is refreshed
+CACHE_STALE_TTL: int = config("CACHE_STALE_TTL", cast=int, default=300)
+# Higher values refresh earlier ahead of expiry; 0 disables early refresh
+CACHE_EARLY_REFRESH_BETA: float = config(
+    "CACHE_EARLY_REFRESH_BETA", cast=float, default=1.0
+)
+CACHE_LOCK_TIMEOUT_MS: int = config("CACHE_LOCK_TIMEOUT_MS", cast=int, default=10000)
+CACHE_LOCK_POLL_INTERVAL: float = config(
+    "CACHE_LOCK_POLL_INTERVAL", cast=float, default=0.05
+)
+
+# Serializer for API responses and cached payloads: "orjson" or "json"
+JSON_SERIALIZER: str = config("JSON_SERIALIZER", default="orjson")
+
+# Cached values are written as "msgpack" (binary, see app/utils/cache_codec.py)
+# or "json"; both are always readable. Bodies above the threshold are
+# compressed with "zstd", "lz4" or "none"
+CACHE_CODEC: str = config("CACHE_CODEC", default="msgpack")
+CACHE_COMPRESSION: str = config("CACHE_COMPRESSION", default="zstd")
+CACHE_COMPRESSION_THRESHOLD: int = config(
+    "CACHE_COMPRESSION_THRESHOLD", cast=int, default=1024
+)
+
+# In-process cache in front of Redis, kept short-lived as a safety net for
+# invalidation messages missed while a worker was disconnected
+L1_CACHE_ENABLED: bool = config("L1_CACHE_ENABLED", cast=bool, default=True)
+L1_CACHE_MAX_BYTES: int = config(
+    "L1_CACHE_MAX_BYTES", cast=int, default=64 * 1024 * 1024
+)
+L1_CACHE_TTL: float = config("L1_CACHE_TTL", cast=float, default=30.0)
+
+HISTORY_PAGE_SIZE: int = config("HISTORY_PAGE_SIZE", cast=int, default=100)
+HISTORY_MAX_PAGE_SIZE: int = config("HISTORY_MAX_PAGE_SIZE", cast=int, default=500)
+# Rows fetched per round trip, and per chunk written, by history exports
+EXPORT_BATCH_SIZE: int = config("EXPORT_BATCH_SIZE", cast=int, default=1000)
+
+BULK_INGEST_CHUNK_SIZE: int = config("BULK_INGEST_CHUNK_SIZE", cast=int, default=1000)
+
+# Refresh only users written to since the last run instead of rebuilding all
+ANALYTICS_INCREMENTAL: bool = config("ANALYTICS_INCREMENTAL", cast=bool, default=True)
+ANALYTICS_CONCURRENCY: int = config("ANALYTICS_CONCURRENCY", cast=int, default=16)
+ANALYTICS_USER_BATCH_SIZE: int = config(
+    "ANALYTICS_USER_BATCH_SIZE", cast=int, default=500
+)
+ANALYTICS_BULK_WRITE_SIZE: int = config(
+    "ANALYTICS_BULK_WRITE_SIZE", cast=int, default=1000
+)
+# Users are split by hash so N analytics processes each take a disjoint slice;
+# changing the shard count needs one full (non-incremental) run afterwards
+ANALYTICS_SHARD_COUNT: int = config("ANALYTICS_SHARD_COUNT", cast=int, default=1)
+ANALYTICS_SHARD_INDEX: int = config("ANALYTICS_SHARD_INDEX", cast=int, default=0)
+# Analytics documents follow writes through a change feed: "redis" (a stream
+# fed by the API, works on a single node), "changestream" (needs a replica
+# set) or "off". With a feed, the scheduled run only reconciles, less often.
+ANALYTICS_FEED: str = config("ANALYTICS_FEED", default="redis")
+ANALYTICS_FEED_BATCH_SIZE: int = config(
+    "ANALYTICS_FEED_BATCH_SIZE", cast=int, default=500
+)
+ANALYTICS_FEED_MAXLEN: int = config("ANALYTICS_FEED_MAXLEN", cast=int, default=100000)
+# Entries left unacknowledged this long by a dead consumer are taken over
+ANALYTICS_FEED_CLAIM_IDLE_MS: int = config(
+    "ANALYTICS_FEED_CLAIM_IDLE_MS", cast=int, default=60000
+)
+ANALYTICS_RECONCILE_INTERVAL: float = config(
+    "ANALYTICS_RECONCILE_INTERVAL", cast=float, default=30 * 60.0
+)
+# Largest list of users accepted by one batch analytics lookup
+ANALYTICS_BATCH_MAX_USERS: int = config(
+    "ANALYTICS_BATCH_MAX_USERS", cast=int, default=500
+)
+# Time-bucketed series; closed buckets stay cached until the user's next write
+ANALYTICS_SERIES_MAX_BUCKETS: int = config(
+    "ANALYTICS_SERIES_MAX_BUCKETS", cast=int, default=1000
+)
+ANALYTICS_SERIES_CACHE_TTL: int = config(
+    "ANALYTICS_SERIES_CACHE_TTL", cast=int, default=24 * 60 * 60
+)
+
+# Only the worker holding the scheduler lease runs scheduled jobs; the lease
+# must outlive a few missed renewals, and failover takes at most one lease
+SCHEDULER_LEASE_MS: int = config("SCHEDULER_LEASE_MS", cast=int, default=30000)
+SCHEDULER_RENEW_INTERVAL: float = config(
+    "SCHEDULER_RENEW_INTERVAL", cast=float, default=10.0
+)
+SCHEDULER_INSTANCE_ID: str = config("SCHEDULER_INSTANCE_ID", default="")
+
+# Encryption and decryption run in batches on a worker pool ("thread" or
+# "process"); callers wait once CRYPTO_MAX_PENDING batches are queued
+CRYPTO_EXECUTOR: str = config("CRYPTO_EXECUTOR", default="thread")
+CRYPTO_WORKERS: int = config("CRYPTO_WORKERS", cast=int, default=4)
+CRYPTO_BATCH_SIZE: int = config("CRYPTO_BATCH_SIZE", cast=int, default=256)
+CRYPTO_MAX_PENDING: int = config("CRYPTO_MAX_PENDING", cast=int, default=64)
+
+# Post-transaction side effects run on `python -m app.tasks.worker`, fed through
+# a Redis stream; the API answers 503 once TASK_QUEUE_MAX_DEPTH tasks wait
+TASK_QUEUE_MAX_DEPTH: int = config("TASK_QUEUE_MAX_DEPTH", cast=int, default=10000)
+TASK_QUEUE_BATCH_SIZE: int = config("TASK_QUEUE_BATCH_SIZE", cast=int, default=50)
+TASK_WORKER_CONCURRENCY: int = config("TASK_WORKER_CONCURRENCY", cast=int, default=16)
+TASK_MAX_ATTEMPTS: int = config("TASK_MAX_ATTEMPTS", cast=int, default=5)
+# Retries wait TASK_RETRY_BASE_DELAY seconds, doubling up to TASK_RETRY_MAX_DELAY
+TASK_RETRY_BASE_DELAY: float = config("TASK_RETRY_BASE_DELAY", cast=float, default=1.0)
+TASK_RETRY_MAX_DELAY: float = config("TASK_RETRY_MAX_DELAY", cast=float, default=300.0)
+# Tasks left unacknowledged this long by a dead worker are taken over
+TASK_CLAIM_IDLE_MS: int = config("TASK_CLAIM_IDLE_MS", cast=int, default=60000)
+
+# Logs are JSON lines ("json") or loguru's text format ("text"), written from a
+# background thread unless LOG_ENQUEUE is off; lines past LOG_QUEUE_SIZE waiting
+# are dropped. LOG_LEVELS overrides the level per logger, by module prefix:
+# "uvicorn.access:WARNING,app.crud.analytics_service:DEBUG"
+LOG_FORMAT: str = config("LOG_FORMAT", default="json")
+LOG_LEVEL: str = config("LOG_LEVEL", default="DEBUG" if DEBUG else "INFO")
+LOG_LEVELS: CommaSeparatedStrings = config(
+    "LOG_LEVELS", cast=CommaSeparatedStrings, default=""
+)
+LOG_ENQUEUE: bool = config("LOG_ENQUEUE", cast=bool, default=True)
+LOG_QUEUE_SIZE: int = config("LOG_QUEUE_SIZE", cast=int, default=10000)
+# Share of per-request info messages kept, and how often a repeated warning or
+# error (a Redis outage, unreadable cache entries) may be logged
+LOG_SAMPLE_RATE: float = config("LOG_SAMPLE_RATE", cast=float, default=0.1)
+LOG_RATE_LIMIT_INTERVAL: float = config(
+    "LOG_RATE_LIMIT_INTERVAL", cast=float, default=10.0
+)
+
+# Requests slower than this are logged with their Server-Timing breakdown
+SLOW_REQUEST_THRESHOLD_MS: float = config(
+    "SLOW_REQUEST_THRESHOLD_MS", cast=float, default=1000.0
+)
+# A request sent with `X-Profile: <PROFILING_TOKEN>` is answered with a
+# pyinstrument report of itself (if installed); an empty token disables this
+PROFILING_TOKEN: Secret = config("PROFILING_TOKEN", cast=Secret, default="")
+PROFILING_INTERVAL: float = config("PROFILING_INTERVAL", cast=float, default=0.001)
 
-LOGGING_LEVEL = logging.DEBUG if DEBUG else logging.INFO
-logging.basicConfig(
-    handlers=[InterceptHandler(level=LOGGING_LEVEL)], level=LOGGING_LEVEL
+configure_logging(
+    LOG_LEVEL,
+    dict(entry.strip().rsplit(":", 1) for entry in LOG_LEVELS),
+    format=LOG_FORMAT,
+    enqueue=LOG_ENQUEUE,
+    queue_size=LOG_QUEUE_SIZE,
+    sample_rate=LOG_SAMPLE_RATE,
+    rate_limit_interval=LOG_RATE_LIMIT_INTERVAL,
 )
-logger.configure(handlers=[{"sink": sys.stderr, "level": LOGGING_LEVEL}])
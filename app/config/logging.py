@@ -1,9 +1,189 @@
 import logging
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
 
+import orjson
 from loguru import logger
 
 
 class InterceptHandler(logging.Handler):
+    """Route stdlib logging (uvicorn, apscheduler, pymongo) into loguru."""
+
     def emit(self, record: logging.LogRecord) -> None:
-        logger_opt = logger.opt(depth=7, exception=record.exc_info)
-        logger_opt.log(record.levelname, record.getMessage())
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        # Attribute the record to the caller outside of `logging`, so its module
+        # name is the one per-logger levels match against
+        frame, depth = logging.currentframe(), 2
+        while frame is not None and frame.f_code.co_filename == logging.__file__:
+            frame = frame.f_back
+            depth += 1
+        logger.opt(depth=depth, exception=record.exc_info).log(
+            level, record.getMessage()
+        )
+
+
+class QueueSink:
+    """
+    Hand formatted lines to a background thread that writes them to `stream`
+    (the current `sys.stderr` by default), so callers never wait on the write.
+    Lines beyond `max_size` queued are dropped and counted rather than blocking
+    the event loop.
+    """
+
+    def __init__(self, stream=None, max_size: int = 10000):
+        self.stream = stream
+        self.queue = queue.Queue(max_size)
+        self.dropped = 0
+        self.thread = threading.Thread(
+            target=self.drain, name="log-writer", daemon=True
+        )
+        self.thread.start()
+
+    def write(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def drain(self):
+        while True:
+            lines = [self.queue.get()]
+            # Write whatever else is waiting in one go
+            while not self.queue.empty() and len(lines) < 1000:
+                lines.append(self.queue.get_nowait())
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(f"{dropped} log lines dropped, the log queue was full\n")
+            stop = None in lines
+            stream = self.stream or sys.stderr
+            try:
+                stream.write("".join(line for line in lines if line is not None))
+                stream.flush()
+            except (OSError, ValueError):
+                # A closed or broken stream must not stop the writer
+                pass
+            if stop:
+                return
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+def json_line(entry: dict) -> str:
+    return orjson.dumps(entry, default=str).decode() + "\n"
+
+
+def json_format(record: dict) -> str:
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+        **record["extra"],
+    }
+    if record["exception"] is not None:
+        entry["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    record["extra"]["json"] = json_line(entry)
+    return "{extra[json]}"
+
+
+class NullLogger:
+    """Stands in for `logger` when a message is sampled out or rate limited."""
+
+    def discard(self, *args, **kwargs):
+        pass
+
+    debug = info = success = warning = error = exception = log = discard
+
+
+null_logger = NullLogger()
+log_settings = {"sample_rate": 1.0, "rate_limit_interval": 10.0}
+sampled_loggers = {}
+# Rate-limited message key -> [time last emitted, calls suppressed since]
+rate_limits = {}
+
+
+def sampled(rate: float = None):
+    """
+    `logger` for a `rate` fraction of calls and a no-op otherwise, for messages
+    logged on every request. Kept records carry `sample_rate`, so counts can be
+    scaled back up. Pass arguments separately to keep formatting lazy:
+
+        sampled().info("Retrieving transaction data for ID: {}", id)
+    """
+    rate = log_settings["sample_rate"] if rate is None else rate
+    if rate >= 1:
+        return logger
+    if random.random() >= rate:
+        return null_logger
+    if rate not in sampled_loggers:
+        sampled_loggers[rate] = logger.bind(sample_rate=rate)
+    return sampled_loggers[rate]
+
+
+def rate_limited(key: str, interval: float = None):
+    """
+    `logger` at most once per `interval` seconds for `key`, a no-op otherwise,
+    for messages that can repeat in a storm. The next kept record carries the
+    number of calls `suppressed` in between.
+    """
+    interval = log_settings["rate_limit_interval"] if interval is None else interval
+    now = time.monotonic()
+    state = rate_limits.get(key)
+    if state is not None and now - state[0] < interval:
+        state[1] += 1
+        return null_logger
+    rate_limits[key] = [now, 0]
+    if state is not None and state[1]:
+        return logger.bind(suppressed=state[1])
+    return logger
+
+
+def configure_logging(
+    level: str,
+    levels: dict,
+    format: str = "json",
+    enqueue: bool = True,
+    queue_size: int = 10000,
+    sample_rate: float = 1.0,
+    rate_limit_interval: float = 10.0,
+):
+    """
+    Send loguru and stdlib logging to one sink: JSON lines or loguru's text
+    format, written from a background thread when `enqueue` is set. `levels`
+    maps logger names (module prefixes such as `uvicorn.access` or
+    `app.crud`) to the lowest level they emit.
+    """
+    log_settings["sample_rate"] = sample_rate
+    log_settings["rate_limit_interval"] = rate_limit_interval
+
+    # Stdlib loggers below their level never build a record at all
+    logging.basicConfig(handlers=[InterceptHandler()], level=level, force=True)
+    for name, name_level in levels.items():
+        logging.getLogger(name).setLevel(name_level)
+
+    lowest = min(
+        logger.level(name_level).no for name_level in [level, *levels.values()]
+    )
+    handler = {
+        "sink": QueueSink(max_size=queue_size) if enqueue else sys.stderr,
+        # The handler admits the lowest level in use; `filter` applies each
+        # logger's own level by module name
+        "level": lowest,
+        "filter": {"": level, **levels},
+        "colorize": format != "json" and sys.stderr.isatty(),
+        "backtrace": False,
+    }
+    if format == "json":
+        handler["format"] = json_format
+    logger.configure(handlers=[handler])
@@ -1,3 +1,25 @@
-import redis
+import redis.asyncio as redis
+from loguru import logger
 
-redis_client = redis.Redis(host="redis", port=6379, db=0)
+from app.config.config import (REDIS_CONNECT_TIMEOUT, REDIS_DB, REDIS_HOST,
+                               REDIS_MAX_CONNECTIONS, REDIS_PORT,
+                               REDIS_SOCKET_TIMEOUT)
+from app.utils.metrics import InstrumentedRedis
+
+# Connections are opened lazily on first use, inside the running event loop
+redis_pool = redis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+)
+
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
+
+
+async def close_redis():
+    await redis_client.aclose()
+    await redis_pool.disconnect()
+    logger.info("Redis connection pool closed")
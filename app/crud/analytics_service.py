@@ -1,167 +1,1011 @@
-import json
-from datetime import datetime
-
+import asyncio
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from bson.decimal128 import Decimal128
 from loguru import logger
-
-from app.config.config import CACHE_EXPIRATION
+from pymongo import DeleteOne, UpdateOne
+
+from app.config.config import (ANALYTICS_BULK_WRITE_SIZE,
+                               ANALYTICS_CONCURRENCY, ANALYTICS_FEED,
+                               ANALYTICS_FEED_MAXLEN, ANALYTICS_INCREMENTAL,
+                               ANALYTICS_SERIES_MAX_BUCKETS,
+                               ANALYTICS_SHARD_COUNT, ANALYTICS_SHARD_INDEX,
+                               ANALYTICS_USER_BATCH_SIZE,
+                               FIDO_DAILY_ROLLUP_COLLECTION)
+from app.config.logging import rate_limited, sampled
 from app.config.redis_config import redis_client
-from app.database.database import analytics_collection, transaction_collection
-from app.exceptions.exceptions import EntityDoesNotExistError, ServiceError
+from app.database.database import (analytics_collection, migrations_collection,
+                                   rollup_collection, transaction_collection)
+from app.exceptions.exceptions import (EntityDoesNotExistError,
+                                       InvalidOperationError, ServiceError)
 from app.models.analytics_model import AnalyticsModel
+from app.tasks.leader_election import check_fencing_token
+from app.utils.bson_utils import to_decimal, to_float
+from app.utils.cache_utils import (analytics_cache_key,
+                                   analytics_range_cache_key,
+                                   analytics_series_cache_key,
+                                   bump_cache_generation, cache_buckets,
+                                   cached_load, cached_load_many,
+                                   get_cached_buckets)
+from app.utils.metrics import record_analytics_run
+from app.utils.request_timing import measure, timed
+
+ANALYTICS_DIRTY_USERS_KEY = "analytics:dirty_users:{shard}"
+# Users written to, for the analytics updater when ANALYTICS_FEED is "redis"
+ANALYTICS_FEED_STREAM = "analytics:feed"
+# Users whose rollup update failed; rebuilt from raw transactions next run
+ROLLUP_REPAIR_KEY = "analytics:rollup_repair"
+# Set while a user's rollups are rebuilt and for ROLLUP_REBUILD_GRACE seconds
+# after, so a write that may have landed mid-rebuild queues a repair
+ROLLUP_REBUILDING_KEY = "analytics:rollup_rebuilding:{user_id}"
+# Upper bound on one rebuild, in case its process dies before clearing it
+ROLLUP_REBUILD_TTL = 600
+# Longer than a rollup write takes to check for a rebuild once it has landed
+ROLLUP_REBUILD_GRACE = 10
+# Users whose rollups were written before the backfilled ones were swapped in;
+# the backfill rebuilds them once it has
+ROLLUP_BACKFILL_KEY = "analytics:rollup_backfill"
+
+# Migration building the rollups of transactions written before they existed
+ROLLUP_BACKFILL_VERSION = 3
+# Seconds between checks, while they are not, whether the rollups are ready
+ROLLUPS_READY_RECHECK = 1.0
+rollups_state = {"ready": False, "checked_at": 0.0}
+
+# Move a batch of users from a set into its processing set in one step
+TAKE_BATCH_SCRIPT = """
+local users = redis.call("spop", KEYS[1], ARGV[1])
+if #users > 0 then
+    redis.call("sadd", KEYS[2], unpack(users))
+end
+return users
+"""
+
+# Bookkeeping fields never returned to clients; the last two are only found on
+# documents written before daily rollups existed, until migration 4 rewrites them
+ANALYTICS_STATE_PROJECTION = {
+    "transaction_count": 0,
+    "transaction_sum": 0,
+    "transactions_by_day": 0,
+    "watermark": 0,
+}
+
+ROLLUP_FIELDS = ("count", "sum", "debit_total", "credit_total")
+
+
+def rollup_id(user_id: str, day: str) -> dict:
+    """
+    `_id` of a rollup document. Naming the user in the key lets a change
+    stream on rollups tell whose day was removed from a delete event.
+    """
+    return {"user_id": user_id, "day": day}
+
+
+def day_key(transaction_date) -> str:
+    """The UTC day of a date, as MongoDB stores and `day_expression` groups it."""
+    if isinstance(transaction_date, datetime):
+        if transaction_date.tzinfo is not None:
+            transaction_date = transaction_date.astimezone(timezone.utc)
+        return transaction_date.strftime("%Y-%m-%d")
+    return str(transaction_date)[:10]
+
+
+def user_shard(user_id: str, shard_count: int = ANALYTICS_SHARD_COUNT) -> int:
+    """Stable hash shard of a user, identical across processes and restarts."""
+    return zlib.crc32(user_id.encode()) % shard_count
+
+
+def dirty_users_key(shard_index: int) -> str:
+    return ANALYTICS_DIRTY_USERS_KEY.format(shard=shard_index)
+
+
+async def mark_users_dirty(*user_ids: str):
+    """Flag users for the next incremental analytics run."""
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.sadd(dirty_users_key(user_shard(user_id)), user_id)
+            await pipe.execute()
+    except Exception as e:
+        rate_limited("mark_users_dirty").error(
+            "Failed to mark analytics dirty for user IDs: {}: {}", user_ids, e
+        )
 
 
-async def compute_and_store_analytics():
-    logger.info("Computing and storing analytics data")
+async def notify_analytics(*user_ids: str):
+    """
+    Report users whose transactions were just written: published to the
+    analytics feed when it is a Redis stream, and flagged dirty so the next
+    reconciliation run catches anything the feed missed.
+    """
     try:
-        users = await transaction_collection.distinct("user_id")
-        for user_id in users:
-            query = {"user_id": user_id}
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.sadd(dirty_users_key(user_shard(user_id)), user_id)
+                if ANALYTICS_FEED == "redis":
+                    pipe.xadd(
+                        ANALYTICS_FEED_STREAM,
+                        {"user_id": user_id},
+                        maxlen=ANALYTICS_FEED_MAXLEN,
+                        approximate=True,
+                    )
+            await pipe.execute()
+    except Exception as e:
+        rate_limited("notify_analytics").error(
+            "Failed to notify analytics for user IDs: {}: {}", user_ids, e
+        )
 
-            logger.info(f"Analytics query: `{query}`")
 
-            transactions = await transaction_collection.find(query).to_list(length=None)
+async def rollups_ready() -> bool:
+    """
+    Whether the rollups backfill has swapped in rollups covering every
+    transaction; until then analytics are computed from raw transactions.
+    Once ready, always ready.
+    """
+    if rollups_state["ready"]:
+        return True
+    now = time.monotonic()
+    if now - rollups_state["checked_at"] < ROLLUPS_READY_RECHECK:
+        return False
+    rollups_state["checked_at"] = now
+    try:
+        record = await migrations_collection.find_one(
+            {
+                "_id": ROLLUP_BACKFILL_VERSION,
+                "$or": [{"status": "applied"}, {"progress.stage": "ready"}],
+            },
+            {"_id": 1},
+        )
+    except Exception as e:
+        rate_limited("rollups_ready").error("Failed to check rollups backfill: {}", e)
+        return False
+    rollups_state["ready"] = record is not None
+    return rollups_state["ready"]
 
-            logger.info(
-                f"Transactions retrieved for user ID: {user_id} - processing analytics next"
-            )
 
-            if not transactions:
-                continue
+async def track_rollup_writes(*user_ids: str):
+    """Have the rollups backfill rebuild these users if it has not finished."""
+    if await rollups_ready():
+        return
+    try:
+        await redis_client.sadd(ROLLUP_BACKFILL_KEY, *user_ids)
+    except Exception as e:
+        rate_limited("track_rollup_writes").error(
+            "Failed to track rollup writes for user IDs: {}: {}", user_ids, e
+        )
 
-            total_value = sum(t["transaction_amount"] for t in transactions)
-            average_value = total_value / len(transactions)
 
-            logger.info(f"Total value: {total_value}, Average value: {average_value}")
+async def queue_rollup_repair(*user_ids: str):
+    """Have the next reconciliation run rebuild these users' rollups."""
+    await track_rollup_writes(*user_ids)
+    try:
+        await redis_client.sadd(ROLLUP_REPAIR_KEY, *user_ids)
+    except Exception as e:
+        rate_limited("queue_rollup_repair").error(
+            "Failed to queue rollup repair for user IDs: {}: {}", user_ids, e
+        )
 
-            transactions_by_day = {}
-            for t in transactions:
-                day = t["transaction_date"]
-                if day not in transactions_by_day:
-                    transactions_by_day[day] = 0
-                transactions_by_day[day] += 1
 
-            logger.info(f"Transactions by day: {transactions_by_day}")
+def rebuilding_key(user_id: str) -> str:
+    return ROLLUP_REBUILDING_KEY.format(user_id=user_id)
 
-            highest_transactions_day = max(
-                transactions_by_day, key=transactions_by_day.get
-            )
 
-            debit_total = sum(
-                t["transaction_amount"]
-                for t in transactions
-                if t["transaction_type"] == "debit"
-            )
-            credit_total = sum(
-                t["transaction_amount"]
-                for t in transactions
-                if t["transaction_type"] == "credit"
+async def repair_if_rebuilt(user_ids: list):
+    """
+    Queue a repair for users whose rollups a rebuild may have replaced while
+    a write to them was landing.
+    """
+    keys = [rebuilding_key(user_id) for user_id in user_ids]
+    try:
+        flags = await redis_client.mget(keys)
+    except Exception as e:
+        rate_limited("repair_if_rebuilt").error(
+            "Failed to check rollup rebuilds for user IDs: {}: {}", user_ids, e
+        )
+        return
+    racing = [user_id for user_id, flag in zip(user_ids, flags) if flag]
+    if racing:
+        await queue_rollup_repair(*racing)
+
+
+def add_rollup_delta(deltas: dict, transaction: dict, sign: int):
+    amount = to_decimal(transaction["transaction_amount"]) * sign
+    key = (transaction["user_id"], day_key(transaction["transaction_date"]))
+    delta = deltas.setdefault(
+        key, {"count": 0, "sum": Decimal(0), "debit_total": 0, "credit_total": 0}
+    )
+    delta["count"] += sign
+    delta["sum"] += amount
+    if transaction["transaction_type"] == "debit":
+        delta["debit_total"] += amount
+    elif transaction["transaction_type"] == "credit":
+        delta["credit_total"] += amount
+
+
+async def update_rollups(removed: list = (), added: list = ()):
+    """
+    Apply transaction writes to the `(user_id, day)` rollups with `$inc`.
+
+    `removed` holds stored documents as they were before an update or delete,
+    `added` the documents as written; an update passes both so only the
+    difference is applied. Failures queue the users for a rebuild instead of
+    failing the write that already happened, as do writes that raced a
+    rebuild of the same user. Users are tracked before the write, so a
+    backfill still running rebuilds them once it is swapped in.
+    """
+    deltas = {}
+    for transaction in removed:
+        add_rollup_delta(deltas, transaction, -1)
+    for transaction in added:
+        add_rollup_delta(deltas, transaction, 1)
+
+    operations = []
+    emptied = []
+    for (user_id, day), delta in deltas.items():
+        if not any(delta.values()):
+            continue
+        increments = {
+            field: Decimal128(value) if isinstance(value, Decimal) else value
+            for field, value in delta.items()
+        }
+        operations.append(
+            UpdateOne(
+                {"user_id": user_id, "day": day},
+                {"$inc": increments, "$setOnInsert": {"_id": rollup_id(user_id, day)}},
+                upsert=True,
             )
+        )
+        if delta["count"] < 0:
+            emptied.append({"user_id": user_id, "day": day})
+    if not operations:
+        return
+
+    user_ids = list({user_id for user_id, _ in deltas})
+    await track_rollup_writes(*user_ids)
+    try:
+        with timed("mongo"):
+            await rollup_collection.bulk_write(operations, ordered=False)
+            if emptied:
+                # Drop days whose last transaction went away
+                await rollup_collection.delete_many(
+                    {"$or": emptied, "count": {"$lte": 0}}
+                )
+    except Exception as e:
+        rate_limited("update_rollups").error(
+            "Failed to update daily rollups for {}: {}", user_ids, e
+        )
+        await queue_rollup_repair(*user_ids)
+        return
+    await repair_if_rebuilt(user_ids)
+
+
+def day_expression(field: str = "$transaction_date") -> dict:
+    """Aggregation counterpart of `day_key`."""
+    return {
+        "$cond": [
+            {"$eq": [{"$type": field}, "date"]},
+            {"$dateToString": {"format": "%Y-%m-%d", "date": field}},
+            {"$substrCP": [field, 0, 10]},
+        ]
+    }
+
+
+def date_range_match(start: datetime, end: datetime, inclusive: bool = False) -> dict:
+    """
+    Transactions dated in `[start, end)`, or `[start, end]` if `inclusive`;
+    dates not yet backfilled to BSON dates are ISO strings.
+    """
+    upper = "$lte" if inclusive else "$lt"
+    return {
+        "$or": [
+            {"transaction_date": {"$gte": start, upper: end}},
+            {
+                "transaction_date": {
+                    "$gte": start.isoformat(timespec="microseconds"),
+                    upper: end.isoformat(timespec="microseconds"),
+                }
+            },
+        ]
+    }
+
+
+def amount_if_type(transaction_type: str) -> dict:
+    return {
+        "$cond": [
+            {"$eq": ["$transaction_type", transaction_type]},
+            "$transaction_amount",
+            0,
+        ]
+    }
 
-            logger.info(f"Debit total: {debit_total}, Credit total: {credit_total}")
 
-            analytics_data = {
-                "user_id": user_id,
-                "average_transaction_value": average_value,
-                "highest_transactions_day": highest_transactions_day,
-                "debit_total": debit_total,
-                "credit_total": credit_total,
-                "last_updated": datetime.now(),
+def rollup_build_pipeline(match: dict) -> list:
+    """Group raw transactions into rollup documents, keyed like `rollup_id`."""
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {"user_id": "$user_id", "day": day_expression()},
+                "count": {"$sum": 1},
+                "sum": {"$sum": "$transaction_amount"},
+                "debit_total": {"$sum": amount_if_type("debit")},
+                "credit_total": {"$sum": amount_if_type("credit")},
+            }
+        },
+        {
+            "$project": {
+                "user_id": "$_id.user_id",
+                "day": "$_id.day",
+                **{field: 1 for field in ROLLUP_FIELDS},
             }
+        },
+    ]
+
+
+def rollup_analytics_pipeline(match: dict) -> list:
+    """One analytics state per user from its rollups, the user ID as `_id`."""
+    return [
+        {"$match": {**match, "count": {"$gt": 0}}},
+        {
+            "$group": {
+                "_id": "$user_id",
+                "transaction_count": {"$sum": "$count"},
+                "transaction_sum": {"$sum": "$sum"},
+                "debit_total": {"$sum": "$debit_total"},
+                "credit_total": {"$sum": "$credit_total"},
+                # Ties go to the earliest day
+                "highest_transactions_day": {
+                    "$top": {"sortBy": {"count": -1, "day": 1}, "output": "$day"}
+                },
+            }
+        },
+    ]
+
+
+async def analytics_states(match: dict):
+    """
+    Cursor over the analytics states of the users in `match`, as from
+    `rollup_analytics_pipeline`. Until the rollups are ready the same states
+    are grouped from raw transactions.
+    """
+    if await rollups_ready():
+        return rollup_collection.aggregate(rollup_analytics_pipeline(match))
+    return transaction_collection.aggregate(
+        [*rollup_build_pipeline(match), *rollup_analytics_pipeline({})],
+        allowDiskUse=True,
+    )
+
+
+def day_start(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def range_analytics_pipeline(
+    user_id: str, start: datetime, end: datetime
+) -> list:
+    """
+    Analytics state of the transactions dated in `[start, end]`, naive UTC,
+    run on the transactions collection. The whole days in between come from
+    their rollups; only the partial first and last days are grouped from raw
+    transactions, all of them until the rollups are ready.
+    """
+    first_day = day_start(start)
+    if first_day < start:
+        first_day += timedelta(days=1)
+    last_day = day_start(end)
+    if first_day >= last_day or not await rollups_ready():
+        return [
+            *rollup_build_pipeline(
+                {"user_id": user_id, **date_range_match(start, end, inclusive=True)}
+            ),
+            *rollup_analytics_pipeline({}),
+        ]
+
+    edges = [date_range_match(last_day, end, inclusive=True)]
+    if start < first_day:
+        edges.append(date_range_match(start, first_day))
+    whole_days = {"$gte": day_key(first_day), "$lt": day_key(last_day)}
+    return [
+        *rollup_build_pipeline({"user_id": user_id, "$or": edges}),
+        {
+            "$unionWith": {
+                "coll": FIDO_DAILY_ROLLUP_COLLECTION,
+                "pipeline": [{"$match": {"user_id": user_id, "day": whole_days}}],
+            }
+        },
+        *rollup_analytics_pipeline({}),
+    ]
+
+
+def analytics_from_state(state: dict) -> dict:
+    # Sums over Decimal128 amounts come back as Decimal128
+    return {
+        "average_transaction_value": to_float(state["transaction_sum"])
+        / state["transaction_count"],
+        "highest_transactions_day": state["highest_transactions_day"],
+        "debit_total": to_float(state["debit_total"]),
+        "credit_total": to_float(state["credit_total"]),
+    }
+
+
+def analytics_write(user_id: str, state: dict = None):
+    """Build the upsert for a user's state, or a delete once nothing is left."""
+    if not state:
+        logger.info(f"No transactions left, analytics removed for user ID: {user_id}")
+        return DeleteOne({"user_id": user_id})
+
+    analytics_data = {
+        "user_id": user_id,
+        "transaction_count": state["transaction_count"],
+        "transaction_sum": to_float(state["transaction_sum"]),
+        **analytics_from_state(state),
+        "last_updated": datetime.now(),
+    }
+    return UpdateOne(
+        {"user_id": user_id},
+        {
+            "$set": analytics_data,
+            "$unset": {"transactions_by_day": "", "watermark": ""},
+        },
+        upsert=True,
+    )
+
+
+class AnalyticsBatchWriter:
+    """
+    Collect per-user analytics writes and flush them with unordered
+    `bulk_write` batches, then bump the users' cache generations.
+    """
+
+    def __init__(self, batch_size: int = ANALYTICS_BULK_WRITE_SIZE):
+        self.batch_size = batch_size
+        self.operations = []
+        self.user_ids = []
+        self.written = 0
 
-            logger.info(f"Analytics data computed for user ID: {user_id}")
+    async def add(self, user_id: str, operation):
+        self.operations.append(operation)
+        self.user_ids.append(user_id)
+        if len(self.operations) >= self.batch_size:
+            await self.flush()
 
-            await analytics_collection.update_one(
-                {"user_id": user_id}, {"$set": analytics_data}, upsert=True
+    async def flush(self):
+        if not self.operations:
+            return
+        # Swap before awaiting so concurrent adds start a fresh batch
+        operations, self.operations = self.operations, []
+        user_ids, self.user_ids = self.user_ids, []
+
+        try:
+            await check_fencing_token()
+            await analytics_collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Leave them flagged so the next run retries them
+            await mark_users_dirty(*user_ids)
+            raise
+        await bump_cache_generation(*user_ids)
+        self.written += len(operations)
+
+
+async def rebuild_rollups(user_ids: list):
+    """
+    Recompute a batch of users' rollups from their raw transactions.
+
+    Used by full runs and to repair rollups after a failed update. An `$inc`
+    landing between the aggregation and the insert would be lost, so the
+    users are flagged meanwhile and `update_rollups` queues such writes'
+    users for another rebuild. A scheduled run whose leader was replaced
+    while it aggregated stops before deleting, so its older view never
+    replaces the new leader's rollups.
+    """
+    keys = [rebuilding_key(user_id) for user_id in user_ids]
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.set(key, 1, ex=ROLLUP_REBUILD_TTL)
+        await pipe.execute()
+    try:
+        rollups = await transaction_collection.aggregate(
+            rollup_build_pipeline({"user_id": {"$in": user_ids}}), allowDiskUse=True
+        ).to_list(length=None)
+        await check_fencing_token()
+        await rollup_collection.delete_many({"user_id": {"$in": user_ids}})
+        if rollups:
+            await rollup_collection.insert_many(rollups, ordered=False)
+    finally:
+        # Writes that landed just before the insert may not have checked yet
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.expire(key, ROLLUP_REBUILD_GRACE)
+            await pipe.execute()
+
+
+async def refresh_user_analytics(
+    user_ids: list, writer: AnalyticsBatchWriter, rebuild: bool = False
+):
+    """Recompute a batch of users' analytics documents from their rollups."""
+    # Rollups written before the backfill is swapped in would be replaced
+    if rebuild and await rollups_ready():
+        await rebuild_rollups(user_ids)
+
+    refreshed = set()
+    cursor = await analytics_states({"user_id": {"$in": user_ids}})
+    async for state in cursor:
+        await writer.add(state["_id"], analytics_write(state["_id"], state))
+        refreshed.add(state["_id"])
+
+    for user_id in user_ids:
+        if user_id not in refreshed:
+            await writer.add(user_id, analytics_write(user_id))
+
+
+def processing_key(key: str) -> str:
+    return f"{key}:processing"
+
+
+async def requeue_processing(key: str):
+    """Return users a run took from `key` but never finished to `key`."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.sunionstore(key, [key, processing_key(key)])
+        pipe.delete(processing_key(key))
+        await pipe.execute()
+
+
+async def iter_set_batches(key: str):
+    """
+    Take batches of users from the set `key`. Users flagged mid-run stay in
+    `key` for the next run; taken ones wait in its processing set until the
+    run has written them, so a run that dies leaves them to the next one.
+    """
+    await requeue_processing(key)
+    while True:
+        users = await redis_client.eval(
+            TAKE_BATCH_SCRIPT,
+            2,
+            key,
+            processing_key(key),
+            ANALYTICS_USER_BATCH_SIZE,
+        )
+        if not users:
+            return
+        yield [user_id.decode() for user_id in users]
+
+
+async def iter_shard_user_batches(shard_index: int, shard_count: int):
+    """
+    The shard's users with transactions, in batches. Sorting on the leading
+    key of the `user_date_id` index lets MongoDB answer the `$group` with a
+    DISTINCT_SCAN: one index seek per user instead of reading every
+    transaction, so each shard walks the user IDs, not the collection.
+    """
+    batch = []
+    cursor = transaction_collection.aggregate(
+        [{"$sort": {"user_id": 1}}, {"$group": {"_id": "$user_id"}}],
+        hint="user_date_id",
+    )
+    async for user in cursor:
+        if user_shard(user["_id"], shard_count) != shard_index:
+            continue
+        batch.append(user["_id"])
+        if len(batch) >= ANALYTICS_USER_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def compute_and_store_analytics(
+    incremental: bool = ANALYTICS_INCREMENTAL,
+    shard_index: int = ANALYTICS_SHARD_INDEX,
+    shard_count: int = ANALYTICS_SHARD_COUNT,
+) -> dict:
+    """
+    Run one analytics pass over this process's shard of users.
+
+    Incremental runs refresh only the users flagged dirty since the last run,
+    from their daily rollups; full runs rebuild every user's rollups in the
+    shard from raw transactions first. Batches of users are processed with
+    bounded concurrency and written through bulk upserts. Returns run statistics.
+    """
+    mode = "incremental" if incremental else "full"
+    logger.info(
+        f"Computing and storing analytics data "
+        f"(shard {shard_index}/{shard_count}, {mode})"
+    )
+    clock_started = time.monotonic()
+    writer = AnalyticsBatchWriter()
+    semaphore = asyncio.Semaphore(ANALYTICS_CONCURRENCY)
+    progress = {"users": 0, "failures": 0}
+
+    pending = set()
+
+    async def process_batch(user_ids: list, rebuild: bool):
+        try:
+            await refresh_user_analytics(user_ids, writer, rebuild)
+            progress["users"] += len(user_ids)
+        except Exception as e:
+            logger.error(f"Analytics failed for {len(user_ids)} users: {e}")
+            progress["failures"] += len(user_ids)
+            if incremental:
+                await mark_users_dirty(*user_ids)
+                if rebuild:
+                    await queue_rollup_repair(*user_ids)
+
+    async def spawn(job):
+        # Bounds the jobs in flight; released as each one finishes
+        await semaphore.acquire()
+        task = asyncio.create_task(job)
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        task.add_done_callback(lambda _: semaphore.release())
+
+    async def run(batches, rebuild: bool):
+        async for user_ids in batches:
+            # A deposed leader stops taking batches; the new one has them
+            await check_fencing_token()
+            await spawn(process_batch(user_ids, rebuild))
+
+            elapsed = time.monotonic() - clock_started
+            logger.info(
+                f"Analytics progress: {progress['users']} users, "
+                f"{progress['failures']} failures, "
+                f"{progress['users'] / elapsed:.1f} users/s"
             )
-            logger.info(f"Analytics data updated for user ID: {user_id}")
+
+    taken_from = []
+    try:
+        if incremental:
+            if shard_index == 0:
+                taken_from.append(ROLLUP_REPAIR_KEY)
+                await run(iter_set_batches(ROLLUP_REPAIR_KEY), rebuild=True)
+                await asyncio.gather(*pending)
+            taken_from.append(dirty_users_key(shard_index))
+            await run(iter_set_batches(dirty_users_key(shard_index)), rebuild=False)
+        else:
+            await run(iter_shard_user_batches(shard_index, shard_count), rebuild=True)
+
+        await asyncio.gather(*pending)
+        await writer.flush()
+        # Every taken user is now written, or flagged again after failing
+        if taken_from:
+            await redis_client.delete(*(processing_key(key) for key in taken_from))
 
     except Exception as e:
         logger.error("An error occurred while computing and storing analytics data", e)
+        record_analytics_run(mode, "failed", time.monotonic() - clock_started, progress)
         raise ServiceError()
 
+    elapsed = time.monotonic() - clock_started
+    record_analytics_run(mode, "ok", elapsed, progress)
+    summary = {
+        **progress,
+        "written": writer.written,
+        "duration_seconds": round(elapsed, 3),
+        "users_per_second": round(progress["users"] / elapsed, 1) if elapsed else 0,
+    }
+    logger.info(f"Analytics run finished: {summary}")
+    return summary
 
-async def retrieve_transaction_analytics(user_id: str) -> AnalyticsModel:
-    cache_key = f"transaction_analytics:{user_id}"
-    cached_data = redis_client.get(cache_key)
 
-    if cached_data:
-        logger.info(f"Cache hit for transaction analytics of user ID: {user_id}")
-        return json.loads(cached_data)
+async def retrieve_transaction_analytics(user_id: str) -> dict:
+    return await cached_load(
+        user_id,
+        analytics_cache_key(user_id),
+        lambda: fetch_transaction_analytics_from_db(user_id),
+    )
 
-    logger.info(f"Cache miss for transaction analytics of user ID: {user_id}")
 
-    analytics = await analytics_collection.find_one({"user_id": user_id})
+async def fetch_transaction_analytics_from_db(user_id: str) -> dict:
+    sampled().info("Cache miss for transaction analytics of user ID: {}", user_id)
+
+    analytics = await measure(
+        "mongo",
+        analytics_collection.find_one({"user_id": user_id}, ANALYTICS_STATE_PROJECTION),
+    )
     if not analytics:
         try:
-            analytics = await retrieve_live_transaction_analytics(user_id)
+            live_analytics = await aggregate_rollup_analytics(user_id)
         except EntityDoesNotExistError as e:
             logger.error(f"Transaction analytics not found for user ID: {user_id}")
             raise EntityDoesNotExistError(
                 f"Transaction analytics not found for user ID {user_id}"
             )
+        analytics = {
+            "user_id": user_id,
+            **live_analytics,
+            "last_updated": datetime.now(),
+        }
+    return analytics_document(analytics)
+
 
-    analytics["_id"] = str(analytics["_id"])
-    analytics["last_updated"] = analytics["last_updated"].isoformat()
-    redis_client.setex(cache_key, CACHE_EXPIRATION, json.dumps(analytics))
+def analytics_document(analytics: dict) -> dict:
+    # Validate before caching so a malformed document is never served from cache
+    with timed("validation"):
+        return AnalyticsModel(**analytics).model_dump(mode="json", by_alias=True)
+
+
+async def retrieve_transaction_analytics_many(user_ids: list) -> dict:
+    """
+    Analytics for several users at once, by user ID. Each entry has a
+    "status" of "found" with the "analytics", or "not_found" with an "error",
+    so one unknown user does not fail the whole batch.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    analytics = await cached_load_many(
+        {user_id: analytics_cache_key(user_id) for user_id in user_ids},
+        fetch_transaction_analytics_many_from_db,
+    )
+    return {
+        user_id: (
+            {"status": "found", "analytics": analytics[user_id]}
+            if user_id in analytics
+            else {
+                "status": "not_found",
+                "error": f"Transaction analytics not found for user ID {user_id}",
+            }
+        )
+        for user_id in user_ids
+    }
+
+
+async def fetch_transaction_analytics_many_from_db(user_ids: list) -> dict:
+    """
+    Stored analytics for `user_ids` in one query, falling back to one rollup
+    aggregation for the users the scheduled job has not reached yet.
+    """
+    sampled().info("Cache miss for transaction analytics of {} users", len(user_ids))
+
+    documents = {}
+    with timed("mongo"):
+        cursor = analytics_collection.find(
+            {"user_id": {"$in": user_ids}}, ANALYTICS_STATE_PROJECTION
+        )
+        async for analytics in cursor:
+            documents[analytics["user_id"]] = analytics
+
+        remaining = [user_id for user_id in user_ids if user_id not in documents]
+        if remaining:
+            cursor = await analytics_states({"user_id": {"$in": remaining}})
+            async for state in cursor:
+                documents[state["_id"]] = {
+                    "user_id": state["_id"],
+                    **analytics_from_state(state),
+                    "last_updated": datetime.now(),
+                }
+
+    return {
+        user_id: analytics_document(analytics)
+        for user_id, analytics in documents.items()
+    }
 
-    return AnalyticsModel(**analytics)
 
 # For when scheduled task yields no result
 async def retrieve_live_transaction_analytics(
     user_id: str, start_date: datetime = None, end_date: datetime = None
 ):
-    query = {"user_id": user_id}
-    if start_date and end_date:
-        query["transaction_date"] = {
-            "$gte": start_date.isoformat(timespec="microseconds"),
-            "$lte": end_date.isoformat(timespec="microseconds"),
-        }
-
-    logger.info(f"Analytics query: `{query}`")
+    if not (start_date and end_date):
+        return await aggregate_rollup_analytics(user_id)
+    # Offsets naming the same instants share one cache entry
+    start_date, end_date = utc_naive(start_date), utc_naive(end_date)
+    return await cached_load(
+        user_id,
+        analytics_range_cache_key(user_id, start_date, end_date),
+        lambda: aggregate_rollup_analytics(user_id, start_date, end_date),
+    )
 
-    transactions = await transaction_collection.find(query).to_list(length=None)
 
-    logger.info(
-        f"Transactions retrieved for user ID: {user_id} - processing analytics next"
-    )
+async def aggregate_rollup_analytics(
+    user_id: str, start_date: datetime = None, end_date: datetime = None
+):
+    """
+    Analytics over the transactions dated from `start_date` to `end_date`
+    inclusive, mostly read from daily rollups so the cost grows with days
+    rather than transactions (see `range_analytics_pipeline`).
+    """
+    if start_date and end_date:
+        pipeline = await range_analytics_pipeline(
+            user_id, utc_naive(start_date), utc_naive(end_date)
+        )
+        logger.debug("Analytics pipeline: `{}`", pipeline)
+        cursor = transaction_collection.aggregate(pipeline)
+    else:
+        cursor = await analytics_states({"user_id": user_id})
+    result = await measure("mongo", cursor.to_list(length=1))
 
-    if not transactions:
+    if not result:
         raise EntityDoesNotExistError(
             f"Transaction analytics not found for user ID {user_id} - Please check time range e.g 2024-10-08T01:05:37.574299"
         )
 
-    total_value = sum(t["transaction_amount"] for t in transactions)
-    average_value = total_value / len(transactions)
+    analytics = analytics_from_state(result[0])
 
-    logger.info(f"Total value: {total_value}, Average value: {average_value}")
+    logger.debug("Live analytics computed for user ID: {}: {}", user_id, analytics)
 
-    transactions_by_day = {}
-    for t in transactions:
-        day = t["transaction_date"]
-        if day not in transactions_by_day:
-            transactions_by_day[day] = 0
-        transactions_by_day[day] += 1
+    return analytics
 
-    logger.info(f"Transactions by day: {transactions_by_day}")
 
-    highest_transactions_day = max(transactions_by_day, key=transactions_by_day.get)
+SERIES_GRANULARITIES = ("hour", "day", "week", "month")
 
-    debit_total = sum(
-        t["transaction_amount"]
-        for t in transactions
-        if t["transaction_type"] == "debit"
-    )
-    credit_total = sum(
-        t["transaction_amount"]
-        for t in transactions
-        if t["transaction_type"] == "credit"
+
+def series_zone(tz: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise InvalidOperationError(f"Unknown time zone: {tz}")
+
+
+def bucket_floor(moment: datetime, granularity: str, zone: ZoneInfo) -> datetime:
+    """Start of the bucket holding `moment`, in local time; weeks start Monday."""
+    local = moment.astimezone(zone)
+    if granularity == "hour":
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start: datetime, granularity: str, zone: ZoneInfo) -> datetime:
+    if granularity == "hour":
+        # In UTC, so DST transitions neither skip nor repeat an hour
+        return bucket_floor(
+            start.astimezone(timezone.utc) + timedelta(hours=1), granularity, zone
+        )
+    # Wall-clock arithmetic keeps day, week and month starts at local midnight
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(weeks=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def series_buckets(
+    start_date: datetime, end_date: datetime, granularity: str, zone: ZoneInfo
+) -> list:
+    """`(start, end)` of every bucket from the one holding `start_date` to the
+    one holding `end_date`, as aware local datetimes."""
+    buckets = []
+    start = bucket_floor(start_date, granularity, zone)
+    while start <= end_date:
+        if len(buckets) >= ANALYTICS_SERIES_MAX_BUCKETS:
+            raise InvalidOperationError(
+                f"Series spans more than {ANALYTICS_SERIES_MAX_BUCKETS} {granularity} buckets"
+            )
+        end = next_bucket(start, granularity, zone)
+        buckets.append((start, end))
+        start = end
+    return buckets
+
+
+def utc_naive(moment: datetime) -> datetime:
+    # Stored dates are naive UTC, as are the bucket starts Mongo returns;
+    # naive moments are taken as UTC already
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def series_pipeline(
+    user_id: str, start: datetime, end: datetime, granularity: str, tz: str
+) -> list:
+    """Group a user's transactions in `[start, end)` into buckets in one pass."""
+    bucket = {
+        "date": {"$toDate": "$transaction_date"},
+        "unit": granularity,
+        "timezone": tz,
+    }
+    if granularity == "week":
+        bucket["startOfWeek"] = "monday"
+    return [
+        {
+            "$match": {"user_id": user_id, **date_range_match(start, end)}
+        },
+        {
+            "$group": {
+                "_id": {"$dateTrunc": bucket},
+                "count": {"$sum": 1},
+                "total": {"$sum": "$transaction_amount"},
+                "debit_total": {"$sum": amount_if_type("debit")},
+                "credit_total": {"$sum": amount_if_type("credit")},
+            }
+        },
+    ]
+
+
+def series_bucket(start: datetime, group: dict = None) -> dict:
+    if not group:
+        return {
+            "start": start.isoformat(),
+            "count": 0,
+            "total": 0.0,
+            "average": 0.0,
+            "debit_total": 0.0,
+            "credit_total": 0.0,
+        }
+    total = to_float(group["total"])
+    return {
+        "start": start.isoformat(),
+        "count": group["count"],
+        "total": total,
+        "average": total / group["count"],
+        "debit_total": to_float(group["debit_total"]),
+        "credit_total": to_float(group["credit_total"]),
+    }
+
+
+async def retrieve_analytics_series(
+    user_id: str,
+    start_date: datetime,
+    end_date: datetime,
+    granularity: str = "day",
+    tz: str = "UTC",
+) -> dict:
+    """
+    Per-bucket count, total, average, debit and credit totals from the bucket
+    holding `start_date` to the one holding `end_date`, in time zone `tz`.
+    Naive dates are taken as local to `tz`; empty buckets are included.
+
+    Closed buckets are cached until the user's next write, so a repeated call
+    only aggregates the buckets not cached yet, typically the open one.
+    """
+    if granularity not in SERIES_GRANULARITIES:
+        raise InvalidOperationError(f"Unknown granularity: {granularity}")
+    zone = series_zone(tz)
+    if start_date.tzinfo is None:
+        start_date = start_date.replace(tzinfo=zone)
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=zone)
+    if start_date > end_date:
+        raise InvalidOperationError("start_date must not be after end_date")
+
+    buckets = series_buckets(start_date, end_date, granularity, zone)
+    now = datetime.now(timezone.utc)
+    fields = [utc_naive(start).isoformat() for start, _ in buckets]
+    closed = [field for field, (_, end) in zip(fields, buckets) if end <= now]
+    redis_key, cached = await get_cached_buckets(
+        user_id, analytics_series_cache_key(user_id, granularity, tz), closed
     )
 
-    logger.info(f"Debit total: {debit_total}, Credit total: {credit_total}")
+    missing = [bucket for field, bucket in zip(fields, buckets) if field not in cached]
+    computed = {}
+    if missing:
+        sampled().info(
+            "Aggregating {} of {} {} buckets for user ID: {}",
+            len(missing),
+            len(buckets),
+            granularity,
+            user_id,
+        )
+        pipeline = series_pipeline(
+            user_id,
+            utc_naive(missing[0][0]),
+            utc_naive(missing[-1][1]),
+            granularity,
+            tz,
+        )
+        with timed("mongo"):
+            groups = {
+                group["_id"]: group
+                async for group in transaction_collection.aggregate(pipeline)
+            }
+        for start, _ in missing:
+            computed[utc_naive(start).isoformat()] = series_bucket(
+                start, groups.get(utc_naive(start))
+            )
+        await cache_buckets(
+            redis_key, {field: computed[field] for field in closed if field in computed}
+        )
 
     return {
-        "average_transaction_value": average_value,
-        "highest_transactions_day": highest_transactions_day,
-        "debit_total": debit_total,
-        "credit_total": credit_total,
+        "user_id": user_id,
+        "granularity": granularity,
+        "timezone": tz,
+        "buckets": [cached.get(field) or computed[field] for field in fields],
     }
@@ -1,26 +1,55 @@
-import json
+import base64
+from datetime import datetime
 
+from bson import json_util
 from bson.objectid import ObjectId
 from loguru import logger
+from pydantic import ValidationError
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
 
-from app.config.config import CACHE_EXPIRATION
-from app.config.redis_config import redis_client
+from app.config.config import EXPORT_BATCH_SIZE, HISTORY_PAGE_SIZE
+from app.config.logging import sampled
+from app.crud.analytics_service import (notify_analytics, queue_rollup_repair,
+                                        update_rollups)
 from app.database.database import transaction_collection
 from app.exceptions.exceptions import (EntityDoesNotExistError,
-                                       FidoTransactionAPIError)
-from app.models.transaction_model import TransactionModel
-from app.utils.encryption_utils import decrypt_data
+                                       FidoTransactionAPIError,
+                                       InvalidOperationError)
+from app.models.transaction_model import TransactionModel, TransactionType
+from app.utils.bson_utils import to_decimal128
+from app.utils.cache_utils import (bump_cache_generation, cached_load,
+                                   history_cache_key)
+from app.utils.crypto_service import crypto_service
+from app.utils.request_timing import measure, timed
+from app.utils.serialization import to_jsonable
+
+
+def transaction_document(transaction: TransactionModel) -> dict:
+    """Shape a validated transaction for storage with native BSON types."""
+    document = transaction.model_dump()
+    document["transaction_type"] = transaction.transaction_type.value
+    document["transaction_amount"] = to_decimal128(transaction.transaction_amount)
+    return document
 
 
 async def add_transaction(transaction_data: dict) -> dict:
     try:
-        new_transaction = await transaction_collection.insert_one(transaction_data)
-        logger.info("New record added")
-        created_transaction = await transaction_collection.find_one(
-            {"_id": new_transaction.inserted_id}
+        transaction_data["full_name"] = await crypto_service.encrypt(
+            transaction_data["full_name"]
         )
-        logger.info("Added a transaction record")
-        return transaction_helper(created_transaction)
+        transaction_data["updated_at"] = datetime.now()
+        with timed("mongo"):
+            new_transaction = await transaction_collection.insert_one(transaction_data)
+            created_transaction = await transaction_collection.find_one(
+                {"_id": new_transaction.inserted_id}
+            )
+        await update_rollups(added=[created_transaction])
+        await bump_cache_generation(transaction_data["user_id"])
+        await notify_analytics(transaction_data["user_id"])
+        sampled().info("Added a transaction record")
+        with timed("serialization"):
+            return to_jsonable(transaction_helper(created_transaction))
     except Exception as e:
         logger.error("An error occurred while adding a transaction record", e)
         raise FidoTransactionAPIError(
@@ -28,13 +57,113 @@ async def add_transaction(transaction_data: dict) -> dict:
         )
 
 
+async def add_transactions_bulk(records: list) -> list:
+    """
+    Validate, encrypt and insert one chunk of bulk records, then invalidate
+    caches and flag analytics for the chunk's users, so a request that fails
+    or disconnects part way still leaves every stored chunk accounted for.
+
+    `records` holds `(index, record)` pairs where a record is either a decoded
+    JSON object or a raw NDJSON line. Returns one result per record.
+    """
+    results = []
+    documents = []
+    indexes = []
+    for index, record in records:
+        try:
+            with timed("validation"):
+                if isinstance(record, (bytes, str)):
+                    transaction = TransactionModel.model_validate_json(record)
+                else:
+                    transaction = TransactionModel.model_validate(record)
+        except ValidationError as e:
+            error = "; ".join(format_validation_error(err) for err in e.errors())
+            results.append({"index": index, "status": "invalid", "error": error})
+            continue
+        documents.append(transaction_document(transaction))
+        indexes.append(index)
+
+    if not documents:
+        return results
+
+    # The whole chunk is encrypted in a few batches on the crypto pool
+    encrypted_names = await crypto_service.encrypt_many(
+        [document["full_name"] for document in documents]
+    )
+    updated_at = datetime.now()
+    for document, encrypted_name in zip(documents, encrypted_names):
+        document["full_name"] = encrypted_name
+        document["updated_at"] = updated_at
+
+    failed = {}
+    try:
+        await measure(
+            "mongo", transaction_collection.insert_many(documents, ordered=False)
+        )
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            failed[error["index"]] = error["errmsg"]
+        logger.warning(f"{len(failed)} of {len(documents)} bulk inserts failed")
+    except Exception:
+        # Any part of the chunk may have been stored; rebuild those users'
+        # rollups from raw transactions rather than guess which
+        user_ids = {document["user_id"] for document in documents}
+        await queue_rollup_repair(*user_ids)
+        await finalize_bulk_ingest(user_ids)
+        raise
+
+    for position, (index, document) in enumerate(zip(indexes, documents)):
+        if position in failed:
+            results.append(
+                {"index": index, "status": "failed", "error": failed[position]}
+            )
+        else:
+            results.append(
+                {
+                    "index": index,
+                    "status": "created",
+                    "id": str(document["_id"]),
+                    "user_id": document["user_id"],
+                }
+            )
+
+    await update_rollups(
+        added=[
+            document
+            for position, document in enumerate(documents)
+            if position not in failed
+        ]
+    )
+    await finalize_bulk_ingest(
+        {result["user_id"] for result in results if result["status"] == "created"}
+    )
+    logger.info(f"Bulk chunk inserted: {len(documents) - len(failed)} records")
+    return sorted(results, key=lambda result: result["index"])
+
+
+def format_validation_error(error: dict) -> str:
+    location = ".".join(str(loc) for loc in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+async def finalize_bulk_ingest(user_ids: set):
+    """Invalidate caches and flag analytics once per affected user."""
+    if not user_ids:
+        return
+    await bump_cache_generation(*user_ids)
+    await notify_analytics(*user_ids)
+
+
 async def retrieve_transaction(id: str) -> dict:
     transaction_id = validate_id(id)
-    transaction = await transaction_collection.find_one({"_id": transaction_id})
+    transaction = await measure(
+        "mongo", transaction_collection.find_one({"_id": transaction_id})
+    )
     if transaction:
-        logger.info(f"Transaction found for ID: {id}")
+        sampled().info("Transaction found for ID: {}", id)
         try:
-            return transaction_helper(transaction)
+            with timed("serialization"):
+                return to_jsonable(transaction_helper(transaction))
         except Exception as e:
             logger.error(
                 f"An error occurred while transforming fields in transaction data for ID: {id}",
@@ -48,63 +177,213 @@ async def retrieve_transaction(id: str) -> dict:
         raise EntityDoesNotExistError("Transaction not found.")
 
 
-async def retrieve_transaction_history(user_id: str) -> dict:
-    cache_key = f"transaction_history:{user_id}"
-    cached_data = redis_client.get(cache_key)
+HISTORY_PROJECTION = {
+    "transaction_date": 1,
+    # Converted server-side; decoding Decimal128 in Python dominates large pages
+    "transaction_amount": {"$toDouble": "$transaction_amount"},
+    "transaction_type": 1,
+}
+
+
+def encode_history_cursor(transaction: dict) -> str:
+    position = json_util.dumps(
+        {"d": transaction["transaction_date"], "i": transaction["_id"]}
+    )
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> dict:
+    try:
+        position = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"transaction_date": position["d"], "_id": ObjectId(position["i"])}
+    except Exception:
+        raise InvalidOperationError(f"Invalid history cursor: {cursor}")
+
 
-    if cached_data:
-        logger.info(f"Cache hit for transaction history of user ID: {user_id}")
-        return json.loads(cached_data)
+async def retrieve_transaction_history(
+    user_id: str,
+    cursor: str = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    include_full_name: bool = False,
+) -> dict:
+    """
+    Return one page of a user's history, newest first, along with the cursor
+    of the next (older) page.
 
-    logger.info(f"Cache miss for transaction history of user ID: {user_id}")
+    With `include_full_name`, names are cached encrypted and the page is
+    decrypted on the crypto pool after the cache lookup.
+    """
+    history = await cached_load(
+        user_id,
+        history_cache_key(user_id, cursor, limit, include_full_name),
+        lambda: fetch_transaction_history_from_db(
+            user_id, cursor, limit, include_full_name
+        ),
+    )
+    if not include_full_name:
+        return history
 
-    transactions = await transaction_collection.find({"user_id": user_id}).to_list(
-        length=100
+    # Cached pages are shared, so decrypt into copies
+    names = await crypto_service.decrypt_many(
+        [transaction["full_name"] for transaction in history["transactions"]]
     )
-    res = []
-    if len(transactions) > 0:
-        for transaction in transactions:
-            res.append(transaction_helper(transaction))
+    return {
+        **history,
+        "transactions": [
+            {**transaction, "full_name": name}
+            for transaction, name in zip(history["transactions"], names)
+        ],
+    }
 
-        redis_client.setex(cache_key, CACHE_EXPIRATION, json.dumps(res))
 
-        return res
-    else:
+async def fetch_transaction_history_from_db(
+    user_id: str, cursor: str, limit: int, include_full_name: bool = False
+) -> dict:
+    sampled().info("Cache miss for transaction history of user ID: {}", user_id)
+
+    query = {"user_id": user_id}
+    if cursor:
+        position = decode_history_cursor(cursor)
+        # Seek past the last row served instead of skipping over older pages
+        query["$or"] = [
+            {"transaction_date": {"$lt": position["transaction_date"]}},
+            {
+                "transaction_date": position["transaction_date"],
+                "_id": {"$lt": position["_id"]},
+            },
+        ]
+        if isinstance(position["transaction_date"], datetime):
+            # Dates sort before not-yet-backfilled string dates when descending
+            query["$or"].append({"transaction_date": {"$type": "string"}})
+
+    projection = HISTORY_PROJECTION
+    if include_full_name:
+        projection = {**HISTORY_PROJECTION, "full_name": 1}
+
+    # One extra row tells whether another page follows
+    transactions = await measure(
+        "mongo",
+        transaction_collection.find(query, projection)
+        .sort([("transaction_date", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1),
+    )
+    if not transactions and not cursor:
         raise EntityDoesNotExistError("No transactions found for the given user ID.")
 
+    page = transactions[:limit]
+    res = {
+        "transactions": [
+            transaction_helper(transaction, include_full_name) for transaction in page
+        ],
+        "next_cursor": (
+            encode_history_cursor(page[-1]) if len(transactions) > limit else None
+        ),
+    }
+
+    return res
+
+
+EXPORT_PROJECTION = {
+    "transaction_date": 1,
+    # Exact decimal text, e.g. "250.50", rather than a rounded double
+    "transaction_amount": {"$toString": "$transaction_amount"},
+    "transaction_type": 1,
+}
+
+
+def date_range_query(start_date: datetime = None, end_date: datetime = None):
+    """`$or` over native and not-yet-backfilled string dates in the range."""
+    native, legacy = {}, {}
+    if start_date:
+        native["$gte"] = start_date
+        legacy["$gte"] = start_date.isoformat(timespec="microseconds")
+    if end_date:
+        native["$lte"] = end_date
+        legacy["$lte"] = end_date.isoformat(timespec="microseconds")
+    if not native:
+        return None
+    return [{"transaction_date": native}, {"transaction_date": legacy}]
+
+
+async def iter_transaction_export(
+    user_id: str,
+    start_date: datetime = None,
+    end_date: datetime = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+):
+    """
+    Yield a user's transactions oldest first, in lists of up to `batch_size`,
+    straight off one cursor. The cursor is closed as soon as the consumer
+    stops, e.g. when the client of a streamed export disconnects.
+    """
+    query = {"user_id": user_id}
+    date_range = date_range_query(start_date, end_date)
+    if date_range:
+        query["$or"] = date_range
+
+    cursor = transaction_collection.find(
+        query, EXPORT_PROJECTION, batch_size=batch_size
+    ).sort([("transaction_date", ASCENDING), ("_id", ASCENDING)])
+    try:
+        batch = []
+        async for transaction in cursor:
+            batch.append(transaction)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        await cursor.close()
+
 
 async def update_transaction(id: str, data: dict):
     transaction_id = validate_id(id)
     if len(data) < 1:
         return False
-    transaction = await transaction_collection.find_one({"_id": transaction_id})
-    if transaction:
-        updated_transaction = await transaction_collection.update_one(
-            {"_id": ObjectId(id)}, {"$set": data}
-        )
-        if updated_transaction:
-            # Invalidate the cache for the user
-            user_id = transaction["user_id"]
-            cache_key = f"transaction_history:{user_id}"
-            redis_client.delete(cache_key)
-            logger.info(f"Cache invalidated for user ID: {user_id}")
-            return True
-        return False
-    else:
+    if "transaction_amount" in data:
+        data["transaction_amount"] = to_decimal128(data["transaction_amount"])
+    if "transaction_type" in data:
+        data["transaction_type"] = TransactionType(data["transaction_type"]).value
+    data["updated_at"] = datetime.now()
+    # The document as this update found it, so concurrent updates of the same
+    # transaction each take back only the values they replaced
+    transaction = await measure(
+        "mongo",
+        transaction_collection.find_one_and_update(
+            {"_id": transaction_id},
+            {"$set": data},
+            return_document=ReturnDocument.BEFORE,
+        ),
+    )
+    if not transaction:
         raise EntityDoesNotExistError("No transactions found for the given user ID.")
 
+    await update_rollups(removed=[transaction], added=[{**transaction, **data}])
+    await notify_analytics(transaction["user_id"])
+
+    # Invalidate the cache for the user
+    await bump_cache_generation(transaction["user_id"])
+    return True
+
 
 async def delete_transaction(id: str):
     transaction_id = validate_id(id)
-    transaction = await transaction_collection.find_one({"_id": transaction_id})
-    if transaction:
-        await transaction_collection.delete_one({"_id": ObjectId(id)})
-        return True
-    else:
+    # Only the delete that removed the document takes it out of the rollups
+    transaction = await measure(
+        "mongo", transaction_collection.find_one_and_delete({"_id": transaction_id})
+    )
+    if not transaction:
         raise EntityDoesNotExistError(
             f"No transactions found for the given user ID: {id}"
         )
 
+    await update_rollups(removed=[transaction])
+    await bump_cache_generation(transaction["user_id"])
+    await notify_analytics(transaction["user_id"])
+    return True
+
 
 def validate_id(id: str) -> ObjectId:
     try:
@@ -114,11 +393,17 @@ def validate_id(id: str) -> ObjectId:
         raise EntityDoesNotExistError(f"Transaction id: {id} is Not Found")
 
 
-def transaction_helper(transaction: TransactionModel) -> dict:
-    return {
-        "id": str(transaction["_id"]),
-        # "full_name": decrypt_data(transaction["full_name"]),
+def transaction_helper(
+    transaction: TransactionModel, include_full_name: bool = False
+) -> dict:
+    """API shape of a transaction; BSON values are converted by the serializer."""
+    res = {
+        "id": transaction["_id"],
         "transaction_date": transaction["transaction_date"],
         "transaction_amount": transaction["transaction_amount"],
         "transaction_type": transaction["transaction_type"],
     }
+    if include_full_name:
+        # Still encrypted; decrypted in batches by the caller
+        res["full_name"] = transaction["full_name"]
+    return res
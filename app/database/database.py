@@ -1,13 +1,20 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from app.config.config import (FIDO_ANALYTICS_COLLECTION,
+                               FIDO_DAILY_ROLLUP_COLLECTION,
                                FIDO_TRANSACTIONS_COLLECTION, MONGO_DB_NAME,
                                MONGODB_URI)
+from app.utils.metrics import mongo_command_listener
+
+# Applied schema migrations, see app/database/migrations.py
+MIGRATIONS_COLLECTION = "_migrations"
 
 
 class DBSessionManager:
     def __init__(self, uri: str, database_name: str):
-        self.client = AsyncIOMotorClient(uri)
+        self.client = AsyncIOMotorClient(
+            uri, event_listeners=[mongo_command_listener]
+        )
         self.db = self.client[database_name]
 
 
@@ -26,3 +33,9 @@ transaction_collection = mongodb_session_manager.get_collection(
 )
 
 analytics_collection = mongodb_session_manager.get_collection(FIDO_ANALYTICS_COLLECTION)
+
+rollup_collection = mongodb_session_manager.get_collection(
+    FIDO_DAILY_ROLLUP_COLLECTION
+)
+
+migrations_collection = mongodb_session_manager.get_collection(MIGRATIONS_COLLECTION)
@@ -0,0 +1,502 @@
+"""
+Versioned schema migrations and declared indexes.
+
+Applied migrations are recorded in the `_migrations` collection, so running
+them again (on every startup, or from several workers at once) is a no-op. A
+running migration keeps its claim alive with a heartbeat and checkpoints its
+progress there; a claim whose heartbeat stopped is taken over on a later
+startup, resuming from the last checkpoint.
+
+    python -m app.database.migrations migrate
+    python -m app.database.migrations status
+    python -m app.database.migrations explain
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from loguru import logger
+from pymongo import (ASCENDING, DESCENDING, IndexModel, ReturnDocument,
+                     UpdateOne)
+from pymongo.errors import DuplicateKeyError
+
+from app.config.config import (BACKFILL_BATCH_SIZE, FIDO_ANALYTICS_COLLECTION,
+                               FIDO_DAILY_ROLLUP_COLLECTION,
+                               FIDO_TRANSACTIONS_COLLECTION,
+                               MIGRATION_HEARTBEAT_INTERVAL,
+                               MIGRATION_STALE_AFTER)
+from app.config.redis_config import redis_client
+from app.crud.analytics_service import (ROLLUP_BACKFILL_KEY,
+                                        ROLLUP_BACKFILL_VERSION,
+                                        ROLLUPS_READY_RECHECK,
+                                        AnalyticsBatchWriter, iter_set_batches,
+                                        processing_key, rebuild_rollups,
+                                        refresh_user_analytics,
+                                        rollup_build_pipeline)
+from app.database.database import (MIGRATIONS_COLLECTION,
+                                   mongodb_session_manager)
+from app.utils.bson_utils import to_datetime, to_decimal128
+
+# Rollups are backfilled here, then renamed over the live collection
+ROLLUP_STAGING_COLLECTION = f"{FIDO_DAILY_ROLLUP_COLLECTION}_staging"
+# Longer than any process takes to notice the backfilled rollups are ready
+ROLLUPS_READY_GRACE = 10 * ROLLUPS_READY_RECHECK
+
+INDEXES = {
+    FIDO_TRANSACTIONS_COLLECTION: [
+        # history pages, exports and per-user rollup rebuilds
+        IndexModel(
+            [
+                ("user_id", ASCENDING),
+                ("transaction_date", DESCENDING),
+                ("_id", DESCENDING),
+            ],
+            name="user_date_id",
+        ),
+    ],
+    FIDO_ANALYTICS_COLLECTION: [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    FIDO_DAILY_ROLLUP_COLLECTION: [
+        # one document per user and day; also serves day-range analytics
+        IndexModel(
+            [("user_id", ASCENDING), ("day", ASCENDING)],
+            name="user_day_unique",
+            unique=True,
+        ),
+    ],
+}
+
+# Representative query shapes issued from app/crud, checked by `explain`
+QUERY_SHAPES = [
+    (
+        "transaction history page",
+        FIDO_TRANSACTIONS_COLLECTION,
+        {"user_id": "user123"},
+        [("transaction_date", DESCENDING), ("_id", DESCENDING)],
+    ),
+    (
+        "history export date range",
+        FIDO_TRANSACTIONS_COLLECTION,
+        {
+            "user_id": "user123",
+            "transaction_date": {
+                "$gte": datetime(2024, 10, 8),
+                "$lte": datetime(2024, 11, 8),
+            },
+        },
+        [("transaction_date", ASCENDING), ("_id", ASCENDING)],
+    ),
+    (
+        "live analytics day range",
+        FIDO_DAILY_ROLLUP_COLLECTION,
+        {"user_id": "user123", "day": {"$gte": "2024-10-08", "$lte": "2024-11-08"}},
+        None,
+    ),
+    ("analytics lookup", FIDO_ANALYTICS_COLLECTION, {"user_id": "user123"}, None),
+]
+
+MIGRATIONS = []
+
+# Keeps background online migrations referenced until they finish
+online_migrations = set()
+
+# Identifies this process's claims in `_migrations`
+MIGRATION_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class MigrationClaimLost(Exception):
+    """Another process took over a migration this process was running."""
+
+
+class MigrationRun:
+    """
+    This process's claim on one migration. `progress` holds what the last
+    checkpoint recorded, empty unless resuming a run that was interrupted.
+    """
+
+    def __init__(self, db, version: int, progress: dict = None):
+        self.collection = db[MIGRATIONS_COLLECTION]
+        self.version = version
+        self.progress = dict(progress or {})
+
+    async def checkpoint(self, **progress):
+        """Record progress and refresh the heartbeat."""
+        self.progress.update(progress)
+        result = await self.collection.update_one(
+            {"_id": self.version, "owner": MIGRATION_OWNER},
+            {"$set": {"heartbeat_at": datetime.now(), "progress": self.progress}},
+        )
+        if not result.matched_count:
+            raise MigrationClaimLost(
+                f"Migration {self.version} was taken over by another process"
+            )
+
+    async def keep_alive(self):
+        """Heartbeat through steps too long to checkpoint in between."""
+        while True:
+            await asyncio.sleep(MIGRATION_HEARTBEAT_INTERVAL)
+            try:
+                await self.checkpoint()
+            except MigrationClaimLost as e:
+                logger.warning(str(e))
+                return
+            except Exception as e:
+                logger.error(f"Migration {self.version} heartbeat failed: {e}")
+
+    async def release(self, status: str, **fields):
+        # Without a heartbeat the claim can be taken over right away
+        await self.collection.update_one(
+            {"_id": self.version, "owner": MIGRATION_OWNER},
+            {"$set": {"status": status, "heartbeat_at": None, **fields}},
+        )
+
+
+def migration(version: int, description: str, online: bool = False):
+    """
+    Register a migration; versions are applied in ascending order.
+
+    Online migrations are long-running backfills that are safe to run while the
+    API serves traffic, so startup does not wait for them.
+    """
+
+    def register(func):
+        MIGRATIONS.append((version, description, func, online))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+
+    return register
+
+
+async def ensure_indexes(db):
+    for collection_name, indexes in INDEXES.items():
+        # create_indexes is idempotent for identical specs
+        names = await db[collection_name].create_indexes(indexes)
+        logger.info(f"Indexes ensured on {collection_name}: {names}")
+
+
+@migration(1, "create declared transaction and analytics indexes")
+async def create_initial_indexes(db, run: MigrationRun):
+    await ensure_indexes(db)
+
+
+@migration(
+    2, "store transaction dates as BSON dates and amounts as Decimal128", online=True
+)
+async def backfill_native_transaction_types(db, run: MigrationRun):
+    collection = db[FIDO_TRANSACTIONS_COLLECTION]
+    legacy = {
+        "$or": [
+            {"transaction_date": {"$type": "string"}},
+            {"transaction_amount": {"$type": ["double", "int", "long"]}},
+        ]
+    }
+    # Picks up after the last batch an interrupted run finished
+    last_id = run.progress.get("last_id")
+    converted = run.progress.get("converted", 0)
+    while True:
+        query = dict(legacy)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = (
+            await collection.find(
+                query, {"transaction_date": 1, "transaction_amount": 1}
+            )
+            .sort("_id", ASCENDING)
+            .limit(BACKFILL_BATCH_SIZE)
+            .to_list(length=BACKFILL_BATCH_SIZE)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        requests = []
+        for document in batch:
+            try:
+                converted_fields = {
+                    "transaction_date": to_datetime(document["transaction_date"]),
+                    "transaction_amount": to_decimal128(document["transaction_amount"]),
+                }
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping transaction {document['_id']}: {e}")
+                continue
+            # Matching on the old values leaves concurrently updated documents alone
+            requests.append(
+                UpdateOne(
+                    {
+                        "_id": document["_id"],
+                        "transaction_date": document["transaction_date"],
+                        "transaction_amount": document["transaction_amount"],
+                    },
+                    {"$set": converted_fields},
+                )
+            )
+        if requests:
+            result = await collection.bulk_write(requests, ordered=False)
+            converted += result.modified_count
+        await run.checkpoint(last_id=last_id, converted=converted)
+        logger.info(f"Backfilled {converted} transactions so far")
+
+        # Give live traffic a turn between batches
+        await asyncio.sleep(0.1)
+
+
+async def rebuild_tracked_rollups(run: MigrationRun):
+    async for user_ids in iter_set_batches(ROLLUP_BACKFILL_KEY):
+        await rebuild_rollups(user_ids)
+        await run.checkpoint()
+    await redis_client.delete(processing_key(ROLLUP_BACKFILL_KEY))
+
+
+@migration(
+    ROLLUP_BACKFILL_VERSION,
+    "build daily rollups from existing transactions",
+    online=True,
+)
+async def backfill_daily_rollups(db, run: MigrationRun):
+    """
+    Build the rollups in a staging collection and swap it in with one rename,
+    so no request reads a half-built collection; analytics are computed from
+    raw transactions until this is done (see `rollups_ready`). Live `$inc`s
+    land in the old collection meanwhile, and the staged rollups may or may
+    not include a given write, so the users written to, tracked under
+    ROLLUP_BACKFILL_KEY, are rebuilt from raw transactions after the swap.
+    """
+    stage = run.progress.get("stage")
+    staging = db[ROLLUP_STAGING_COLLECTION]
+    if stage is None:
+        await db[FIDO_TRANSACTIONS_COLLECTION].aggregate(
+            [*rollup_build_pipeline({}), {"$out": ROLLUP_STAGING_COLLECTION}],
+            allowDiskUse=True,
+        ).to_list(length=None)
+        await staging.create_indexes(INDEXES[FIDO_DAILY_ROLLUP_COLLECTION])
+        stage = "built"
+        await run.checkpoint(stage=stage)
+        logger.info("Daily rollups built from existing transactions")
+
+    if stage == "built":
+        # Gone already if a run was interrupted right after renaming it
+        names = await db.list_collection_names(
+            filter={"name": ROLLUP_STAGING_COLLECTION}
+        )
+        if names:
+            await staging.rename(FIDO_DAILY_ROLLUP_COLLECTION, dropTarget=True)
+        stage = "swapped"
+        await run.checkpoint(stage=stage)
+
+    if stage == "swapped":
+        await rebuild_tracked_rollups(run)
+        stage = "ready"
+        await run.checkpoint(stage=stage)
+        logger.info("Daily rollups ready")
+
+    # Writers that found the rollups not ready just before they were may still
+    # have tracked users since
+    await asyncio.sleep(ROLLUPS_READY_GRACE)
+    await rebuild_tracked_rollups(run)
+
+
+@migration(4, "recompute analytics folded from per-user watermarks", online=True)
+async def recompute_watermark_analytics(db, run: MigrationRun):
+    """
+    The watermark fold skipped transactions stamped before, but committed
+    after, a run's watermark. Daily rollups replaced the fold; recompute the
+    analytics documents it left, which still carry its state.
+    """
+    collection = db[FIDO_ANALYTICS_COLLECTION]
+    last_id = run.progress.get("last_id")
+    recomputed = run.progress.get("recomputed", 0)
+    while True:
+        query = {"watermark": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = (
+            await collection.find(query, {"user_id": 1})
+            .sort("_id", ASCENDING)
+            .limit(BACKFILL_BATCH_SIZE)
+            .to_list(length=BACKFILL_BATCH_SIZE)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        writer = AnalyticsBatchWriter()
+        user_ids = [document["user_id"] for document in batch]
+        await refresh_user_analytics(user_ids, writer)
+        await writer.flush()
+        recomputed += len(batch)
+        await run.checkpoint(last_id=last_id, recomputed=recomputed)
+        logger.info(f"Recomputed {recomputed} watermark analytics so far")
+
+        # Give live traffic a turn between batches
+        await asyncio.sleep(0.1)
+
+
+async def claim_migration(db, version: int, description: str):
+    """
+    Claim a migration for this process, or take over one whose process died
+    or that failed, keeping its progress. None if it is applied or running.
+    """
+    migrations_collection = db[MIGRATIONS_COLLECTION]
+    now = datetime.now()
+    try:
+        # Claiming the version first keeps concurrent workers from racing
+        await migrations_collection.insert_one(
+            {
+                "_id": version,
+                "description": description,
+                "status": "running",
+                "owner": MIGRATION_OWNER,
+                "started_at": now,
+                "heartbeat_at": now,
+                "progress": {},
+            }
+        )
+        return MigrationRun(db, version)
+    except DuplicateKeyError:
+        pass
+
+    # Matches missing heartbeats too, as on claims released or written by
+    # versions without one
+    record = await migrations_collection.find_one_and_update(
+        {
+            "_id": version,
+            "status": {"$ne": "applied"},
+            "heartbeat_at": {
+                "$not": {"$gte": now - timedelta(seconds=MIGRATION_STALE_AFTER)}
+            },
+        },
+        {"$set": {"status": "running", "owner": MIGRATION_OWNER, "heartbeat_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if record is None:
+        return None
+    logger.warning(
+        f"Taking over migration {version} from {record.get('progress') or 'the start'}"
+    )
+    return MigrationRun(db, version, record.get("progress"))
+
+
+async def run_migration(db, run: MigrationRun, description: str, func):
+    version = run.version
+    logger.info(f"Applying migration {version}: {description}")
+    heartbeat = asyncio.create_task(run.keep_alive())
+    try:
+        await func(db, run)
+    except asyncio.CancelledError:
+        logger.warning(f"Migration {version} interrupted at {run.progress}")
+        await run.release("interrupted")
+        raise
+    except Exception as e:
+        logger.error(f"Migration {version} failed: {e}")
+        # Retried, from its last checkpoint, by the next apply_migrations
+        await run.release("failed", error=str(e))
+        raise
+    finally:
+        heartbeat.cancel()
+
+    await run.release("applied", applied_at=datetime.now())
+    logger.info(f"Migration {version} applied")
+
+
+async def apply_migrations(db=None, wait_for_online: bool = True):
+    db = db if db is not None else mongodb_session_manager.db
+
+    for version, description, func, online in MIGRATIONS:
+        run = await claim_migration(db, version, description)
+        if run is None:
+            continue
+
+        if online and not wait_for_online:
+            task = asyncio.create_task(run_migration(db, run, description, func))
+            online_migrations.add(task)
+            task.add_done_callback(online_migrations.discard)
+            continue
+        await run_migration(db, run, description, func)
+
+    # Declared indexes may have grown since the last migration was written
+    await ensure_indexes(db)
+
+
+async def stop_online_migrations():
+    """Cancel online migrations still running; each records where it stopped."""
+    for task in online_migrations:
+        task.cancel()
+    await asyncio.gather(*online_migrations, return_exceptions=True)
+
+
+async def migration_status(db=None) -> list:
+    db = db if db is not None else mongodb_session_manager.db
+    applied = {
+        record["_id"]: record
+        for record in await db[MIGRATIONS_COLLECTION].find().to_list(length=None)
+    }
+    return [
+        {
+            "version": version,
+            "description": description,
+            "status": applied.get(version, {}).get("status", "pending"),
+            "applied_at": applied.get(version, {}).get("applied_at"),
+        }
+        for version, description, _, _ in MIGRATIONS
+    ]
+
+
+def plan_stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+async def explain_report(db=None) -> list:
+    """Explain each query shape and flag the ones answered by a collection scan."""
+    db = db if db is not None else mongodb_session_manager.db
+    report = []
+    for name, collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        stages = [stage for stage in plan_stages(winning_plan) if stage]
+        report.append(
+            {
+                "query": name,
+                "collection": collection_name,
+                "stages": stages,
+                "covered": "COLLSCAN" not in stages,
+            }
+        )
+    return report
+
+
+async def main(command: str):
+    if command == "migrate":
+        await apply_migrations()
+    elif command == "status":
+        for entry in await migration_status():
+            print(
+                f"{entry['version']:>4}  {entry['status']:<8}  {entry['description']}"
+            )
+    elif command == "explain":
+        report = await explain_report()
+        for entry in report:
+            flag = "ok" if entry["covered"] else "COLLSCAN"
+            print(
+                f"{flag:<9} {entry['collection']:<14} {entry['query']}  {entry['stages']}"
+            )
+        if not all(entry["covered"] for entry in report):
+            sys.exit(1)
+    else:
+        sys.exit(f"Unknown command: {command} (expected migrate, status or explain)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "migrate"))
@@ -1,21 +1,29 @@
 from contextlib import asynccontextmanager
 
-import redis
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from loguru import logger
 from motor.motor_asyncio import AsyncIOMotorClient
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from redis.exceptions import ConnectionError as RedisConnectionError
 
+from app.api.middleware import MetricsMiddleware, TimingMiddleware
+from app.api.responses import ORJSONResponse
 from app.api.routes.router import base_router
 from app.config.config import (API_PREFIX, DEBUG, MONGO_DB_NAME, MONGODB_URI,
-                               PROJECT_NAME, VERSION)
-from app.config.redis_config import redis_client
+                               PROJECT_NAME, RUN_MIGRATIONS_ON_STARTUP,
+                               VERSION)
+from app.config.redis_config import close_redis, redis_client
+from app.database.migrations import apply_migrations, stop_online_migrations
 from app.exceptions.exception_handler import (
     entity_already_exists_error_handler, entity_does_not_exist_error_handler,
     invalid_operation_error_handler, service_error_handler)
 from app.exceptions.exceptions import (EntityAlreadyExistsError,
                                        EntityDoesNotExistError,
                                        InvalidOperationError, ServiceError)
-from app.tasks.scheduler import start_scheduler
+from app.tasks.scheduler import start_scheduler, stop_scheduler
+from app.utils.cache_utils import (start_invalidation_listener,
+                                   stop_invalidation_listener)
+from app.utils.crypto_service import crypto_service
 
 app = FastAPI(title=PROJECT_NAME, debug=DEBUG, version=VERSION)
 
@@ -31,7 +39,11 @@ async def lifespan(app: FastAPI):
         logger.info(MONGODB_URI)
         logger.info("Successfully connected to MongoDB")
 
+        if RUN_MIGRATIONS_ON_STARTUP:
+            await apply_migrations(wait_for_online=False)
+
         await check_redis_connection()
+        start_invalidation_listener()
 
         # start analytics computation scheduler
         start_scheduler()
@@ -40,10 +52,16 @@ async def lifespan(app: FastAPI):
         raise ServiceError("MongoDB connection error")
     yield
 
-    await client.close()
+    await stop_scheduler()
+    # Before the clients close, so interrupted migrations can record progress
+    await stop_online_migrations()
+    client.close()
+    await stop_invalidation_listener()
+    await close_redis()
+    crypto_service.shutdown()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 @app.get("/", tags=["root-ping"])
@@ -51,11 +69,16 @@ async def root():
     return {"message": "Welcome to Fido Transactions API"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 async def check_redis_connection():
     try:
-        redis_client.ping()
+        await redis_client.ping()
         logger.info("Successfully connected to Redis")
-    except redis.ConnectionError as e:
+    except RedisConnectionError as e:
         logger.error(f"Failed to connect to Redis: {e}")
 
 
@@ -65,4 +88,7 @@ app.add_exception_handler(EntityDoesNotExistError, entity_does_not_exist_error_h
 app.add_exception_handler(EntityAlreadyExistsError, entity_already_exists_error_handler)
 app.add_exception_handler(InvalidOperationError, invalid_operation_error_handler)
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TimingMiddleware)
+
 app.include_router(base_router, prefix=API_PREFIX)
@@ -1,9 +1,10 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from bson import ObjectId
 from pydantic import BaseModel, ConfigDict, Field
 
+from app.config.config import ANALYTICS_BATCH_MAX_USERS
 from app.models.transaction_model import PyObjectId
 
 
@@ -33,6 +34,16 @@ class AnalyticsModel(BaseModel):
     )
 
 
+class BatchAnalyticsRequest(BaseModel):
+    user_ids: List[str] = Field(
+        ..., min_length=1, max_length=ANALYTICS_BATCH_MAX_USERS
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={"example": {"user_ids": ["user123", "user456"]}}
+    )
+
+
 def ResponseModel(data, message, code):
     return {
         "data": data,
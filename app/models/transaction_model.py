@@ -5,8 +5,6 @@ from typing import Annotated, List, Optional
 from bson.objectid import ObjectId
 from pydantic import BaseModel, BeforeValidator, ConfigDict, Field
 
-from app.utils.encryption_utils import encrypt_data
-
 
 class TransactionType(str, Enum):
     CREDIT = "credit"
@@ -18,7 +16,7 @@ PyObjectId = Annotated[str, BeforeValidator(str)]
 
 class TransactionModel(BaseModel):
     user_id: str = Field(..., description="Unique identifier for the user")
-    full_name: str = Field(..., description="Full name of the user: encrypted in DB")
+    full_name: str = Field(..., description="Full name of the user: encrypted before it is stored")
     transaction_date: datetime = Field(
         default_factory=datetime.now, description="Date of the transaction"
     )
@@ -27,12 +25,6 @@ class TransactionModel(BaseModel):
         ..., description="Type of transaction: credit or debit"
     )
 
-    def __init__(self, **data):
-        super().__init__(**data)
-
-        if "full_name" in data:
-            self.full_name = encrypt_data(data["full_name"])
-
     model_config = ConfigDict(
         arbitrary_types_allowed=True,
         json_schema_extra={
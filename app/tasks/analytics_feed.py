@@ -0,0 +1,173 @@
+"""
+Keep analytics documents current by following transaction writes:
+
+    python -m app.tasks.analytics_feed
+
+Reads the feed selected by ANALYTICS_FEED. Each batch of events is reduced to
+the users it touches, whose analytics are recomputed from their daily rollups
+and whose cached analytics are invalidated. The feed position is saved only
+after that, so a restart replays at most the last batch; recomputing is
+idempotent, so a replayed event is never counted twice.
+"""
+
+import asyncio
+import os
+import socket
+
+from loguru import logger
+
+from app.config.config import (ANALYTICS_FEED, ANALYTICS_FEED_BATCH_SIZE,
+                               ANALYTICS_FEED_CLAIM_IDLE_MS)
+from app.config.redis_config import close_redis, redis_client
+from app.crud.analytics_service import (ANALYTICS_FEED_STREAM,
+                                        AnalyticsBatchWriter,
+                                        refresh_user_analytics)
+from app.database.database import rollup_collection
+from app.utils.redis_streams import create_group, group_batches
+
+FEED_GROUP = "analytics"
+RESUME_TOKEN_KEY = "analytics:feed:resume_token"
+
+# How long one read waits for new events before yielding what it has
+FEED_WAIT_MS = 1000
+
+
+class RedisStreamFeed:
+    """
+    The `analytics:feed` stream written by `notify_analytics`, read through a
+    consumer group so several updaters can share it. Entries are acknowledged
+    once applied; ones left pending by a consumer that died are claimed after
+    ANALYTICS_FEED_CLAIM_IDLE_MS.
+    """
+
+    def __init__(self, consumer: str = ""):
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+
+    async def setup(self):
+        await create_group(ANALYTICS_FEED_STREAM, FEED_GROUP)
+
+    async def batches(self):
+        async for entries in group_batches(
+            ANALYTICS_FEED_STREAM,
+            FEED_GROUP,
+            self.consumer,
+            ANALYTICS_FEED_BATCH_SIZE,
+            ANALYTICS_FEED_CLAIM_IDLE_MS,
+            FEED_WAIT_MS,
+        ):
+            if entries:
+                yield (
+                    [fields[b"user_id"].decode() for _, fields in entries],
+                    [entry_id for entry_id, _ in entries],
+                )
+
+    async def commit(self, entry_ids: list):
+        await redis_client.xack(ANALYTICS_FEED_STREAM, FEED_GROUP, *entry_ids)
+
+
+class ChangeStreamFeed:
+    """
+    A MongoDB change stream on the daily rollups collection; needs a replica
+    set. Rollups are written after the transactions they count, so an event
+    is only seen once the analytics recomputed from it include the write.
+    Rollups are keyed by user and day (`rollup_id`), so the document key of
+    any event, deletes included, names the user. The resume token is kept in
+    Redis; the stream is reopened after the rollups backfill renames a new
+    collection into place.
+    """
+
+    pipeline = [
+        {
+            "$match": {
+                "operationType": {
+                    "$in": ["insert", "update", "replace", "delete", "invalidate"]
+                }
+            }
+        },
+        {"$project": {"operationType": 1, "documentKey": 1}},
+    ]
+
+    async def setup(self):
+        pass
+
+    async def batches(self):
+        while True:
+            token = await redis_client.get(RESUME_TOKEN_KEY)
+            async for batch in self.stream_batches(token):
+                yield batch
+
+    async def stream_batches(self, token: bytes = None):
+        # start_after, unlike resume_after, also resumes past an invalidate
+        async with rollup_collection.watch(
+            self.pipeline,
+            start_after={"_data": token.decode()} if token else None,
+            max_await_time_ms=FEED_WAIT_MS,
+            batch_size=ANALYTICS_FEED_BATCH_SIZE,
+        ) as stream:
+            invalidated = False
+            while not invalidated:
+                user_ids = []
+                events = 0
+                while events < ANALYTICS_FEED_BATCH_SIZE:
+                    event = await stream.try_next()
+                    if event is None:
+                        break
+                    events += 1
+                    if event["operationType"] == "invalidate":
+                        invalidated = True
+                        break
+                    key = event["documentKey"]["_id"]
+                    # Rollups written before they were keyed by user are left
+                    # to the reconciliation run
+                    if isinstance(key, dict):
+                        user_ids.append(key["user_id"])
+                # The token moves past idle periods too, so keep it current
+                if events or stream.resume_token:
+                    yield user_ids, stream.resume_token
+
+    async def commit(self, resume_token: dict):
+        if resume_token:
+            await redis_client.set(RESUME_TOKEN_KEY, resume_token["_data"])
+
+
+FEEDS = {"redis": RedisStreamFeed, "changestream": ChangeStreamFeed}
+
+
+async def apply_events(user_ids: list):
+    writer = AnalyticsBatchWriter()
+    await refresh_user_analytics(sorted(set(user_ids)), writer)
+    await writer.flush()
+
+
+async def follow_feed(feed):
+    """Apply feed batches until cancelled, resuming from the saved position."""
+    await feed.setup()
+    while True:
+        try:
+            async for user_ids, position in feed.batches():
+                if user_ids:
+                    await apply_events(user_ids)
+                    logger.info(
+                        f"Analytics updated from feed for {len(user_ids)} events"
+                    )
+                await feed.commit(position)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Analytics feed failed, resuming from last position: {e}")
+            await asyncio.sleep(1)
+
+
+async def main():
+    if ANALYTICS_FEED not in FEEDS:
+        logger.info(f"Analytics feed is {ANALYTICS_FEED!r}; nothing to follow")
+        return
+    logger.info(f"Following the {ANALYTICS_FEED} analytics feed")
+    try:
+        await follow_feed(FEEDS[ANALYTICS_FEED]())
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,28 +1,19 @@
-from loguru import logger
+from app.config.logging import sampled
+from app.tasks.task_queue import task
 
+# Run by `python -m app.tasks.worker`; raising hands the task back for a retry
 
+
+@task
 async def update_user_statistics(user_id: str):
-    try:
-        logger.info(f"User statistics updated for user ID: {user_id}")
-    except Exception as e:
-        logger.error(
-            f"An error occurred while updating user statistics for user ID: {user_id}: {e}"
-        )
+    sampled().info("User statistics updated for user ID: {}", user_id)
 
 
+@task
 async def alert_relevant_systems(transaction):
-    try:
-        logger.info(f"Alert sent for transaction ID: {transaction}")
-    except Exception as e:
-        logger.error(
-            f"An error occurred while sending alert for transaction ID: {transaction.transaction_id}: {e}"
-        )
+    sampled().info("Alert sent for transaction ID: {}", transaction)
 
 
+@task
 async def recalculate_credit_scores(user_id: str):
-    try:
-        logger.info(f"Credit score recalculated for user ID: {user_id}")
-    except Exception as e:
-        logger.error(
-            f"An error occurred while recalculating credit score for user ID: {user_id}: {e}"
-        )
+    sampled().info("Credit score recalculated for user ID: {}", user_id)
@@ -0,0 +1,230 @@
+import json
+import os
+import socket
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+from loguru import logger
+
+from app.config.config import SCHEDULER_INSTANCE_ID, SCHEDULER_LEASE_MS
+from app.config.redis_config import redis_client
+
+LEADER_KEY = "scheduler:leader"
+FENCING_TOKEN_KEY = "scheduler:fencing_token"
+LAST_RUN_KEY = "scheduler:last_run"
+
+# Take the lease and hand out the next fencing token in one step, so every
+# leadership term gets a strictly larger token than the one before it
+ACQUIRE_SCRIPT = """
+if redis.call("set", KEYS[1], ARGV[1], "NX", "PX", ARGV[2]) then
+    return redis.call("incr", KEYS[2])
+end
+return false
+"""
+
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Writes from a deposed leader carry an older token and are rejected
+RECORD_RUN_SCRIPT = """
+if tonumber(redis.call("get", KEYS[1])) == tonumber(ARGV[1]) then
+    redis.call("hset", KEYS[2], ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class LeaderElection:
+    """
+    Redis lease deciding which process runs the scheduled jobs.
+
+    Every process campaigns on an interval: the leader extends its lease and
+    the rest try to take it, so a leader that dies or stalls is replaced once
+    its lease expires. Each new term gets a fencing token from a counter that
+    only grows, which is checked before the job's writes and when recording
+    its run.
+    """
+
+    def __init__(self, instance_id: str = "", lease_ms: int = SCHEDULER_LEASE_MS):
+        self.instance_id = (
+            instance_id
+            or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self.lease_ms = lease_ms
+        self.token = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token is not None
+
+    async def campaign(self):
+        """Renew the lease if held, otherwise try to acquire it."""
+        try:
+            if self.is_leader:
+                if await self.renew():
+                    return
+                logger.warning(
+                    f"Scheduler leader {self.instance_id} lost its lease "
+                    f"(token {self.token})"
+                )
+                self.token = None
+
+            token = await redis_client.eval(
+                ACQUIRE_SCRIPT,
+                2,
+                LEADER_KEY,
+                FENCING_TOKEN_KEY,
+                self.instance_id,
+                self.lease_ms,
+            )
+            if token:
+                self.token = int(token)
+                logger.info(
+                    f"Scheduler leader elected: {self.instance_id} (token {self.token})"
+                )
+        except Exception as e:
+            # Without Redis nobody can prove leadership, so step down
+            self.token = None
+            logger.error(f"Scheduler leader election failed: {e}")
+
+    async def renew(self) -> bool:
+        renewed = await redis_client.eval(
+            RENEW_SCRIPT, 1, LEADER_KEY, self.instance_id, self.lease_ms
+        )
+        return bool(renewed)
+
+    async def resign(self):
+        if not self.is_leader:
+            return
+        self.token = None
+        try:
+            await redis_client.eval(RELEASE_SCRIPT, 1, LEADER_KEY, self.instance_id)
+            logger.info(f"Scheduler leader {self.instance_id} resigned")
+        except Exception as e:
+            logger.error(f"Failed to release scheduler lease: {e}")
+
+    async def record_run(self, job_id: str, token: int, run: dict) -> bool:
+        recorded = await redis_client.eval(
+            RECORD_RUN_SCRIPT,
+            2,
+            FENCING_TOKEN_KEY,
+            LAST_RUN_KEY,
+            token,
+            job_id,
+            json.dumps(run, default=str),
+        )
+        return bool(recorded)
+
+
+election = LeaderElection(SCHEDULER_INSTANCE_ID)
+
+# Token of the leadership term the scheduled job running in this context
+# started under; None outside scheduled jobs
+current_fencing_token: ContextVar = ContextVar("current_fencing_token", default=None)
+
+
+class StaleLeaderError(Exception):
+    """A scheduled job kept running after its leader was replaced."""
+
+
+async def check_fencing_token():
+    """
+    Raise StaleLeaderError if the scheduled job running in this context
+    started under a leadership term that has since ended; a no-op outside
+    scheduled jobs.
+
+    Called right before each of the job's writes. MongoDB cannot check a
+    Redis token in the same step as the write, so a leader deposed in
+    between still lands that one write, but never the rest of its run.
+    """
+    token = current_fencing_token.get()
+    if token is None:
+        return
+    current = await redis_client.get(FENCING_TOKEN_KEY)
+    if current is None or int(current) != token:
+        raise StaleLeaderError(
+            f"Fencing token {token} was superseded by {current and int(current)}"
+        )
+
+
+def leader_only(job_id: str):
+    """
+    Run a scheduled job only on the current leader and record when it finished.
+
+    The lease is renewed right before the job starts so a leader that was
+    stalled past its lease does not start a run another process may also start.
+    The job runs with its term's fencing token in `current_fencing_token`, for
+    `check_fencing_token` to guard its writes.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = election.token
+            if token is None or not await election.renew():
+                return None
+
+            started_at = datetime.utcnow()
+            error = None
+            result = None
+            context_token = current_fencing_token.set(token)
+            try:
+                result = await func(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                current_fencing_token.reset(context_token)
+                run = {
+                    "instance_id": election.instance_id,
+                    "fencing_token": token,
+                    "started_at": started_at.isoformat(),
+                    "finished_at": datetime.utcnow().isoformat(),
+                    "result": result,
+                    "error": error,
+                }
+                if not await election.record_run(job_id, token, run):
+                    logger.warning(
+                        f"Discarded {job_id} run from deposed leader "
+                        f"{election.instance_id} (token {token})"
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+async def scheduler_status() -> dict:
+    """Current leader, its lease and the last recorded run of each job."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(LEADER_KEY)
+        pipe.pttl(LEADER_KEY)
+        pipe.get(FENCING_TOKEN_KEY)
+        pipe.hgetall(LAST_RUN_KEY)
+        leader, ttl_ms, token, last_runs = await pipe.execute()
+
+    return {
+        "leader": leader.decode() if leader else None,
+        "lease_remaining_ms": ttl_ms if leader and ttl_ms > 0 else None,
+        "fencing_token": int(token) if token else None,
+        "instance_id": election.instance_id,
+        "is_leader": election.is_leader,
+        "last_runs": {
+            job_id.decode(): json.loads(run) for job_id, run in last_runs.items()
+        },
+    }
@@ -1,35 +1,41 @@
-import json
+import time
 
 from loguru import logger
 
-from app.config.config import CACHE_EXPIRATION
-from app.config.redis_config import redis_client
-from app.crud.transactions_service import (fetch_transaction_analytics_from_db,
-                                           fetch_transaction_history_from_db)
+from app.config.logging import sampled
+from app.utils.cache_utils import (acquire_cache_lock, cache_set,
+                                   release_cache_lock, wait_for_cache)
 
 
-async def refresh_cache(user_id: str):
-    try:
-        logger.info(f"Refreshing cache for user ID: {user_id}")
+async def refresh_cache(token: tuple, loader, wait_for_lock: bool = False):
+    """
+    Recompute one cache entry with `loader` while holding its cross-process lock.
 
-        # Refresh transaction history cache
-        transaction_history = await fetch_transaction_history_from_db(user_id)
-        redis_client.setex(
-            f"transaction_history:{user_id}",
-            CACHE_EXPIRATION,
-            json.dumps(transaction_history),
-        )
+    Background refreshes (`wait_for_lock=False`) give up when another process
+    already holds the lock and log failures instead of raising. Foreground loads
+    wait for that process's result, then compute it themselves if none arrives.
+    """
+    user_id, key, redis_key, _ = token
+    lock_id = await acquire_cache_lock(token)
+    if lock_id is None:
+        if not wait_for_lock:
+            return None
+        value = await wait_for_cache(token)
+        if value is not None:
+            return value
+        logger.warning(f"Timed out waiting for cache refresh of {redis_key}")
 
-        # Refresh transaction analytics cache
-        transaction_analytics = await fetch_transaction_analytics_from_db(user_id)
-        redis_client.setex(
-            f"transaction_analytics:{user_id}",
-            CACHE_EXPIRATION,
-            json.dumps(transaction_analytics),
-        )
-
-        logger.info(f"Cache refreshed for user ID: {user_id}")
+    try:
+        sampled().info("Refreshing cache for user ID: {}: {}", user_id, key)
+        started = time.monotonic()
+        value = await loader()
+        return await cache_set(token, value, compute_time=time.monotonic() - started)
     except Exception as e:
+        if wait_for_lock:
+            raise
         logger.error(
             f"An error occurred while refreshing cache for user ID: {user_id}: {e}"
         )
+    finally:
+        if lock_id is not None:
+            await release_cache_lock(token, lock_id)
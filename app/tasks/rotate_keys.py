@@ -0,0 +1,68 @@
+"""
+Re-encrypt stored full names under the primary key from ENCRYPTION_KEYS:
+
+    python -m app.tasks.rotate_keys
+
+Run after prepending a new key; once it reports nothing left to rotate, the
+old key can be dropped from ENCRYPTION_KEYS.
+"""
+
+import asyncio
+import re
+
+from loguru import logger
+from pymongo import ASCENDING, UpdateOne
+
+from app.config.config import BACKFILL_BATCH_SIZE
+from app.database.database import transaction_collection
+from app.utils.crypto_service import crypto_service
+from app.utils.encryption_utils import PRIMARY_KEY_ID
+
+
+async def rotate_full_names(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Rotate names not yet under the primary key, in `_id` order."""
+    query = {"full_name": {"$not": re.compile(f"^{re.escape(PRIMARY_KEY_ID)}:")}}
+    rotated = 0
+    last_id = None
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        batch = (
+            await transaction_collection.find(batch_query, {"full_name": 1})
+            .sort("_id", ASCENDING)
+            .limit(batch_size)
+            .to_list(length=batch_size)
+        )
+        if not batch:
+            return rotated
+
+        names = await crypto_service.rotate_many(
+            [document["full_name"] for document in batch]
+        )
+        # Match the old ciphertext so a concurrent rewrite is not overwritten
+        await transaction_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": document["_id"], "full_name": document["full_name"]},
+                    {"$set": {"full_name": name}},
+                )
+                for document, name in zip(batch, names)
+            ],
+            ordered=False,
+        )
+        rotated += len(batch)
+        last_id = batch[-1]["_id"]
+        logger.info(f"Rotated {rotated} full names to key {PRIMARY_KEY_ID}")
+
+
+async def main():
+    try:
+        rotated = await rotate_full_names()
+        logger.info(f"Key rotation finished: {rotated} full names re-encrypted")
+    finally:
+        crypto_service.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
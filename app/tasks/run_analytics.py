@@ -0,0 +1,39 @@
+"""
+Run one analytics pass outside the API, e.g. one process per shard:
+
+    python -m app.tasks.run_analytics --shard-index 0 --shard-count 4
+    python -m app.tasks.run_analytics --full
+"""
+import argparse
+import asyncio
+import json
+
+from app.config.config import (ANALYTICS_INCREMENTAL, ANALYTICS_SHARD_COUNT,
+                               ANALYTICS_SHARD_INDEX)
+from app.config.redis_config import close_redis
+from app.crud.analytics_service import compute_and_store_analytics
+
+
+async def main(args: argparse.Namespace):
+    try:
+        summary = await compute_and_store_analytics(
+            incremental=not args.full,
+            shard_index=args.shard_index,
+            shard_count=args.shard_count,
+        )
+        print(json.dumps(summary))
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shard-index", type=int, default=ANALYTICS_SHARD_INDEX)
+    parser.add_argument("--shard-count", type=int, default=ANALYTICS_SHARD_COUNT)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=not ANALYTICS_INCREMENTAL,
+        help="rebuild every user in the shard instead of only dirty users",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -1,11 +1,34 @@
+from datetime import datetime
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from app.config.config import (ANALYTICS_FEED, ANALYTICS_RECONCILE_INTERVAL,
+                               SCHEDULER_RENEW_INTERVAL)
 from app.crud.analytics_service import compute_and_store_analytics
+from app.tasks.leader_election import election, leader_only
 
 scheduler = AsyncIOScheduler()
 
 
-# Schedule the job to run every 15 minutes
+# Every worker runs the scheduler, but only the lease holder executes the jobs
 def start_scheduler():
-    scheduler.add_job(compute_and_store_analytics, "interval", hours=0.025)
+    scheduler.add_job(
+        election.campaign,
+        "interval",
+        seconds=SCHEDULER_RENEW_INTERVAL,
+        next_run_time=datetime.now(),
+        id="leader_election",
+    )
+    # With a feed updating analytics as writes happen, this only reconciles
+    scheduler.add_job(
+        leader_only("compute_and_store_analytics")(compute_and_store_analytics),
+        "interval",
+        seconds=ANALYTICS_RECONCILE_INTERVAL if ANALYTICS_FEED != "off" else 90,
+        id="compute_and_store_analytics",
+    )
     scheduler.start()
+
+
+async def stop_scheduler():
+    scheduler.shutdown(wait=False)
+    await election.resign()
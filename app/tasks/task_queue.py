@@ -0,0 +1,82 @@
+"""
+Durable queue for side effects of transaction writes, on a Redis stream.
+
+Tasks are registered with `@task` and queued by name with JSON arguments.
+`python -m app.tasks.worker` runs them through a consumer group; failures are
+retried with exponential backoff from a sorted set of delayed tasks, and moved
+to a dead-letter stream after TASK_MAX_ATTEMPTS.
+"""
+
+import uuid
+
+from app.config.config import TASK_QUEUE_MAX_DEPTH
+from app.config.logging import rate_limited
+from app.config.redis_config import redis_client
+from app.exceptions.exceptions import ServiceError
+from app.utils.serialization import dumps
+
+TASK_STREAM = "tasks:queue"
+TASK_GROUP = "workers"
+DELAYED_TASKS_KEY = "tasks:delayed"
+DEAD_LETTER_STREAM = "tasks:dead"
+DEAD_LETTER_MAXLEN = 100000
+
+# Task functions by name, filled in by `@task`
+TASKS = {}
+
+
+def task(func):
+    """Register a coroutine function so it can be queued and run by workers."""
+    TASKS[func.__name__] = func
+    return func
+
+
+def task_fields(name: str, args, attempts: int = 0) -> dict:
+    return {
+        "task": name,
+        "args": args if isinstance(args, (bytes, str)) else dumps(list(args)),
+        "attempts": attempts,
+    }
+
+
+def delayed_member(fields: dict) -> str:
+    # The ID keeps identical retries from collapsing into one sorted set member
+    return dumps({**fields, "id": uuid.uuid4().hex}).decode()
+
+
+async def queue_depth() -> int:
+    # Workers delete tasks once handled, so the length is what is still waiting
+    return await redis_client.xlen(TASK_STREAM)
+
+
+async def check_capacity():
+    """Refuse new work while the queue is backed up, before anything is written."""
+    depth = await queue_depth()
+    if depth >= TASK_QUEUE_MAX_DEPTH:
+        rate_limited("task_queue_full").warning(
+            "Task queue is full: {} tasks waiting", depth
+        )
+        raise ServiceError("Too many tasks are queued, please try again later")
+
+
+async def enqueue_many(calls: list):
+    """
+    Queue `(func, *args)` calls in one round trip. A failure is logged rather
+    than raised, as callers have already committed the write they follow.
+    """
+    if not calls:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for func, *args in calls:
+                if TASKS.get(func.__name__) is not func:
+                    raise ValueError(f"{func.__name__} is not a registered task")
+                pipe.xadd(TASK_STREAM, task_fields(func.__name__, args))
+            await pipe.execute()
+    except Exception as e:
+        names = [call[0].__name__ for call in calls]
+        rate_limited("enqueue_many").error("Failed to queue tasks {}: {}", names, e)
+
+
+async def enqueue(func, *args):
+    await enqueue_many([(func, *args)])
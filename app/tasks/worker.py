@@ -0,0 +1,167 @@
+"""
+Run queued tasks outside the API; start as many as the load needs:
+
+    python -m app.tasks.worker --concurrency 16
+
+Workers share the queue through a consumer group, each pulling batches of up
+to TASK_QUEUE_BATCH_SIZE tasks. SIGTERM lets the current batch finish.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+from contextlib import aclosing
+
+from loguru import logger
+
+from app.config.config import (TASK_CLAIM_IDLE_MS, TASK_MAX_ATTEMPTS,
+                               TASK_QUEUE_BATCH_SIZE, TASK_RETRY_BASE_DELAY,
+                               TASK_RETRY_MAX_DELAY, TASK_WORKER_CONCURRENCY)
+from app.config.redis_config import close_redis, redis_client
+from app.tasks import background_tasks  # noqa: F401 (registers the tasks)
+from app.tasks.task_queue import (DEAD_LETTER_MAXLEN, DEAD_LETTER_STREAM,
+                                  DELAYED_TASKS_KEY, TASK_GROUP, TASK_STREAM,
+                                  TASKS, delayed_member, task_fields)
+from app.utils.redis_streams import create_group, group_batches
+from app.utils.serialization import loads
+
+# Move retries that are due back onto the stream, atomically
+PROMOTE_SCRIPT = """
+local due = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, member in ipairs(due) do
+    local task = cjson.decode(member)
+    redis.call("xadd", KEYS[2], "*",
+        "task", task.task, "args", task.args, "attempts", task.attempts)
+    redis.call("zrem", KEYS[1], member)
+end
+return #due
+"""
+
+# How long one read waits for new tasks, which also paces due-retry checks
+READ_WAIT_MS = 1000
+
+
+def retry_delay(attempts: int) -> float:
+    return min(TASK_RETRY_BASE_DELAY * 2 ** (attempts - 1), TASK_RETRY_MAX_DELAY)
+
+
+class TaskWorker:
+    def __init__(self, consumer: str = "", concurrency: int = TASK_WORKER_CONCURRENCY):
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+        self.slots = asyncio.Semaphore(concurrency)
+        self.stopping = asyncio.Event()
+        self.stats = {"done": 0, "retried": 0, "dead": 0}
+
+    async def setup(self):
+        await create_group(TASK_STREAM, TASK_GROUP)
+
+    async def promote_due_retries(self):
+        promoted = await redis_client.eval(
+            PROMOTE_SCRIPT,
+            2,
+            DELAYED_TASKS_KEY,
+            TASK_STREAM,
+            time.time(),
+            TASK_QUEUE_BATCH_SIZE,
+        )
+        if promoted:
+            logger.info(f"{promoted} tasks queued again for retry")
+
+    async def batches(self):
+        await self.promote_due_retries()
+        async with aclosing(
+            group_batches(
+                TASK_STREAM,
+                TASK_GROUP,
+                self.consumer,
+                TASK_QUEUE_BATCH_SIZE,
+                TASK_CLAIM_IDLE_MS,
+                READ_WAIT_MS,
+            )
+        ) as batches:
+            async for entries in batches:
+                if entries:
+                    yield entries
+                if self.stopping.is_set():
+                    return
+                await self.promote_due_retries()
+
+    async def run_task(self, entry_id: bytes, fields: dict):
+        name = fields[b"task"].decode()
+        attempts = int(fields.get(b"attempts", 0)) + 1
+        func = TASKS.get(name)
+        error = None if func else LookupError(f"Unknown task {name}")
+        if func:
+            async with self.slots:
+                try:
+                    await func(*loads(fields[b"args"]))
+                except Exception as e:
+                    error = e
+
+        # Settle the outcome and acknowledge in one step, so a crash in
+        # between neither loses the task nor queues its retry twice
+        async with redis_client.pipeline(transaction=True) as pipe:
+            if error is None:
+                self.stats["done"] += 1
+            elif func and attempts < TASK_MAX_ATTEMPTS:
+                delay = retry_delay(attempts)
+                logger.warning(
+                    f"Task {name} failed (attempt {attempts}), retrying in {delay}s: {error}"
+                )
+                retry = task_fields(name, fields[b"args"].decode(), attempts)
+                pipe.zadd(DELAYED_TASKS_KEY, {delayed_member(retry): time.time() + delay})
+                self.stats["retried"] += 1
+            else:
+                logger.error(
+                    f"Task {name} failed for good after {attempts} attempts: {error}"
+                )
+                pipe.xadd(
+                    DEAD_LETTER_STREAM,
+                    {
+                        **task_fields(name, fields[b"args"], attempts),
+                        "error": repr(error),
+                        "failed_at": time.time(),
+                    },
+                    maxlen=DEAD_LETTER_MAXLEN,
+                    approximate=True,
+                )
+                self.stats["dead"] += 1
+            pipe.xack(TASK_STREAM, TASK_GROUP, entry_id)
+            pipe.xdel(TASK_STREAM, entry_id)
+            await pipe.execute()
+
+    async def run(self):
+        await self.setup()
+        logger.info(f"Task worker {self.consumer} started")
+        async for entries in self.batches():
+            await asyncio.gather(
+                *(self.run_task(entry_id, fields) for entry_id, fields in entries)
+            )
+            logger.info(f"Task worker processed {len(entries)} tasks: {self.stats}")
+        logger.info(f"Task worker {self.consumer} stopped: {self.stats}")
+
+
+async def main(args: argparse.Namespace):
+    worker = TaskWorker(args.consumer, args.concurrency)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stopping.set)
+    try:
+        while not worker.stopping.is_set():
+            try:
+                await worker.run()
+            except Exception as e:
+                logger.error(f"Task worker failed, restarting: {e}")
+                await asyncio.sleep(1)
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--consumer", default="")
+    parser.add_argument("--concurrency", type=int, default=TASK_WORKER_CONCURRENCY)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,34 @@
+from datetime import datetime
+from decimal import Decimal
+
+from bson.decimal128 import Decimal128
+
+# Transactions written before native types were introduced keep
+# `transaction_date` as an ISO string and `transaction_amount` as a double
+# until the backfill migration reaches them, so reads accept both.
+
+
+def to_decimal128(amount) -> Decimal128:
+    """Store amounts exactly as the client sent them rather than as binary floats."""
+    if isinstance(amount, Decimal128):
+        return amount
+    return Decimal128(str(amount))
+
+
+def to_decimal(amount) -> Decimal:
+    if isinstance(amount, Decimal128):
+        return amount.to_decimal()
+    return Decimal(str(amount))
+
+
+def to_float(amount) -> float:
+    if isinstance(amount, Decimal128):
+        return float(amount.to_decimal())
+    return amount
+
+
+def to_datetime(transaction_date) -> datetime:
+    if isinstance(transaction_date, datetime):
+        return transaction_date
+    return datetime.fromisoformat(transaction_date)
+
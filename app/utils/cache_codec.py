@@ -0,0 +1,149 @@
+"""
+Binary format for cached values.
+
+A payload is one header byte followed by a MessagePack body:
+
+    header = 0x10 | (CODEC_VERSION - 1) << 2 | compression
+
+Lists of same-shaped objects (history rows) are packed column by column, so
+each field name is stored once per page instead of once per row. Bodies above
+CACHE_COMPRESSION_THRESHOLD bytes are compressed with zstd or lz4 when the
+library is installed. JSON payloads always start with a printable character or
+whitespace, so headers stay in 0x10-0x1F (room for four codec versions) and
+JSON entries remain readable while old and new workers run side by side.
+"""
+
+import msgpack
+from loguru import logger
+
+from app.config.config import (CACHE_CODEC, CACHE_COMPRESSION,
+                               CACHE_COMPRESSION_THRESHOLD)
+from app.utils.serialization import dumps, encode_stdlib, loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+CODEC_VERSION = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSION_LZ4 = 2
+
+HEADER_BASE = 0x10
+
+# MessagePack extension type for a list of objects packed as columns
+TABLE_EXT = 1
+TABLE_MIN_ROWS = 2
+
+
+class CacheDecodeError(Exception):
+    """Payload written in a format this worker cannot read."""
+
+
+def compressors() -> dict:
+    available = {}
+    if zstandard is not None:
+        available[COMPRESSION_ZSTD] = (
+            zstandard.ZstdCompressor(level=3).compress,
+            zstandard.ZstdDecompressor().decompress,
+        )
+    if lz4_frame is not None:
+        available[COMPRESSION_LZ4] = (lz4_frame.compress, lz4_frame.decompress)
+    return available
+
+
+COMPRESSORS = compressors()
+COMPRESSION_IDS = {
+    "none": COMPRESSION_NONE,
+    "zstd": COMPRESSION_ZSTD,
+    "lz4": COMPRESSION_LZ4,
+}
+
+compression = COMPRESSION_IDS[CACHE_COMPRESSION]
+if compression != COMPRESSION_NONE and compression not in COMPRESSORS:
+    logger.warning(
+        f"{CACHE_COMPRESSION} is not installed; cached values are stored uncompressed"
+    )
+    compression = COMPRESSION_NONE
+
+
+def pack_tables(value):
+    if isinstance(value, dict):
+        return {key: pack_tables(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if (
+            len(value) >= TABLE_MIN_ROWS
+            and isinstance(value[0], dict)
+            # A table of rows without fields would unpack to no rows at all
+            and value[0]
+            and all(
+                isinstance(row, dict) and row.keys() == value[0].keys() for row in value
+            )
+        ):
+            keys = list(value[0])
+            columns = [pack_column([row[key] for row in value]) for key in keys]
+            return msgpack.ExtType(TABLE_EXT, pack_body([keys, columns]))
+        return [pack_tables(item) for item in value]
+    return value
+
+
+def pack_column(column: list) -> list:
+    # Columns of scalars, the common case, need no further transformation
+    if any(isinstance(item, (dict, list, tuple)) for item in column):
+        return [pack_tables(item) for item in column]
+    return column
+
+
+def unpack_table(code: int, data: bytes):
+    if code != TABLE_EXT:
+        raise CacheDecodeError(f"Unknown cache extension type {code}")
+    keys, columns = unpack_body(data)
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+def pack_body(value) -> bytes:
+    return msgpack.packb(value, default=encode_stdlib, datetime=False)
+
+
+def unpack_body(body: bytes):
+    return msgpack.unpackb(body, ext_hook=unpack_table, strict_map_key=False)
+
+
+def encode(value) -> tuple:
+    """Serialize `value`; returns the payload and its uncompressed size."""
+    if CACHE_CODEC == "json":
+        payload = dumps(value)
+        return payload, len(payload)
+
+    body = pack_body(pack_tables(value))
+    size = len(body)
+    used = COMPRESSION_NONE
+    if compression != COMPRESSION_NONE and size > CACHE_COMPRESSION_THRESHOLD:
+        body = COMPRESSORS[compression][0](body)
+        used = compression
+    header = HEADER_BASE | (CODEC_VERSION - 1) << 2 | used
+    return bytes([header]) + body, size
+
+
+def decode(payload: bytes) -> tuple:
+    """Inverse of `encode`, also accepting plain JSON payloads."""
+    header = payload[0]
+    if header >= 0x20 or header in b"\t\r\n":
+        return loads(payload), len(payload)
+
+    version, used = ((header - HEADER_BASE) >> 2) + 1, header & 0x03
+    if header < HEADER_BASE or version != CODEC_VERSION:
+        raise CacheDecodeError(f"Unknown cache codec version {version}")
+    body = payload[1:]
+    if used != COMPRESSION_NONE:
+        if used not in COMPRESSORS:
+            raise CacheDecodeError(f"Cache compression {used} is not installed")
+        body = COMPRESSORS[used][1](body)
+    return unpack_body(body), len(body)
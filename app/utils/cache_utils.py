@@ -0,0 +1,370 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+
+from loguru import logger
+
+from app.config.config import (ANALYTICS_SERIES_CACHE_TTL,
+                               CACHE_EARLY_REFRESH_BETA, CACHE_EXPIRATION,
+                               CACHE_LOCK_POLL_INTERVAL, CACHE_LOCK_TIMEOUT_MS,
+                               CACHE_STALE_TTL, L1_CACHE_ENABLED,
+                               L1_CACHE_MAX_BYTES, L1_CACHE_TTL)
+from app.config.logging import rate_limited, sampled
+from app.config.redis_config import redis_client
+from app.utils.cache_codec import CacheDecodeError, decode, encode
+from app.utils.local_cache import LocalCache
+from app.utils.metrics import record_cache
+from app.utils.request_timing import timed
+from app.utils.serialization import dumps, loads
+
+# Every cached value for a user embeds the user's current generation, so bumping
+# it makes all of them unreachable at once and they simply age out by TTL.
+# Generation keys carry no TTL, which keeps them safe from volatile-* eviction.
+CACHE_GENERATION_KEY = "cache_generation:{user_id}"
+
+# Bumps are broadcast here so every worker drops its in-process copies
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+local_cache = LocalCache(max_bytes=L1_CACHE_MAX_BYTES, ttl=L1_CACHE_TTL)
+redis_stats = {"hits": 0, "misses": 0}
+
+# Loads in flight in this process, by generation-qualified Redis key
+inflight = {}
+
+
+async def get_cache_generation(user_id: str) -> int:
+    generation = await redis_client.get(CACHE_GENERATION_KEY.format(user_id=user_id))
+    return int(generation) if generation else 0
+
+
+async def bump_cache_generation(*user_ids: str):
+    if not user_ids:
+        return
+    local_cache.invalidate(*user_ids)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.incr(CACHE_GENERATION_KEY.format(user_id=user_id))
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, dumps(list(user_ids)))
+        await pipe.execute()
+    sampled().info("Cache generation bumped for {} users", len(user_ids))
+
+
+def history_cache_key(
+    user_id: str, cursor: str, limit: int, include_full_name: bool = False
+) -> str:
+    names = ":names" if include_full_name else ""
+    return f"transaction_history:{user_id}:{cursor or ''}:{limit}{names}"
+
+
+def analytics_cache_key(user_id: str) -> str:
+    return f"transaction_analytics:{user_id}"
+
+
+def analytics_range_cache_key(user_id: str, start_date, end_date) -> str:
+    return (
+        f"transaction_analytics_range:{user_id}:"
+        f"{start_date.isoformat()}:{end_date.isoformat()}"
+    )
+
+
+def analytics_series_cache_key(user_id: str, granularity: str, tz: str) -> str:
+    return f"analytics_series:{user_id}:{granularity}:{tz}"
+
+
+async def get_cached_buckets(user_id: str, key: str, fields: list) -> tuple:
+    """
+    Read the cached buckets of a series, a Redis hash under the user's current
+    generation. Returns the hash key to store computed buckets under, and the
+    cached buckets by field.
+    """
+    generation = await get_cache_generation(user_id)
+    redis_key = f"{key}:g{generation}"
+    cached = {}
+    if fields:
+        for field, payload in zip(fields, await redis_client.hmget(redis_key, fields)):
+            if payload is None:
+                continue
+            try:
+                cached[field], _ = decode(payload)
+            except CacheDecodeError as e:
+                rate_limited("cache_decode").warning(
+                    "Ignoring unreadable cached bucket: {}", e
+                )
+        record_cache(key, "redis", hits=len(cached), misses=len(fields) - len(cached))
+    return redis_key, cached
+
+
+async def cache_buckets(redis_key: str, buckets: dict):
+    if not buckets:
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(
+            redis_key,
+            mapping={field: encode(bucket)[0] for field, bucket in buckets.items()},
+        )
+        pipe.expire(redis_key, ANALYTICS_SERIES_CACHE_TTL)
+        await pipe.execute()
+
+
+def encode_envelope(value, compute_time: float) -> bytes:
+    """
+    Wrap a value with its logical expiry and how long it took to compute; the
+    Redis TTL runs CACHE_STALE_TTL longer so stale values can still be served.
+    """
+    with timed("serialization"):
+        payload, _ = encode(
+            {"v": value, "exp": time.time() + CACHE_EXPIRATION, "d": compute_time}
+        )
+    return payload
+
+
+def decode_envelope(payload):
+    """
+    The envelope in `payload`, with its decoded size under "n" for the L1 byte
+    budget, or None if this worker cannot read the payload's format.
+    """
+    try:
+        with timed("serialization"):
+            envelope, size = decode(payload)
+    except CacheDecodeError as e:
+        rate_limited("cache_decode").warning("Ignoring unreadable cache entry: {}", e)
+        return None
+    if not (isinstance(envelope, dict) and envelope.keys() == {"v", "exp", "d"}):
+        # Written before envelopes existed; treat as fresh until its TTL runs out
+        envelope = {"v": envelope, "exp": float("inf"), "d": 0.0}
+    envelope["n"] = size
+    return envelope
+
+
+def needs_refresh(envelope: dict) -> bool:
+    """
+    True once the value is logically expired, or probabilistically a little
+    before (XFetch), with values that are slow to compute refreshed earlier.
+    """
+    early_by = -envelope["d"] * CACHE_EARLY_REFRESH_BETA * math.log(random.random())
+    return time.time() + early_by >= envelope["exp"]
+
+
+async def cache_set(token: tuple, value, compute_time: float = 0.0):
+    """
+    Store a freshly computed value and return it as every cache hit will see
+    it, i.e. with ObjectIds, datetimes and decimals already serialized.
+    """
+    user_id, key, redis_key, started_at = token
+    payload = encode_envelope(value, compute_time)
+    envelope = decode_envelope(payload)
+    await redis_client.setex(
+        redis_key, CACHE_EXPIRATION + CACHE_STALE_TTL, payload
+    )
+    if L1_CACHE_ENABLED:
+        local_cache.set(user_id, key, envelope["v"], envelope["n"], started_at)
+    return envelope["v"]
+
+
+async def acquire_cache_lock(token: tuple):
+    """Take the cross-process recompute lock for an entry; None if it is held."""
+    lock_id = uuid.uuid4().hex
+    acquired = await redis_client.set(
+        f"lock:{token[2]}", lock_id, nx=True, px=CACHE_LOCK_TIMEOUT_MS
+    )
+    return lock_id if acquired else None
+
+
+async def release_cache_lock(token: tuple, lock_id: str):
+    await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{token[2]}", lock_id)
+
+
+async def wait_for_cache(token: tuple):
+    """Poll for the value another process is computing, up to the lock timeout."""
+    deadline = time.monotonic() + CACHE_LOCK_TIMEOUT_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+        payload = await redis_client.get(token[2])
+        envelope = decode_envelope(payload) if payload else None
+        if envelope is not None:
+            return envelope["v"]
+    return None
+
+
+def single_flight(token: tuple, loader, wait_for_lock: bool = True):
+    """
+    Share one recompute per entry between all callers in this process.
+
+    Foreground and background recomputes are tracked apart: a background
+    refresh gives up and yields `None` when another process holds the lock,
+    which a foreground miss must never be handed.
+    """
+    # Imported here because refresh_cache is built on this module
+    from app.tasks.refresh_cache import refresh_cache
+
+    flight = (token[2], wait_for_lock)
+    task = inflight.get(flight)
+    if task is None:
+        task = asyncio.create_task(refresh_cache(token, loader, wait_for_lock))
+        inflight[flight] = task
+        task.add_done_callback(lambda _: inflight.pop(flight, None))
+    return task
+
+
+async def cached_load(user_id: str, key: str, loader):
+    """
+    Read-through lookup of `key`: in-process cache, then Redis under the user's
+    current generation, then `loader()`.
+
+    Concurrent misses share one load, in process and across processes. Stale
+    or about-to-expire values are served while one background refresh runs.
+    """
+    started_at = time.monotonic()
+    if L1_CACHE_ENABLED:
+        value = local_cache.get(key)
+        if value is not None:
+            record_cache(key, "l1", hits=1)
+            return value
+        record_cache(key, "l1", misses=1)
+
+    generation = await get_cache_generation(user_id)
+    token = (user_id, key, f"{key}:g{generation}", started_at)
+    payload = await redis_client.get(token[2])
+    envelope = decode_envelope(payload) if payload else None
+    if envelope is not None:
+        redis_stats["hits"] += 1
+        record_cache(key, "redis", hits=1)
+        if needs_refresh(envelope):
+            single_flight(token, loader, wait_for_lock=False)
+        elif L1_CACHE_ENABLED:
+            local_cache.set(user_id, key, envelope["v"], envelope["n"], started_at)
+        return envelope["v"]
+
+    redis_stats["misses"] += 1
+    record_cache(key, "redis", misses=1)
+    # Shielded so one cancelled request does not cancel the shared load
+    return await asyncio.shield(single_flight(token, loader))
+
+
+async def cached_load_many(keys: dict, loader) -> dict:
+    """
+    Batch counterpart of `cached_load` for one key per user (`keys` maps user
+    IDs to keys): in-process cache, then one `MGET` of the users' generations
+    and one of the values, then a single `loader(user_ids)` call for the
+    misses, written back in one pipeline.
+
+    `loader` returns values by user ID and leaves out users it has nothing
+    for; those are missing from the result too. Expired entries count as
+    misses here, since they are reloaded with the rest of the batch anyway.
+    """
+    started_at = time.monotonic()
+    values = {}
+    pending = []
+    for user_id, key in keys.items():
+        value = local_cache.get(key) if L1_CACHE_ENABLED else None
+        if value is not None:
+            values[user_id] = value
+        else:
+            pending.append(user_id)
+    # All keys of a batch belong to the same cache
+    family = next(iter(keys.values()), "")
+    if L1_CACHE_ENABLED:
+        record_cache(family, "l1", hits=len(values), misses=len(pending))
+    if not pending:
+        return values
+
+    generations = await redis_client.mget(
+        [CACHE_GENERATION_KEY.format(user_id=user_id) for user_id in pending]
+    )
+    tokens = {
+        user_id: (
+            user_id,
+            keys[user_id],
+            f"{keys[user_id]}:g{int(generation) if generation else 0}",
+            started_at,
+        )
+        for user_id, generation in zip(pending, generations)
+    }
+    payloads = await redis_client.mget([tokens[user_id][2] for user_id in pending])
+
+    misses = []
+    now = time.time()
+    for user_id, payload in zip(pending, payloads):
+        envelope = decode_envelope(payload) if payload else None
+        if envelope is None or envelope["exp"] <= now:
+            misses.append(user_id)
+            continue
+        values[user_id] = envelope["v"]
+        if L1_CACHE_ENABLED:
+            local_cache.set(
+                user_id, keys[user_id], envelope["v"], envelope["n"], started_at
+            )
+    redis_stats["hits"] += len(pending) - len(misses)
+    redis_stats["misses"] += len(misses)
+    record_cache(family, "redis", hits=len(pending) - len(misses), misses=len(misses))
+    if not misses:
+        return values
+
+    loaded = await loader(misses)
+    compute_time = (time.monotonic() - started_at) / len(misses)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id, value in loaded.items():
+            user_id, key, redis_key, _ = tokens[user_id]
+            payload = encode_envelope(value, compute_time)
+            envelope = decode_envelope(payload)
+            pipe.setex(redis_key, CACHE_EXPIRATION + CACHE_STALE_TTL, payload)
+            if L1_CACHE_ENABLED:
+                local_cache.set(user_id, key, envelope["v"], envelope["n"], started_at)
+            values[user_id] = envelope["v"]
+        await pipe.execute()
+    return values
+
+
+def cache_stats() -> dict:
+    return {"l1": local_cache.stats(), "redis": dict(redis_stats)}
+
+
+async def listen_for_invalidations():
+    """Evict in-process entries for users bumped by any worker."""
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            logger.info("Listening for cache invalidations")
+            while True:
+                message = await pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    local_cache.invalidate(*loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Messages may have been missed while disconnected
+            logger.error(f"Cache invalidation listener failed: {e}")
+            local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+invalidation_listener = None
+
+
+def start_invalidation_listener():
+    global invalidation_listener
+    if L1_CACHE_ENABLED and invalidation_listener is None:
+        invalidation_listener = asyncio.create_task(listen_for_invalidations())
+
+
+async def stop_invalidation_listener():
+    global invalidation_listener
+    if invalidation_listener is not None:
+        invalidation_listener.cancel()
+        try:
+            await invalidation_listener
+        except asyncio.CancelledError:
+            pass
+        invalidation_listener = None
@@ -0,0 +1,135 @@
+import asyncio
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from loguru import logger
+
+from app.config.config import (CRYPTO_BATCH_SIZE, CRYPTO_EXECUTOR,
+                               CRYPTO_MAX_PENDING, CRYPTO_WORKERS)
+from app.utils import encryption_utils
+from app.utils.encryption_utils import (configure_keys, decrypt_batch,
+                                        encrypt_batch, rotate_batch)
+from app.utils.request_timing import measure
+
+
+class CryptoService:
+    """
+    Runs Fernet work off the event loop, in batches, on a worker pool.
+
+    Single values submitted during the same loop iteration are coalesced into
+    one batch. At most `max_pending` batches are queued on the pool; further
+    callers wait for a slot instead of growing the queue without bound.
+    """
+
+    def __init__(
+        self,
+        executor: str = CRYPTO_EXECUTOR,
+        workers: int = CRYPTO_WORKERS,
+        batch_size: int = CRYPTO_BATCH_SIZE,
+        max_pending: int = CRYPTO_MAX_PENDING,
+    ):
+        self.executor_kind = executor
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.executor = None
+        self.slots = weakref.WeakKeyDictionary()
+        self.waiting = {}
+        self.tasks = set()
+
+    def get_executor(self):
+        if self.executor is None:
+            if self.executor_kind == "process":
+                # Workers must share the key ring, including a generated key
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=configure_keys,
+                    initargs=(encryption_utils.raw_keys_by_id,),
+                )
+            else:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="crypto"
+                )
+            logger.info(
+                f"Started {self.executor_kind} crypto pool with {self.workers} workers"
+            )
+        return self.executor
+
+    def get_slots(self) -> asyncio.Semaphore:
+        # One semaphore per event loop, as the test client runs its own loops
+        loop = asyncio.get_running_loop()
+        if loop not in self.slots:
+            self.slots[loop] = asyncio.Semaphore(self.max_pending)
+        return self.slots[loop]
+
+    async def run_batch(self, func, values: list) -> list:
+        async with self.get_slots():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.get_executor(), func, values)
+
+    async def run_many(self, func, values: list) -> list:
+        if not values:
+            return []
+        batches = [
+            values[i : i + self.batch_size]
+            for i in range(0, len(values), self.batch_size)
+        ]
+        results = await asyncio.gather(
+            *(self.run_batch(func, batch) for batch in batches)
+        )
+        return [value for batch in results for value in batch]
+
+    async def run_one(self, func, value: str) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (loop, func)
+        waiting = self.waiting.setdefault(key, [])
+        waiting.append((value, future))
+        if len(waiting) == 1:
+            loop.call_soon(self.flush, key)
+        elif len(waiting) >= self.batch_size:
+            self.flush(key)
+        return await future
+
+    def flush(self, key: tuple):
+        waiting = self.waiting.pop(key, None)
+        if waiting:
+            task = asyncio.ensure_future(self.resolve(key[1], waiting))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def resolve(self, func, waiting: list):
+        try:
+            results = await self.run_batch(func, [value for value, _ in waiting])
+        except Exception as e:
+            for _, future in waiting:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(waiting, results):
+            if not future.done():
+                future.set_result(result)
+
+    # Timed as seen by the caller, waiting for a pool slot included
+    async def encrypt(self, value: str) -> str:
+        return await measure("crypto", self.run_one(encrypt_batch, value))
+
+    async def decrypt(self, value: str) -> str:
+        return await measure("crypto", self.run_one(decrypt_batch, value))
+
+    async def encrypt_many(self, values: list) -> list:
+        return await measure("crypto", self.run_many(encrypt_batch, values))
+
+    async def decrypt_many(self, values: list) -> list:
+        return await measure("crypto", self.run_many(decrypt_batch, values))
+
+    async def rotate_many(self, values: list) -> list:
+        return await self.run_many(rotate_batch, values)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+crypto_service = CryptoService()
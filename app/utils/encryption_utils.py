@@ -1,7 +1,7 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from loguru import logger
 
-from app.config.config import SECRET_KEY
+from app.config.config import ENCRYPTION_KEYS, SECRET_KEY
 
 # Ensure SECRET_KEY is a string
 if isinstance(SECRET_KEY, bytes):
@@ -9,24 +9,81 @@ if isinstance(SECRET_KEY, bytes):
 else:
     ENCRYPTION_KEY = str(SECRET_KEY)
 
-if not ENCRYPTION_KEY:
-    # If the key is not found, generate a new one and log a warning
-    logger.warning(
-        "ENCRYPTION_KEY not found in environment variables. Generating a new key."
-    )
-    ENCRYPTION_KEY = Fernet.generate_key().decode()
 
-cipher_suite = Fernet(ENCRYPTION_KEY.encode())
+def load_keys() -> dict:
+    """
+    Raw Fernet keys by key ID, primary (newest) first.
+
+    ENCRYPTION_KEYS holds `kid:key` entries; SECRET_KEY alone is read as the
+    single key `k0`.
+    """
+    keys = {}
+    for entry in ENCRYPTION_KEYS:
+        kid, _, key = entry.strip().partition(":")
+        if not kid or not key:
+            raise ValueError("ENCRYPTION_KEYS entries must look like kid:key")
+        keys[kid] = key
+    if not keys and ENCRYPTION_KEY:
+        keys["k0"] = ENCRYPTION_KEY
+    if not keys:
+        # If the key is not found, generate a new one and log a warning
+        logger.warning(
+            "ENCRYPTION_KEY not found in environment variables. Generating a new key."
+        )
+        keys["k0"] = Fernet.generate_key().decode()
+    return keys
+
+
+def configure_keys(raw_keys: dict):
+    """Install the key ring; also run in each crypto worker process."""
+    global raw_keys_by_id, ciphers, PRIMARY_KEY_ID, cipher_suite, legacy_cipher_suite
+    raw_keys_by_id = dict(raw_keys)
+    ciphers = {kid: Fernet(key.encode()) for kid, key in raw_keys.items()}
+    PRIMARY_KEY_ID = next(iter(ciphers))
+    cipher_suite = ciphers[PRIMARY_KEY_ID]
+    # Values written before key IDs existed are tried against every key
+    legacy_cipher_suite = MultiFernet(list(ciphers.values()))
+
+
+configure_keys(load_keys())
+
+
+def key_id(encrypted_data: str):
+    """Key ID an encrypted value was written with, None for legacy values."""
+    kid, separator, _ = encrypted_data.partition(":")
+    return kid if separator else None
 
 
 def encrypt_data(data: str) -> str:
-    """Encrypt the data using Fernet encryption."""
-    return cipher_suite.encrypt(data.encode()).decode()
+    """Encrypt the data with the primary key, prefixed with its key ID."""
+    return f"{PRIMARY_KEY_ID}:{cipher_suite.encrypt(data.encode()).decode()}"
 
 
 def decrypt_data(encrypted_data: str) -> str:
-    """Decrypt the data using Fernet decryption."""
-    logger.info(f"Decrypting data: {encrypted_data}")
-    data = cipher_suite.decrypt(encrypted_data.encode()).decode()
-    logger.info(f"Done decrypting data")
-    return data
+    """Decrypt the data with the key it was written with."""
+    kid, separator, token = encrypted_data.partition(":")
+    if not separator:
+        return legacy_cipher_suite.decrypt(encrypted_data.encode()).decode()
+    if kid not in ciphers:
+        raise ValueError(f"Unknown encryption key ID: {kid}")
+    return ciphers[kid].decrypt(token.encode()).decode()
+
+
+def rotate_data(encrypted_data: str) -> str:
+    """Re-encrypt a value under the primary key; no-op if it already is."""
+    if key_id(encrypted_data) == PRIMARY_KEY_ID:
+        return encrypted_data
+    return encrypt_data(decrypt_data(encrypted_data))
+
+
+# Batch variants run in the crypto worker pool, one call per batch
+def encrypt_batch(values: list) -> list:
+    return [encrypt_data(value) for value in values]
+
+
+def decrypt_batch(values: list) -> list:
+    return [decrypt_data(value) for value in values]
+
+
+def rotate_batch(values: list) -> list:
+    return [rotate_data(value) for value in values]
@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with a per-entry TTL, sized by the byte length
+    of each entry's serialized payload.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, size, user_id, value)
+        self.keys_by_user = {}
+        self.invalidated_at = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < time.monotonic():
+            self.remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def set(self, user_id: str, key: str, value, size: int, started_at: float):
+        """
+        Store `value` unless the user was invalidated after `started_at`, the
+        moment the caller began fetching it - that value may already be stale.
+        """
+        if self.invalidated_at.get(user_id, 0) >= started_at or size > self.max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, size, user_id, value)
+        self.keys_by_user.setdefault(user_id, set()).add(key)
+        self.size += size
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry[1]
+        user_keys = self.keys_by_user.get(entry[2])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self.keys_by_user[entry[2]]
+
+    def invalidate(self, *user_ids: str):
+        now = time.monotonic()
+        for user_id in user_ids:
+            self.invalidated_at[user_id] = now
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self.remove(key)
+        # No lookup runs longer than an entry lives, so older marks can go
+        if len(self.invalidated_at) > 10_000:
+            self.invalidated_at = {
+                user_id: at
+                for user_id, at in self.invalidated_at.items()
+                if at > now - self.ttl
+            }
+
+    def clear(self):
+        self.invalidated_at = {}
+        self.entries.clear()
+        self.keys_by_user.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
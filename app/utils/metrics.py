@@ -0,0 +1,138 @@
+"""
+Prometheus metrics, served by the API on `/metrics`.
+
+Labels only ever take values from small fixed sets - route templates, cache
+names, command names - never user IDs, cursors or raw keys.
+"""
+
+import time
+
+from prometheus_client import Counter, Histogram
+from pymongo import monitoring
+from redis.asyncio.client import Pipeline, Redis
+
+from app.utils.request_timing import add_timing
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache, tier (l1 or redis) and result (hit or miss)",
+    ["cache", "tier", "result"],
+)
+
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds",
+    "MongoDB command latency, from pymongo command monitoring",
+    ["command", "collection", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+REDIS_COMMAND_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Redis call latency; pipelines are timed as one call",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 2.5),
+)
+
+ANALYTICS_RUN_DURATION = Histogram(
+    "analytics_run_duration_seconds",
+    "Duration of compute_and_store_analytics runs",
+    ["mode", "outcome"],
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+ANALYTICS_USERS_PROCESSED = Counter(
+    "analytics_users_processed_total",
+    "Users whose analytics were refreshed by scheduled runs",
+    ["mode"],
+)
+ANALYTICS_USER_FAILURES = Counter(
+    "analytics_user_failures_total",
+    "Users whose analytics refresh failed in scheduled runs",
+    ["mode"],
+)
+
+
+def record_analytics_run(mode: str, outcome: str, duration: float, progress: dict):
+    ANALYTICS_RUN_DURATION.labels(mode, outcome).observe(duration)
+    ANALYTICS_USERS_PROCESSED.labels(mode).inc(progress["users"])
+    ANALYTICS_USER_FAILURES.labels(mode).inc(progress["failures"])
+
+
+def cache_name(key: str) -> str:
+    """`transaction_history:<user>:...` -> `transaction_history`."""
+    return key.split(":", 1)[0]
+
+
+def record_cache(key: str, tier: str, hits: int = 0, misses: int = 0):
+    name = cache_name(key)
+    if hits:
+        CACHE_REQUESTS.labels(name, tier, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(name, tier, "miss").inc(misses)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command sent by the client it is registered on."""
+
+    def __init__(self):
+        # Collection of each command in flight, by request ID
+        self.collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self.collections[event.request_id] = target if isinstance(target, str) else ""
+
+    def record(self, event, status: str):
+        collection = self.collections.pop(event.request_id, "")
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection, status).observe(
+            event.duration_micros / 1e6
+        )
+
+    def succeeded(self, event):
+        self.record(event, "ok")
+
+    def failed(self, event):
+        self.record(event, "failed")
+
+
+mongo_command_listener = MongoCommandListener()
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            elapsed = time.perf_counter() - started
+            command = "MULTI" if self.is_transaction else "PIPELINE"
+            REDIS_COMMAND_LATENCY.labels(command).observe(elapsed)
+            add_timing("redis", elapsed)
+
+
+class InstrumentedRedis(Redis):
+    """Redis client timing each call by command name."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - started
+            command = args[0]
+            if isinstance(command, bytes):
+                command = command.decode()
+            REDIS_COMMAND_LATENCY.labels(command.upper()).observe(elapsed)
+            add_timing("redis", elapsed)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> Pipeline:
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
@@ -0,0 +1,46 @@
+from redis.exceptions import ResponseError
+
+from app.config.redis_config import redis_client
+
+
+async def create_group(stream: str, group: str):
+    """Create consumer group `group` on `stream`, and the stream, if missing."""
+    try:
+        await redis_client.xgroup_create(stream, group, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def group_batches(
+    stream: str,
+    group: str,
+    consumer: str,
+    count: int,
+    claim_idle_ms: int,
+    block_ms: int,
+):
+    """
+    Yield batches of up to `count` `(entry_id, fields)` entries read by
+    `consumer` in `group`, without acknowledging them.
+
+    Entries left pending longer than `claim_idle_ms` by a consumer that died
+    are claimed first, then this consumer's own unacknowledged entries, then
+    new ones, waiting up to `block_ms` for them. A read that finds nothing
+    yields an empty batch, so callers can do periodic work or stop between
+    reads.
+    """
+    stream_id = "0"
+    while True:
+        _, entries, _ = await redis_client.xautoclaim(
+            stream, group, consumer, min_idle_time=claim_idle_ms, count=count
+        )
+        if not entries:
+            response = await redis_client.xreadgroup(
+                group, consumer, {stream: stream_id}, count=count, block=block_ms
+            )
+            entries = response[0][1] if response else []
+            if not entries and stream_id == "0":
+                stream_id = ">"
+                continue
+        yield entries
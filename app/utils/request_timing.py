@@ -0,0 +1,40 @@
+"""
+Time spent per category (mongo, redis, crypto, validation, serialization)
+while handling the current request, reported by TimingMiddleware.
+
+Outside a request nothing is recorded. Work run concurrently within one
+request is summed, so categories can add up to more than the request took.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+def add_timing(category: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings[category] = timings.get(category, 0.0) + seconds
+
+
+@contextmanager
+def timed(category: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(category, time.perf_counter() - started)
+
+
+async def measure(category: str, awaitable):
+    """`await awaitable`, counting the wait towards `category`."""
+    with timed(category):
+        return await awaitable
+
+
+def server_timing(timings: dict, total: float) -> str:
+    metrics = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics)
@@ -0,0 +1,63 @@
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+
+import orjson
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+
+from app.config.config import JSON_SERIALIZER
+
+# Documents are serialized straight from Mongo: ObjectIds become strings,
+# Decimal128 amounts become numbers and datetimes ISO 8601 strings.
+
+
+def encode_bson_type(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def encode_stdlib(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return encode_bson_type(value)
+
+
+Serializer = namedtuple("Serializer", ["dumps", "loads"])
+
+SERIALIZERS = {
+    "orjson": Serializer(
+        dumps=lambda value: orjson.dumps(
+            value, default=encode_bson_type, option=orjson.OPT_NON_STR_KEYS
+        ),
+        loads=orjson.loads,
+    ),
+    # Kept for comparison and as a fallback; much slower on large payloads
+    "json": Serializer(
+        dumps=lambda value: json.dumps(
+            value, default=encode_stdlib, separators=(",", ":")
+        ).encode(),
+        loads=json.loads,
+    ),
+}
+
+serializer = SERIALIZERS[JSON_SERIALIZER]
+
+
+def dumps(value) -> bytes:
+    return serializer.dumps(value)
+
+
+def loads(payload):
+    return serializer.loads(payload)
+
+
+def to_jsonable(value):
+    """The value as it reads back from JSON, e.g. for uncached responses."""
+    return serializer.loads(serializer.dumps(value))
@@ -0,0 +1,188 @@
+"""
+Seed N users x M transactions with realistic skew for benchmarks:
+
+    python -m benchmarks.generate_data --users 1000 --transactions 200 --drop
+    python -m benchmarks.generate_data --target memory --users 100
+
+Per-user volume follows a Zipf curve, so `bench-user-000000` is the heaviest
+user and most users have few transactions; M is the mean per user. Amounts are
+log-normal, debits outnumber credits, and activity clusters on weekdays and
+business hours. The same --seed gives the same data, bar ObjectIds. Daily rollups
+are written alongside, as the API would have maintained them.
+
+`--target mongo` writes to MONGODB_URI; `--target memory` seeds an in-memory
+mongomock database (if installed) to time generation and the insert path.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+
+from app.crud.analytics_service import add_rollup_delta, rollup_id
+from app.utils.crypto_service import crypto_service
+from benchmarks.results import save_results
+
+USER_PREFIX = "bench-user-"
+
+
+def user_id(index: int) -> str:
+    return f"{USER_PREFIX}{index:06d}"
+
+
+def user_volumes(users: int, mean: int, skew: float) -> list:
+    """Transactions per user, Zipf-distributed, totalling about users * mean."""
+    weights = [1 / (rank + 1) ** skew for rank in range(users)]
+    scale = users * mean / sum(weights)
+    return [max(1, round(weight * scale)) for weight in weights]
+
+
+def transaction_moment(rng: random.Random, end: datetime, days: int) -> datetime:
+    while True:
+        day = end - timedelta(days=rng.randrange(days))
+        # Weekends see well under half the weekday volume
+        if day.weekday() < 5 or rng.random() < 0.4:
+            break
+    hour = min(23, max(0, round(rng.gauss(13, 3.5))))
+    return day.replace(
+        hour=hour,
+        minute=rng.randrange(60),
+        second=rng.randrange(60),
+        microsecond=rng.randrange(1000000),
+    )
+
+
+def generate_transactions(
+    users: int,
+    transactions: int,
+    skew: float = 1.1,
+    days: int = 365,
+    seed: int = 42,
+    end: datetime = datetime(2024, 12, 31),
+):
+    """Yield transaction documents shaped as the API stores them, names in clear."""
+    rng = random.Random(seed)
+    for index, volume in enumerate(user_volumes(users, transactions, skew)):
+        for _ in range(volume):
+            amount = max(0.01, round(rng.lognormvariate(3.5, 1.1), 2))
+            yield {
+                "_id": ObjectId(),
+                "user_id": user_id(index),
+                "full_name": f"Bench User {index}",
+                "transaction_date": transaction_moment(rng, end, days),
+                "transaction_amount": Decimal128(f"{amount:.2f}"),
+                "transaction_type": "debit" if rng.random() < 0.7 else "credit",
+                "updated_at": end,
+            }
+
+
+def batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def seed(transactions, rollups, documents, batch_size: int, encrypt: bool):
+    deltas = {}
+    inserted = 0
+    for batch in batched(documents, batch_size):
+        for document in batch:
+            add_rollup_delta(deltas, document, 1)
+        if encrypt:
+            names = await crypto_service.encrypt_many(
+                [document["full_name"] for document in batch]
+            )
+            for document, name in zip(batch, names):
+                document["full_name"] = name
+        await transactions.insert_many(batch, ordered=False)
+        inserted += len(batch)
+        if inserted % (batch_size * 20) == 0:
+            print(f"{inserted} transactions inserted")
+
+    rollup_documents = [
+        {
+            "_id": rollup_id(user, day),
+            "user_id": user,
+            "day": day,
+            "count": delta["count"],
+            "sum": Decimal128(str(delta["sum"])),
+            "debit_total": Decimal128(str(delta["debit_total"])),
+            "credit_total": Decimal128(str(delta["credit_total"])),
+        }
+        for (user, day), delta in deltas.items()
+    ]
+    for batch in batched(rollup_documents, batch_size):
+        await rollups.insert_many(batch, ordered=False)
+    return inserted, len(rollup_documents)
+
+
+def collections(target: str):
+    if target == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--target memory needs mongomock-motor installed")
+        db = AsyncMongoMockClient()["benchmarks"]
+        return db["transactions"], db["daily_rollups"], db["analytics"]
+
+    from app.database.database import (analytics_collection, rollup_collection,
+                                       transaction_collection)
+
+    return transaction_collection, rollup_collection, analytics_collection
+
+
+async def main(args: argparse.Namespace):
+    transactions, rollups, analytics = collections(args.target)
+    if args.drop:
+        bench_users = {"user_id": {"$regex": f"^{USER_PREFIX}"}}
+        for collection in (transactions, rollups, analytics):
+            await collection.delete_many(bench_users)
+
+    started = time.perf_counter()
+    documents = generate_transactions(
+        args.users, args.transactions, args.skew, args.days, args.seed
+    )
+    inserted, rollup_count = await seed(
+        transactions, rollups, documents, args.batch_size, not args.no_encrypt
+    )
+    elapsed = time.perf_counter() - started
+    crypto_service.shutdown()
+
+    summary = {
+        "transactions": inserted,
+        "rollups": rollup_count,
+        "seconds": round(elapsed, 2),
+        "ops_per_second": round(inserted / elapsed, 1),
+    }
+    print(summary)
+    save_results(args.output, "generate_data", {"seed": summary}, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--transactions", type=int, default=100, help="mean transactions per user"
+    )
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--target", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument(
+        "--drop", action="store_true", help="delete earlier benchmark users first"
+    )
+    parser.add_argument(
+        "--no-encrypt", action="store_true", help="store names in clear (faster)"
+    )
+    parser.add_argument("--output", help="write the summary as JSON")
+    asyncio.run(main(parser.parse_args()))
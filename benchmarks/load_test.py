@@ -0,0 +1,186 @@
+"""
+HTTP load scenarios against a running API seeded by `benchmarks.generate_data`:
+
+    python -m benchmarks.load_test --base-url http://localhost:8000 --output load.json
+    python -m benchmarks.load_test --scenario history_page --concurrency 64
+
+Each scenario keeps --concurrency requests in flight for --duration seconds
+after a --warmup period, picking users with the same Zipf skew as the seeded
+data, and reports throughput, error count and p50/p95/p99 latency.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+
+from benchmarks.generate_data import user_id
+from benchmarks.results import percentile, save_results
+
+API = "/api/v1"
+
+
+class Users:
+    """Zipf-skewed user picker over the seeded `bench-user-*` IDs."""
+
+    def __init__(self, count: int, skew: float, seed: int):
+        self.ids = [user_id(index) for index in range(count)]
+        self.weights = [1 / (rank + 1) ** skew for rank in range(count)]
+        self.rng = random.Random(seed)
+
+    def pick(self) -> str:
+        return self.rng.choices(self.ids, self.weights)[0]
+
+    def sample(self, size: int) -> list:
+        return self.rng.sample(self.ids, min(size, len(self.ids)))
+
+
+def transaction_body(user: str) -> dict:
+    return {
+        "user_id": user,
+        "full_name": "Bench User",
+        "transaction_date": "2024-12-31T12:00:00",
+        "transaction_amount": 42.5,
+        "transaction_type": "debit",
+    }
+
+
+def build_scenarios(users: Users, transaction_ids: list) -> dict:
+    """Scenario name -> function returning `(method, path, json_body)`."""
+    return {
+        "get_transaction": lambda: (
+            "GET",
+            f"{API}/transaction/{users.rng.choice(transaction_ids)}",
+            None,
+        ),
+        "history_page": lambda: (
+            "GET",
+            f"{API}/transaction/history/{users.pick()}?limit=100",
+            None,
+        ),
+        "history_export": lambda: (
+            "GET",
+            f"{API}/transaction/history/{users.pick()}/export?format=ndjson",
+            None,
+        ),
+        "analytics": lambda: ("GET", f"{API}/analytics/{users.pick()}", None),
+        "analytics_range": lambda: (
+            "GET",
+            f"{API}/analytics/range/{users.pick()}"
+            "?start_date=2024-10-01T00:00:00&end_date=2024-12-31T00:00:00",
+            None,
+        ),
+        "analytics_series": lambda: (
+            "GET",
+            f"{API}/analytics/series/{users.pick()}?granularity=day"
+            "&start_date=2024-10-01T00:00:00&end_date=2024-12-31T00:00:00",
+            None,
+        ),
+        "analytics_batch": lambda: (
+            "POST",
+            f"{API}/analytics/batch",
+            {"user_ids": users.sample(100)},
+        ),
+        "add_transaction": lambda: (
+            "POST",
+            f"{API}/transaction/",
+            transaction_body(users.pick()),
+        ),
+    }
+
+
+async def collect_transaction_ids(client: httpx.AsyncClient, users: Users) -> list:
+    ids = []
+    for user in users.sample(20):
+        response = await client.get(f"{API}/transaction/history/{user}?limit=50")
+        if response.status_code == 200:
+            ids.extend(row["id"] for row in response.json()["data"])
+    return ids
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, request, concurrency: int, duration: float, warmup: float
+) -> dict:
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def user_loop():
+        nonlocal errors
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            method, path, body = request()
+            try:
+                response = await client.request(method, path, json=body)
+                await response.aread()
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            finished = time.perf_counter()
+            if now >= measure_from:
+                latencies.append((finished - now) * 1000)
+                errors += failed
+
+    await asyncio.gather(*(user_loop() for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+async def main(args: argparse.Namespace):
+    # httpx logs every request, which would slow the client down
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    users = Users(args.users, args.skew, args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=args.timeout
+    ) as client:
+        transaction_ids = await collect_transaction_ids(client, users)
+        scenarios = build_scenarios(
+            users, transaction_ids or ["000000000000000000000000"]
+        )
+        names = list(scenarios) if args.scenario == "all" else args.scenario.split(",")
+
+        results = {}
+        for name in names:
+            results[name] = await run_scenario(
+                client, scenarios[name], args.concurrency, args.duration, args.warmup
+            )
+            metrics = results[name]
+            print(
+                f"{name:<18} {metrics['requests_per_second']:>9.1f} req/s  "
+                f"p50 {metrics['p50_ms']:>8.2f}  p95 {metrics['p95_ms']:>8.2f}  "
+                f"p99 {metrics['p99_ms']:>8.2f} ms  errors {metrics['errors']}"
+            )
+    save_results(args.output, "load_test", results, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--scenario", default="all", help="'all' or comma-separated scenario names"
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--users", type=int, default=1000, help="seeded user count")
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results as JSON")
+    asyncio.run(main(parser.parse_args()))
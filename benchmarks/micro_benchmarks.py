@@ -0,0 +1,165 @@
+"""
+Time the hot functions of the request paths in isolation:
+
+    python -m benchmarks.micro_benchmarks --output micro.json
+    python -m benchmarks.micro_benchmarks --only encrypt --number 5000
+
+Inputs come from the data generator, so they have production-like shapes and
+sizes. Each benchmark reports the best of --repeat runs in microseconds per
+operation. With --mongo, live analytics are also timed against a database
+seeded by `benchmarks.generate_data`.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import timeit
+from datetime import datetime
+
+from app.crud.analytics_service import (add_rollup_delta,
+                                        aggregate_rollup_analytics,
+                                        analytics_from_state)
+from app.crud.transactions_service import transaction_helper
+from app.utils.cache_codec import decode, encode
+from app.utils.cache_utils import decode_envelope, encode_envelope
+from app.utils.encryption_utils import (decrypt_batch, decrypt_data,
+                                        encrypt_batch, encrypt_data)
+from app.utils.serialization import dumps, loads, to_jsonable
+from benchmarks.generate_data import generate_transactions, user_id
+from benchmarks.results import percentile, save_results
+
+
+def history_documents(rows: int) -> list:
+    # As HISTORY_PROJECTION returns them: amounts already converted to doubles
+    documents = list(generate_transactions(1, rows, seed=7))[:rows]
+    for document in documents:
+        document["transaction_amount"] = float(
+            document["transaction_amount"].to_decimal()
+        )
+    return documents
+
+
+def build_benchmarks(rows: int) -> dict:
+    """Benchmark name -> zero-argument callable doing one operation."""
+    documents = history_documents(rows)
+    stored = list(generate_transactions(1, rows, seed=7))[:rows]
+    page = {"transactions": to_jsonable([transaction_helper(d) for d in documents])}
+    page["next_cursor"] = "abc"
+    encoded_page, _ = encode(page)
+    envelope = encode_envelope(page, 0.01)
+    name = "Bench User 0"
+    encrypted = encrypt_data(name)
+    names = [name] * rows
+    encrypted_names = encrypt_batch(names)
+    state = {
+        "transaction_count": rows,
+        "transaction_sum": 12345.67,
+        "debit_total": 9000.0,
+        "credit_total": 3345.67,
+        "highest_transactions_day": "2024-10-01",
+    }
+
+    def rollup_fold():
+        deltas = {}
+        for document in stored:
+            add_rollup_delta(deltas, document, 1)
+        return deltas
+
+    return {
+        "transaction_helper": lambda: [transaction_helper(d) for d in documents],
+        "transaction_helper_jsonable": lambda: to_jsonable(
+            [transaction_helper(d) for d in documents]
+        ),
+        "encrypt_data": lambda: encrypt_data(name),
+        "decrypt_data": lambda: decrypt_data(encrypted),
+        "encrypt_batch": lambda: encrypt_batch(names),
+        "decrypt_batch": lambda: decrypt_batch(encrypted_names),
+        # The write-path fold whose rollups live analytics are read from
+        "analytics_rollup_fold": rollup_fold,
+        "analytics_from_state": lambda: analytics_from_state(state),
+        "cache_encode_page": lambda: encode(page),
+        "cache_decode_page": lambda: decode(encoded_page),
+        "cache_envelope_roundtrip": lambda: decode_envelope(
+            encode_envelope(page, 0.01)
+        ),
+        "cache_envelope_decode": lambda: decode_envelope(envelope),
+        "response_dumps": lambda: dumps(
+            {"data": page["transactions"], "code": 200, "message": "ok"}
+        ),
+        "response_loads": lambda: loads(dumps(page)),
+    }
+
+
+def run_micro(benchmarks: dict, number: int, repeat: int) -> dict:
+    results = {}
+    for name, func in benchmarks.items():
+        timings = [
+            timing / number * 1e6
+            for timing in timeit.repeat(func, number=number, repeat=repeat)
+        ]
+        results[name] = {
+            "us_per_op": round(min(timings), 3),
+            "median_us": round(statistics.median(timings), 3),
+            "ops_per_second": round(1e6 / min(timings), 1),
+        }
+        print(f"{name:<28} {results[name]['us_per_op']:>12.2f} us/op")
+    return results
+
+
+async def time_async(func, number: int) -> dict:
+    latencies = []
+    for _ in range(number):
+        started = time.perf_counter()
+        await func()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "ops_per_second": round(number / (sum(latencies) / 1000), 1),
+    }
+
+
+async def run_mongo(number: int) -> dict:
+    """Live analytics of the heaviest and a median seeded user, overall and 30 days."""
+    results = {}
+    # The generator's data ends on 2024-12-31
+    ranges = {
+        "all": (None, None),
+        "30d": (datetime(2024, 12, 1), datetime(2024, 12, 31)),
+    }
+    for label, user in (("heavy", user_id(0)), ("median", user_id(500))):
+        for span, (start_date, end_date) in ranges.items():
+            name = f"live_analytics_{label}_{span}"
+            results[name] = await time_async(
+                lambda: aggregate_rollup_analytics(user, start_date, end_date), number
+            )
+            print(f"{name:<28} {results[name]['p50_ms']:>12.2f} ms p50")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100, help="rows per page or batch")
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    parser.add_argument(
+        "--mongo", action="store_true", help="also time live analytics in MongoDB"
+    )
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    benchmarks = build_benchmarks(args.rows)
+    if args.only:
+        benchmarks = {k: v for k, v in benchmarks.items() if args.only in k}
+    results = run_micro(benchmarks, args.number, args.repeat)
+    if args.mongo:
+        results.update(asyncio.run(run_mongo(max(1, args.number // 10))))
+    save_results(args.output, "micro_benchmarks", results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Store benchmark results as JSON and compare two runs for regressions:
+
+    python -m benchmarks.results old.json new.json --threshold 0.10
+
+Every suite writes `{"suite", "metadata", "results"}`, where `results` maps a
+benchmark name to its metrics. Exits non-zero when a metric got worse by more
+than the threshold, so the comparison can gate CI.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+# Metrics where smaller is better; the rest are throughputs
+LOWER_IS_BETTER = {"us_per_op", "median_us", "p50_ms", "p95_ms", "p99_ms", "max_ms"}
+HIGHER_IS_BETTER = {"ops_per_second", "requests_per_second"}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata(args: argparse.Namespace = None) -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args) if args else {},
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def save_results(path: str, suite: str, results: dict, args=None) -> dict:
+    report = {"suite": suite, "metadata": run_metadata(args), "results": results}
+    if path:
+        with open(path, "w") as output:
+            json.dump(report, output, indent=2, default=str)
+        print(f"Results written to {path}")
+    return report
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """One row per shared metric: `(benchmark, metric, old, new, change, regressed)`."""
+    rows = []
+    for name, new_metrics in new["results"].items():
+        old_metrics = old["results"].get(name)
+        if not old_metrics:
+            continue
+        for metric, new_value in new_metrics.items():
+            old_value = old_metrics.get(metric)
+            if metric not in LOWER_IS_BETTER | HIGHER_IS_BETTER or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = change if metric in LOWER_IS_BETTER else -change
+            rows.append((name, metric, old_value, new_value, change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="allowed relative slowdown"
+    )
+    args = parser.parse_args()
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    rows = compare(old, new, args.threshold)
+    for name, metric, old_value, new_value, change, regressed in rows:
+        flag = "REGRESSED" if regressed else "ok"
+        print(
+            f"{flag:<10} {name:<28} {metric:<20} "
+            f"{old_value:>12.2f} -> {new_value:>12.2f} ({change:+.1%})"
+        )
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare the stdlib and orjson paths for a cached history page:
+
+    python -m benchmarks.serialization_benchmark --rows 100 --number 2000
+
+Each path builds the API rows from Mongo documents, writes the cache envelope,
+reads it back and renders the response body, as a cache miss does. The new
+path reads amounts as doubles, as HISTORY_PROJECTION converts them in Mongo.
+"""
+
+import argparse
+import json
+import time
+import timeit
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from fastapi.responses import JSONResponse
+
+from app.api.responses import ORJSONResponse
+from app.crud.transactions_service import transaction_helper
+from app.utils.serialization import SERIALIZERS
+
+
+def make_documents(rows: int, projected: bool = False) -> list:
+    start = datetime(2024, 10, 1, 12, 30, 15, 123456)
+    return [
+        {
+            "_id": ObjectId(),
+            "transaction_date": start - timedelta(hours=i),
+            "transaction_amount": (
+                i * 13 % 5000 + 0.25 if projected else Decimal128(f"{i * 13 % 5000}.25")
+            ),
+            "transaction_type": "debit" if i % 3 else "credit",
+        }
+        for i in range(rows)
+    ]
+
+
+def legacy_row(document: dict) -> dict:
+    # What transaction_helper did before serialization moved into orjson
+    return {
+        "id": str(document["_id"]),
+        "transaction_date": document["transaction_date"].isoformat(),
+        "transaction_amount": float(document["transaction_amount"].to_decimal()),
+        "transaction_type": document["transaction_type"],
+    }
+
+
+def stdlib_path(documents: list) -> bytes:
+    page = {"transactions": [legacy_row(document) for document in documents]}
+    payload = json.dumps({"v": page, "exp": time.time(), "d": 0.0})
+    value = json.loads(payload)["v"]
+    return JSONResponse(
+        {"data": value["transactions"], "code": 200, "message": "ok"}
+    ).body
+
+
+def orjson_path(documents: list) -> bytes:
+    serializer = SERIALIZERS["orjson"]
+    page = {"transactions": [transaction_helper(document) for document in documents]}
+    payload = serializer.dumps({"v": page, "exp": time.time(), "d": 0.0})
+    value = serializer.loads(payload)["v"]
+    return ORJSONResponse(
+        {"data": value["transactions"], "code": 200, "message": "ok"}
+    ).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_documents(args.rows)
+    projected = make_documents(args.rows, projected=True)
+    for document, row in zip(documents, projected):
+        row["_id"] = document["_id"]
+    assert json.loads(stdlib_path(documents)) == json.loads(orjson_path(projected))
+
+    results = {}
+    for name, path, rows in (
+        ("stdlib", stdlib_path, documents),
+        ("orjson", orjson_path, projected),
+    ):
+        timings = timeit.repeat(
+            lambda: path(rows), number=args.number, repeat=args.repeat
+        )
+        results[name] = min(timings) / args.number * 1e6
+        print(f"{name:>7}: {results[name]:9.1f} us per {args.rows}-row page")
+    print(f"speedup: {results['stdlib'] / results['orjson']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import json
+import logging
+import threading
+
+import pytest
+from loguru import logger
+from pytest_mock import MockerFixture
+
+from app.config.config import (LOG_FORMAT, LOG_LEVEL, LOG_LEVELS,
+                               LOG_RATE_LIMIT_INTERVAL, LOG_SAMPLE_RATE)
+from app.config.logging import (QueueSink, configure_logging, null_logger,
+                                rate_limited, rate_limits, sampled)
+
+
+@pytest.fixture
+def records():
+    """Records of everything logged through loguru during the test."""
+    records = []
+    handler_id = logger.add(lambda message: records.append(message.record))
+    rate_limits.clear()
+    yield records
+    logger.remove(handler_id)
+    rate_limits.clear()
+
+
+def test_sampled_keeps_a_share_of_calls(records, mocker: MockerFixture):
+    random = mocker.patch("app.config.logging.random.random")
+
+    random.return_value = 0.7
+    assert sampled(0.5) is null_logger
+    random.return_value = 0.2
+    sampled(0.5).info("kept")
+
+    assert sampled(1.0) is logger
+    assert [record["message"] for record in records] == ["kept"]
+    # Kept records can be scaled back up by their rate
+    assert records[0]["extra"]["sample_rate"] == 0.5
+
+
+def test_rate_limited_counts_suppressed_calls(records, mocker: MockerFixture):
+    monotonic = mocker.patch("app.config.logging.time.monotonic")
+
+    for now in (100.0, 101.0, 105.0, 111.0, 112.0):
+        monotonic.return_value = now
+        rate_limited("redis", interval=10.0).warning("Redis is down")
+    rate_limited("other", interval=10.0).warning("Other message")
+
+    suppressed = [record["extra"].get("suppressed") for record in records]
+    assert suppressed == [None, 2, None]
+    assert rate_limits["redis"] == [111.0, 1]
+
+
+class BlockingStream:
+    """Holds the writer thread in `write` until released."""
+
+    def __init__(self):
+        self.lines = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text: str):
+        self.writing.set()
+        self.release.wait(5)
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_queue_sink_drops_and_counts_lines_past_max_size():
+    stream = BlockingStream()
+    sink = QueueSink(stream, max_size=1)
+
+    sink.write("first\n")
+    assert stream.writing.wait(5)
+    # The writer is busy with the first line; one more fits in the queue
+    for line in ("second\n", "third\n", "fourth\n"):
+        sink.write(line)
+    assert sink.dropped == 2
+
+    stream.release.set()
+    sink.stop()
+
+    assert "".join(stream.lines) == (
+        "first\nsecond\n2 log lines dropped, the log queue was full\n"
+    )
+
+
+@pytest.fixture
+def restore_logging():
+    yield
+    for name in ("app.crud", "uvicorn.access"):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    configure_logging(
+        LOG_LEVEL,
+        dict(entry.strip().rsplit(":", 1) for entry in LOG_LEVELS),
+        format=LOG_FORMAT,
+        enqueue=False,
+        sample_rate=LOG_SAMPLE_RATE,
+        rate_limit_interval=LOG_RATE_LIMIT_INTERVAL,
+    )
+
+
+def test_configure_logging_applies_per_logger_levels(restore_logging, capsys):
+    configure_logging(
+        "WARNING", {"app.crud": "DEBUG", "uvicorn.access": "ERROR"}, enqueue=False
+    )
+
+    crud_logger = logger.patch(
+        lambda record: record.update(name="app.crud.analytics_service")
+    )
+
+    crud_logger.debug("crud debug")
+    logger.info("test info")
+    logger.warning("test warning")
+    logging.getLogger("uvicorn.access").warning("access warning")
+    logging.getLogger("uvicorn.access").error("access error")
+
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [(line["logger"], line["message"]) for line in lines] == [
+        ("app.crud.analytics_service", "crud debug"),
+        (__name__, "test warning"),
+        # Attributed to the caller of the stdlib logger
+        (__name__, "access error"),
+    ]
+    assert logging.getLogger("uvicorn.access").level == logging.ERROR
@@ -0,0 +1,24 @@
+import fakeredis
+import pytest
+from pytest_mock import MockerFixture
+
+# Modules holding their own reference to the shared Redis client
+REDIS_CLIENT_MODULES = (
+    "app.utils.cache_utils",
+    "app.crud.analytics_service",
+    "app.database.migrations",
+    "app.tasks.analytics_feed",
+    "app.tasks.leader_election",
+    "app.tasks.task_queue",
+    "app.tasks.worker",
+    "app.utils.redis_streams",
+)
+
+
+@pytest.fixture
+def fake_redis(mocker: MockerFixture):
+    """An empty in-memory Redis in place of the shared client."""
+    client = fakeredis.FakeAsyncRedis()
+    for module in REDIS_CLIENT_MODULES:
+        mocker.patch(f"{module}.redis_client", client)
+    return client
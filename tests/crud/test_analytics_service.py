@@ -0,0 +1,607 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import pytest
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from pytest_mock import MockerFixture
+
+from app.crud.analytics_service import (ROLLUP_BACKFILL_KEY,
+                                        ROLLUP_BACKFILL_VERSION,
+                                        ROLLUP_REBUILD_GRACE,
+                                        ROLLUP_REPAIR_KEY,
+                                        aggregate_rollup_analytics,
+                                        analytics_document,
+                                        analytics_from_state, bucket_floor,
+                                        compute_and_store_analytics,
+                                        date_range_match, day_key,
+                                        dirty_users_key, iter_set_batches,
+                                        iter_shard_user_batches, next_bucket,
+                                        processing_key,
+                                        range_analytics_pipeline,
+                                        rebuild_rollups, rebuilding_key,
+                                        retrieve_analytics_series,
+                                        retrieve_live_transaction_analytics,
+                                        rollup_analytics_pipeline,
+                                        rollup_build_pipeline, rollups_state,
+                                        series_buckets, series_pipeline,
+                                        update_rollups, user_shard, utc_naive)
+from app.exceptions.exceptions import InvalidOperationError
+
+DIRTY_KEY = dirty_users_key(0)
+
+
+async def members(fake_redis, key: str) -> set:
+    return {user_id.decode() for user_id in await fake_redis.smembers(key)}
+
+
+@pytest.mark.asyncio
+async def test_taken_users_wait_in_processing_set(fake_redis):
+    await fake_redis.sadd(DIRTY_KEY, "u1", "u2")
+
+    batches = [batch async for batch in iter_set_batches(DIRTY_KEY)]
+
+    assert sorted(batches[0]) == ["u1", "u2"]
+    assert await members(fake_redis, DIRTY_KEY) == set()
+    assert await members(fake_redis, processing_key(DIRTY_KEY)) == {"u1", "u2"}
+
+
+@pytest.mark.asyncio
+async def test_users_left_by_a_dead_run_are_taken_again(fake_redis):
+    await fake_redis.sadd(processing_key(DIRTY_KEY), "u1")
+    await fake_redis.sadd(DIRTY_KEY, "u2")
+
+    batches = [batch async for batch in iter_set_batches(DIRTY_KEY)]
+
+    assert sorted(batches[0]) == ["u1", "u2"]
+
+
+@pytest.mark.asyncio
+async def test_incremental_run_clears_processing_set_once_written(
+    fake_redis, mocker: MockerFixture
+):
+    await fake_redis.sadd(DIRTY_KEY, "u1", "u2")
+    refresh_user_analytics = mocker.patch(
+        "app.crud.analytics_service.refresh_user_analytics"
+    )
+
+    summary = await compute_and_store_analytics(
+        incremental=True, shard_index=0, shard_count=1
+    )
+
+    assert summary["users"] == 2
+    assert sorted(refresh_user_analytics.call_args.args[0]) == ["u1", "u2"]
+    assert not await fake_redis.exists(processing_key(DIRTY_KEY))
+
+
+@pytest.mark.asyncio
+async def test_incremental_run_flags_failed_users_again(
+    fake_redis, mocker: MockerFixture
+):
+    await fake_redis.sadd(DIRTY_KEY, "u1")
+    mocker.patch(
+        "app.crud.analytics_service.refresh_user_analytics",
+        side_effect=RuntimeError("mongo down"),
+    )
+
+    summary = await compute_and_store_analytics(
+        incremental=True, shard_index=0, shard_count=1
+    )
+
+    assert summary["failures"] == 1
+    assert await members(fake_redis, DIRTY_KEY) == {"u1"}
+
+
+class AsyncCursor:
+    def __init__(self, documents: list):
+        self.documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+@pytest.mark.asyncio
+async def test_shard_users_come_from_a_distinct_scan(mocker: MockerFixture):
+    users = [f"user-{index}" for index in range(20)]
+    collection = mocker.patch("app.crud.analytics_service.transaction_collection")
+    collection.aggregate.return_value = AsyncCursor(
+        [{"_id": user_id} for user_id in users]
+    )
+
+    batches = [batch async for batch in iter_shard_user_batches(1, 3)]
+
+    pipeline = collection.aggregate.call_args.args[0]
+    assert pipeline == [{"$sort": {"user_id": 1}}, {"$group": {"_id": "$user_id"}}]
+    assert collection.aggregate.call_args.kwargs["hint"] == "user_date_id"
+    assert sum(batches, []) == [
+        user_id for user_id in users if user_shard(user_id, 3) == 1
+    ]
+
+
+@pytest.fixture
+def rollups_not_ready(mocker: MockerFixture):
+    mocker.patch.dict(
+        "app.crud.analytics_service.rollups_state", {"ready": False, "checked_at": 0.0}
+    )
+    migrations = mocker.patch("app.crud.analytics_service.migrations_collection")
+    migrations.find_one = mocker.AsyncMock(return_value=None)
+    return migrations
+
+
+def aggregate_returning(mocker: MockerFixture, collection, states: list):
+    collection.aggregate = mocker.MagicMock()
+    collection.aggregate.return_value.to_list = mocker.AsyncMock(return_value=states)
+
+
+STATE = {
+    "_id": "u1",
+    "transaction_count": 2,
+    "transaction_sum": 30.0,
+    "debit_total": 10.0,
+    "credit_total": 20.0,
+    "highest_transactions_day": "2024-10-08",
+}
+
+
+@pytest.mark.asyncio
+async def test_analytics_come_from_transactions_until_rollups_ready(
+    rollups_not_ready, mocker: MockerFixture
+):
+    transactions = mocker.patch("app.crud.analytics_service.transaction_collection")
+    rollups = mocker.patch("app.crud.analytics_service.rollup_collection")
+    aggregate_returning(mocker, transactions, [STATE])
+    aggregate_returning(mocker, rollups, [STATE])
+
+    analytics = await aggregate_rollup_analytics("u1")
+
+    assert analytics["average_transaction_value"] == 15.0
+    rollups.aggregate.assert_not_called()
+    pipeline = transactions.aggregate.call_args.args[0]
+    assert pipeline[:3] == rollup_build_pipeline({"user_id": "u1"})
+
+    rollups_not_ready.find_one.return_value = {"_id": ROLLUP_BACKFILL_VERSION}
+    rollups_state["checked_at"] = 0.0
+    await aggregate_rollup_analytics("u1")
+
+    pipeline = rollups.aggregate.call_args.args[0]
+    assert pipeline == rollup_analytics_pipeline({"user_id": "u1"})
+    assert rollups_state["ready"]
+
+
+@pytest.mark.asyncio
+async def test_rollup_writes_are_tracked_until_rollups_ready(
+    fake_redis, rollups_not_ready, mocker: MockerFixture
+):
+    rollups = mocker.patch("app.crud.analytics_service.rollup_collection")
+    rollups.bulk_write = mocker.AsyncMock()
+    transaction = {
+        "user_id": "u1",
+        "transaction_date": "2024-10-08T10:00:00",
+        "transaction_amount": 10,
+        "transaction_type": "debit",
+    }
+
+    await update_rollups(added=[transaction])
+
+    assert await members(fake_redis, ROLLUP_BACKFILL_KEY) == {"u1"}
+    rollups.bulk_write.assert_called_once()
+
+
+@pytest.fixture
+def rollups(fake_redis, mocker: MockerFixture):
+    """The rollup collection, with the backfill finished."""
+    mocker.patch.dict("app.crud.analytics_service.rollups_state", {"ready": True})
+    collection = mocker.patch("app.crud.analytics_service.rollup_collection")
+    collection.bulk_write = mocker.AsyncMock()
+    collection.delete_many = mocker.AsyncMock()
+    collection.insert_many = mocker.AsyncMock()
+    return collection
+
+
+def transaction(amount, transaction_type="debit", day="2024-10-08", user_id="u1"):
+    return {
+        "user_id": user_id,
+        "transaction_date": datetime.fromisoformat(f"{day}T10:00:00"),
+        "transaction_amount": Decimal128(str(amount)),
+        "transaction_type": transaction_type,
+    }
+
+
+def increments(rollups) -> dict:
+    operations = rollups.bulk_write.call_args.args[0]
+    return {
+        (operation._filter["user_id"], operation._filter["day"]): {
+            field: value.to_decimal() if isinstance(value, Decimal128) else value
+            for field, value in operation._doc["$inc"].items()
+        }
+        for operation in operations
+    }
+
+
+@pytest.mark.asyncio
+async def test_update_rollups_applies_only_the_difference_of_an_update(rollups):
+    await update_rollups(
+        removed=[transaction(10, "debit")], added=[transaction(25, "credit")]
+    )
+
+    assert increments(rollups) == {
+        ("u1", "2024-10-08"): {
+            "count": 0,
+            "sum": Decimal(15),
+            "debit_total": Decimal(-10),
+            "credit_total": Decimal(25),
+        }
+    }
+    rollups.delete_many.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_update_rollups_moves_a_transaction_between_days(rollups):
+    await update_rollups(
+        removed=[transaction(10, day="2024-10-08")],
+        added=[transaction(10, day="2024-10-09")],
+    )
+
+    changes = increments(rollups)
+    assert changes[("u1", "2024-10-08")]["count"] == -1
+    assert changes[("u1", "2024-10-09")]["count"] == 1
+    rollups.delete_many.assert_called_once_with(
+        {"$or": [{"user_id": "u1", "day": "2024-10-08"}], "count": {"$lte": 0}}
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_rollups_skips_unchanged_days(rollups):
+    await update_rollups(removed=[transaction(10)], added=[transaction(10)])
+
+    rollups.bulk_write.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_update_rollups_queues_repair_when_the_write_fails(
+    fake_redis, rollups
+):
+    rollups.bulk_write.side_effect = RuntimeError("mongo down")
+
+    await update_rollups(added=[transaction(10), transaction(5, user_id="u2")])
+
+    assert await members(fake_redis, ROLLUP_REPAIR_KEY) == {"u1", "u2"}
+
+
+@pytest.mark.asyncio
+async def test_rebuild_rollups_replaces_the_users_rollups(
+    rollups, mocker: MockerFixture
+):
+    rebuilt = [{"user_id": "u1", "day": "2024-10-08", "count": 1}]
+    transactions = mocker.patch("app.crud.analytics_service.transaction_collection")
+    aggregate_returning(mocker, transactions, rebuilt)
+
+    await rebuild_rollups(["u1", "u2"])
+
+    pipeline = transactions.aggregate.call_args.args[0]
+    assert pipeline == rollup_build_pipeline({"user_id": {"$in": ["u1", "u2"]}})
+    rollups.delete_many.assert_called_once_with({"user_id": {"$in": ["u1", "u2"]}})
+    rollups.insert_many.assert_called_once_with(rebuilt, ordered=False)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_rollups_of_users_without_transactions(
+    rollups, mocker: MockerFixture
+):
+    transactions = mocker.patch("app.crud.analytics_service.transaction_collection")
+    aggregate_returning(mocker, transactions, [])
+
+    await rebuild_rollups(["u1"])
+
+    rollups.delete_many.assert_called_once()
+    rollups.insert_many.assert_not_called()
+
+
+def test_rollup_analytics_pipeline_skips_emptied_days_and_breaks_ties_early():
+    match, group = rollup_analytics_pipeline({"user_id": "u1"})
+
+    assert match == {"$match": {"user_id": "u1", "count": {"$gt": 0}}}
+    top = group["$group"]["highest_transactions_day"]["$top"]
+    assert top == {"sortBy": {"count": -1, "day": 1}, "output": "$day"}
+
+
+def test_analytics_from_state_converts_decimal_sums():
+    state = {
+        **STATE,
+        "transaction_sum": Decimal128("30.5"),
+        "debit_total": Decimal128("10.5"),
+        "credit_total": Decimal128("20"),
+    }
+
+    assert analytics_from_state(state) == {
+        "average_transaction_value": 15.25,
+        "highest_transactions_day": "2024-10-08",
+        "debit_total": 10.5,
+        "credit_total": 20.0,
+    }
+
+
+def test_day_key_uses_the_utc_day_of_offset_dates():
+    assert day_key(datetime.fromisoformat("2024-10-08T01:00:00+09:00")) == "2024-10-07"
+    assert day_key(datetime(2024, 10, 8, 1)) == "2024-10-08"
+    assert day_key("2024-10-08T01:00:00") == "2024-10-08"
+
+
+@pytest.mark.asyncio
+async def test_update_rollups_counts_offset_dates_on_their_utc_day(rollups):
+    added = transaction(10)
+    added["transaction_date"] = datetime.fromisoformat("2024-10-08T01:00:00+09:00")
+
+    await update_rollups(added=[added])
+
+    assert list(increments(rollups)) == [("u1", "2024-10-07")]
+
+
+@pytest.mark.asyncio
+async def test_rebuild_flags_users_until_racing_writes_have_checked(
+    fake_redis, rollups, mocker: MockerFixture
+):
+    transactions = mocker.patch("app.crud.analytics_service.transaction_collection")
+    aggregate_returning(mocker, transactions, [])
+
+    await rebuild_rollups(["u1"])
+
+    ttl = await fake_redis.ttl(rebuilding_key("u1"))
+    assert 0 < ttl <= ROLLUP_REBUILD_GRACE
+
+
+@pytest.mark.asyncio
+async def test_write_racing_a_rebuild_queues_a_repair(fake_redis, rollups):
+    await fake_redis.set(rebuilding_key("u1"), 1)
+
+    await update_rollups(added=[transaction(10), transaction(5, user_id="u2")])
+
+    assert await members(fake_redis, ROLLUP_REPAIR_KEY) == {"u1"}
+
+
+@pytest.fixture
+def rollups_ready(mocker: MockerFixture):
+    mocker.patch.dict("app.crud.analytics_service.rollups_state", {"ready": True})
+
+
+@pytest.mark.asyncio
+async def test_range_reads_whole_days_from_rollups_and_edges_from_transactions(
+    rollups_ready,
+):
+    start, end = datetime(2024, 10, 8, 1, 5), datetime(2024, 10, 11, 12)
+
+    pipeline = await range_analytics_pipeline("u1", start, end)
+
+    edges = pipeline[0]["$match"]["$or"]
+    assert edges == [
+        date_range_match(datetime(2024, 10, 11), end, inclusive=True),
+        date_range_match(start, datetime(2024, 10, 9)),
+    ]
+    [whole_days] = pipeline[3]["$unionWith"]["pipeline"]
+    assert whole_days["$match"] == {
+        "user_id": "u1",
+        "day": {"$gte": "2024-10-09", "$lt": "2024-10-11"},
+    }
+
+
+@pytest.mark.asyncio
+async def test_range_starting_at_midnight_has_no_partial_first_day(rollups_ready):
+    pipeline = await range_analytics_pipeline(
+        "u1", datetime(2024, 10, 8), datetime(2024, 10, 11, 12)
+    )
+
+    assert len(pipeline[0]["$match"]["$or"]) == 1
+    day_range = pipeline[3]["$unionWith"]["pipeline"][0]["$match"]["day"]
+    assert day_range == {"$gte": "2024-10-08", "$lt": "2024-10-11"}
+
+
+@pytest.mark.asyncio
+async def test_range_within_a_day_reads_only_transactions(rollups_ready):
+    start, end = datetime(2024, 10, 8, 1), datetime(2024, 10, 9, 12)
+
+    pipeline = await range_analytics_pipeline("u1", start, end)
+
+    assert pipeline[0]["$match"] == {
+        "user_id": "u1",
+        **date_range_match(start, end, inclusive=True),
+    }
+    assert not any("$unionWith" in stage for stage in pipeline)
+
+
+@pytest.mark.asyncio
+async def test_range_reads_only_transactions_until_rollups_ready(rollups_not_ready):
+    pipeline = await range_analytics_pipeline(
+        "u1", datetime(2024, 10, 1), datetime(2024, 10, 30)
+    )
+
+    assert not any("$unionWith" in stage for stage in pipeline)
+
+
+@pytest.mark.asyncio
+async def test_range_cache_key_is_the_same_for_equal_instants(mocker: MockerFixture):
+    cached_load = mocker.patch("app.crud.analytics_service.cached_load")
+
+    await retrieve_live_transaction_analytics(
+        "u1",
+        datetime.fromisoformat("2024-10-08T09:00:00+09:00"),
+        datetime.fromisoformat("2024-10-09T09:00:00+09:00"),
+    )
+    await retrieve_live_transaction_analytics(
+        "u1", datetime(2024, 10, 8), datetime(2024, 10, 9)
+    )
+
+    first, second = [call.args[1] for call in cached_load.call_args_list]
+    assert first == second
+
+
+PARIS = ZoneInfo("Europe/Paris")
+UTC = ZoneInfo("UTC")
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def duration(start: datetime, end: datetime) -> timedelta:
+    # Aware datetimes sharing a tzinfo subtract as wall-clock times
+    return end.astimezone(timezone.utc) - start.astimezone(timezone.utc)
+
+
+def test_hour_buckets_repeat_the_hour_clocks_go_back():
+    buckets = series_buckets(
+        utc(2024, 10, 26, 23, 30), utc(2024, 10, 27, 2, 30), "hour", PARIS
+    )
+
+    assert [start.isoformat() for start, _ in buckets] == [
+        "2024-10-27T01:00:00+02:00",
+        "2024-10-27T02:00:00+02:00",
+        "2024-10-27T02:00:00+01:00",
+        "2024-10-27T03:00:00+01:00",
+    ]
+    for start, end in buckets:
+        assert duration(start, end) == timedelta(hours=1)
+
+
+def test_day_bucket_the_clocks_go_back_lasts_25_hours():
+    [(start, end)] = series_buckets(
+        datetime(2024, 10, 27, 12, tzinfo=PARIS),
+        datetime(2024, 10, 27, 18, tzinfo=PARIS),
+        "day",
+        PARIS,
+    )
+
+    assert start.isoformat() == "2024-10-27T00:00:00+02:00"
+    assert end.isoformat() == "2024-10-28T00:00:00+01:00"
+    assert duration(start, end) == timedelta(hours=25)
+
+
+def test_week_buckets_start_on_monday():
+    # 2024-10-27 is a Sunday
+    start = bucket_floor(datetime(2024, 10, 27, 12, tzinfo=PARIS), "week", PARIS)
+
+    assert start.isoformat() == "2024-10-21T00:00:00+02:00"
+    assert bucket_floor(start, "week", PARIS) == start
+    assert next_bucket(start, "week", PARIS).isoformat() == "2024-10-28T00:00:00+01:00"
+
+
+def test_month_buckets_roll_over_into_january():
+    buckets = series_buckets(utc(2024, 12, 15), utc(2025, 1, 15), "month", UTC)
+
+    assert [(start.date(), end.date()) for start, end in buckets] == [
+        (date(2024, 12, 1), date(2025, 1, 1)),
+        (date(2025, 1, 1), date(2025, 2, 1)),
+    ]
+
+
+def test_series_buckets_are_capped(mocker: MockerFixture):
+    mocker.patch("app.crud.analytics_service.ANALYTICS_SERIES_MAX_BUCKETS", 3)
+
+    assert len(series_buckets(utc(2024, 10, 1), utc(2024, 10, 3), "day", UTC)) == 3
+    with pytest.raises(InvalidOperationError):
+        series_buckets(utc(2024, 10, 1), utc(2024, 10, 4), "day", UTC)
+
+
+def aggregate_yielding(mocker: MockerFixture, collection, groups: list):
+    async def iterate():
+        for group in groups:
+            yield group
+
+    collection.aggregate = mocker.MagicMock(side_effect=lambda pipeline: iterate())
+
+
+def series_group(start: datetime, count: int, total) -> dict:
+    return {
+        "_id": start,
+        "count": count,
+        "total": total,
+        "debit_total": total,
+        "credit_total": 0.0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_series_matches_groups_to_repeated_local_hours(
+    fake_redis, mocker: MockerFixture
+):
+    transactions = mocker.patch("app.crud.analytics_service.transaction_collection")
+    # Groups come back keyed by their naive UTC start
+    aggregate_yielding(
+        mocker,
+        transactions,
+        [
+            series_group(datetime(2024, 10, 27, 0), 1, Decimal128("10")),
+            series_group(datetime(2024, 10, 27, 1), 2, 30.0),
+        ],
+    )
+
+    series = await retrieve_analytics_series(
+        "u1", utc(2024, 10, 26, 23), utc(2024, 10, 27, 1, 30), "hour", "Europe/Paris"
+    )
+
+    assert [
+        (bucket["start"], bucket["count"], bucket["total"])
+        for bucket in series["buckets"]
+    ] == [
+        ("2024-10-27T01:00:00+02:00", 0, 0.0),
+        ("2024-10-27T02:00:00+02:00", 1, 10.0),
+        ("2024-10-27T02:00:00+01:00", 2, 30.0),
+    ]
+    assert series["buckets"][2]["average"] == 15.0
+
+
+@pytest.mark.asyncio
+async def test_series_aggregates_only_the_open_bucket_once_closed_are_cached(
+    fake_redis, mocker: MockerFixture
+):
+    transactions = mocker.patch("app.crud.analytics_service.transaction_collection")
+    aggregate_yielding(mocker, transactions, [])
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    first = await retrieve_analytics_series("u1", now - timedelta(days=2), now)
+    second = await retrieve_analytics_series("u1", now - timedelta(days=2), now)
+
+    assert second == first
+    assert len(first["buckets"]) == 3
+    tomorrow = utc_naive(today + timedelta(days=1))
+    first_pipeline, second_pipeline = [
+        call.args[0] for call in transactions.aggregate.call_args_list
+    ]
+    assert first_pipeline == series_pipeline(
+        "u1", utc_naive(today - timedelta(days=2)), tomorrow, "day", "UTC"
+    )
+    # The two closed days now come from the cache
+    assert second_pipeline == series_pipeline(
+        "u1", utc_naive(today), tomorrow, "day", "UTC"
+    )
+
+
+def test_analytics_document_converts_bson_values_once_validated():
+    analytics = {
+        "_id": ObjectId("65f0c0ffee00000000000001"),
+        "user_id": "u1",
+        "average_transaction_value": 15.0,
+        "highest_transactions_day": datetime(2024, 10, 8),
+        "debit_total": 10.0,
+        "credit_total": 20.0,
+        "last_updated": datetime(2024, 10, 9, 12, 30, 0, 250000),
+    }
+
+    document = analytics_document(analytics)
+
+    assert document == {
+        "_id": "65f0c0ffee00000000000001",
+        "user_id": "u1",
+        "average_transaction_value": 15.0,
+        "highest_transactions_day": "2024-10-08T00:00:00",
+        "debit_total": 10.0,
+        "credit_total": 20.0,
+        "last_updated": "2024-10-09T12:30:00.250000",
+    }
@@ -0,0 +1,261 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import AutoReconnect
+from pytest_mock import MockerFixture
+
+from app.crud.transactions_service import (HISTORY_PROJECTION,
+                                           add_transactions_bulk,
+                                           decode_history_cursor,
+                                           delete_transaction,
+                                           encode_history_cursor,
+                                           fetch_transaction_history_from_db,
+                                           update_transaction)
+from app.exceptions.exceptions import (EntityDoesNotExistError,
+                                       InvalidOperationError)
+
+RECORDS = [
+    (
+        0,
+        {
+            "user_id": "1",
+            "full_name": "A",
+            "transaction_amount": 10,
+            "transaction_type": "debit",
+        },
+    ),
+    (
+        1,
+        {
+            "user_id": "2",
+            "full_name": "B",
+            "transaction_amount": 20,
+            "transaction_type": "credit",
+        },
+    ),
+    (2, {"user_id": "3", "transaction_amount": 30}),
+]
+
+
+def patch_bulk_dependencies(mocker: MockerFixture, insert_many):
+    mocker.patch(
+        "app.crud.transactions_service.crypto_service.encrypt_many",
+        side_effect=lambda names: names,
+    )
+    collection = mocker.patch("app.crud.transactions_service.transaction_collection")
+    collection.insert_many = mocker.AsyncMock(side_effect=insert_many)
+    return (
+        mocker.patch("app.crud.transactions_service.update_rollups"),
+        mocker.patch("app.crud.transactions_service.finalize_bulk_ingest"),
+        mocker.patch("app.crud.transactions_service.queue_rollup_repair"),
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_transactions_bulk_flags_users_of_each_chunk(mocker: MockerFixture):
+    def insert_many(documents, ordered):
+        for document in documents:
+            document["_id"] = ObjectId()
+
+    update_rollups, finalize_bulk_ingest, queue_rollup_repair = (
+        patch_bulk_dependencies(mocker, insert_many)
+    )
+
+    results = await add_transactions_bulk(RECORDS)
+
+    assert [result["status"] for result in results] == ["created", "created", "invalid"]
+    assert len(update_rollups.call_args.kwargs["added"]) == 2
+    finalize_bulk_ingest.assert_called_once_with({"1", "2"})
+    queue_rollup_repair.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_add_transactions_bulk_failed_insert_still_flags_users(
+    mocker: MockerFixture,
+):
+    update_rollups, finalize_bulk_ingest, queue_rollup_repair = (
+        patch_bulk_dependencies(mocker, AutoReconnect("connection reset"))
+    )
+
+    with pytest.raises(AutoReconnect):
+        await add_transactions_bulk(RECORDS)
+
+    update_rollups.assert_not_called()
+    assert set(queue_rollup_repair.call_args.args) == {"1", "2"}
+    finalize_bulk_ingest.assert_called_once_with({"1", "2"})
+
+
+STORED = {
+    "_id": ObjectId(),
+    "user_id": "1",
+    "transaction_amount": 10,
+    "transaction_type": "debit",
+    "transaction_date": "2024-10-08T10:00:00",
+}
+
+
+def patch_write_dependencies(mocker: MockerFixture):
+    collection = mocker.patch("app.crud.transactions_service.transaction_collection")
+    collection.find_one_and_update = mocker.AsyncMock(return_value=None)
+    collection.find_one_and_delete = mocker.AsyncMock(return_value=None)
+    mocker.patch("app.crud.transactions_service.notify_analytics")
+    mocker.patch("app.crud.transactions_service.bump_cache_generation")
+    return collection, mocker.patch("app.crud.transactions_service.update_rollups")
+
+
+@pytest.mark.asyncio
+async def test_update_transaction_replaces_the_values_it_overwrote(
+    mocker: MockerFixture,
+):
+    collection, update_rollups = patch_write_dependencies(mocker)
+    collection.find_one_and_update.return_value = STORED
+
+    assert await update_transaction(str(STORED["_id"]), {"transaction_amount": 25})
+
+    query, update = collection.find_one_and_update.call_args.args
+    assert query == {"_id": STORED["_id"]}
+    assert update["$set"]["transaction_amount"] == Decimal128("25")
+    assert (
+        collection.find_one_and_update.call_args.kwargs["return_document"]
+        == ReturnDocument.BEFORE
+    )
+    rollup_changes = update_rollups.call_args.kwargs
+    assert rollup_changes["removed"] == [STORED]
+    assert rollup_changes["added"][0]["transaction_amount"] == Decimal128("25")
+
+
+@pytest.mark.asyncio
+async def test_update_of_a_missing_transaction_leaves_rollups_alone(
+    mocker: MockerFixture,
+):
+    _, update_rollups = patch_write_dependencies(mocker)
+
+    with pytest.raises(EntityDoesNotExistError):
+        await update_transaction(str(ObjectId()), {"transaction_amount": 25})
+    update_rollups.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_only_the_delete_that_removed_a_transaction_updates_rollups(
+    mocker: MockerFixture,
+):
+    collection, update_rollups = patch_write_dependencies(mocker)
+    collection.find_one_and_delete.side_effect = [STORED, None]
+
+    assert await delete_transaction(str(STORED["_id"]))
+    with pytest.raises(EntityDoesNotExistError):
+        await delete_transaction(str(STORED["_id"]))
+
+    update_rollups.assert_called_once_with(removed=[STORED])
+
+
+def history_row(day: int, transaction_date=None) -> dict:
+    return {
+        "_id": ObjectId(f"{day:024x}"),
+        "transaction_date": transaction_date or datetime(2024, 10, day),
+        "transaction_amount": 10.0,
+        "transaction_type": "debit",
+    }
+
+
+def patch_history_find(mocker: MockerFixture, rows: list):
+    collection = mocker.patch("app.crud.transactions_service.transaction_collection")
+    cursor = collection.find.return_value
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = mocker.AsyncMock(return_value=rows)
+    return collection
+
+
+def test_history_cursor_round_trips_the_last_row():
+    row = history_row(8)
+
+    position = decode_history_cursor(encode_history_cursor(row))
+
+    # Decoded as aware UTC, which Mongo matches like the naive stored date
+    assert position == {
+        "transaction_date": row["transaction_date"].replace(tzinfo=timezone.utc),
+        "_id": row["_id"],
+    }
+    # String dates left by the backfill keep their type too
+    row = history_row(8, "2024-10-08T00:00:00")
+    assert decode_history_cursor(encode_history_cursor(row)) == {
+        "transaction_date": "2024-10-08T00:00:00",
+        "_id": row["_id"],
+    }
+    with pytest.raises(InvalidOperationError):
+        decode_history_cursor("not-a-cursor")
+
+
+@pytest.mark.asyncio
+async def test_history_first_page_has_next_cursor_only_with_an_extra_row(
+    mocker: MockerFixture,
+):
+    rows = [history_row(day) for day in (9, 8, 7)]
+    collection = patch_history_find(mocker, rows)
+
+    page = await fetch_transaction_history_from_db("u1", None, limit=2)
+
+    collection.find.assert_called_once_with({"user_id": "u1"}, HISTORY_PROJECTION)
+    cursor = collection.find.return_value
+    cursor.sort.assert_called_once_with(
+        [("transaction_date", DESCENDING), ("_id", DESCENDING)]
+    )
+    cursor.limit.assert_called_once_with(3)
+    cursor.to_list.assert_called_once_with(length=3)
+    assert [row["id"] for row in page["transactions"]] == [
+        rows[0]["_id"],
+        rows[1]["_id"],
+    ]
+    # The next page starts after the last row served, not the extra one
+    assert decode_history_cursor(page["next_cursor"])["_id"] == rows[1]["_id"]
+
+    cursor.to_list.return_value = rows[:2]
+    page = await fetch_transaction_history_from_db("u1", None, limit=2)
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_history_seeks_past_the_cursor_including_string_dates(
+    mocker: MockerFixture,
+):
+    last = history_row(8)
+    collection = patch_history_find(mocker, [history_row(7)])
+
+    await fetch_transaction_history_from_db(
+        "u1", encode_history_cursor(last), limit=2
+    )
+
+    query = collection.find.call_args.args[0]
+    date = last["transaction_date"].replace(tzinfo=timezone.utc)
+    assert query == {
+        "user_id": "u1",
+        "$or": [
+            {"transaction_date": {"$lt": date}},
+            {"transaction_date": date, "_id": {"$lt": last["_id"]}},
+            # Dates sort before strings descending, so strings all come after
+            {"transaction_date": {"$type": "string"}},
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_history_seek_from_a_string_date_stays_among_strings(
+    mocker: MockerFixture,
+):
+    last = history_row(8, "2024-10-08T00:00:00")
+    collection = patch_history_find(mocker, [])
+
+    page = await fetch_transaction_history_from_db(
+        "u1", encode_history_cursor(last), limit=2
+    )
+
+    assert page == {"transactions": [], "next_cursor": None}
+    query = collection.find.call_args.args[0]
+    assert query["$or"] == [
+        {"transaction_date": {"$lt": "2024-10-08T00:00:00"}},
+        {"transaction_date": "2024-10-08T00:00:00", "_id": {"$lt": last["_id"]}},
+    ]
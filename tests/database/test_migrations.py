@@ -0,0 +1,178 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+from pytest_mock import MockerFixture
+
+from app.config.config import (FIDO_ANALYTICS_COLLECTION,
+                               FIDO_DAILY_ROLLUP_COLLECTION,
+                               FIDO_TRANSACTIONS_COLLECTION)
+from app.crud.analytics_service import (ROLLUP_BACKFILL_KEY,
+                                        ROLLUP_BACKFILL_VERSION,
+                                        processing_key)
+from app.database.migrations import (MIGRATION_OWNER,
+                                     ROLLUP_STAGING_COLLECTION, MigrationRun,
+                                     backfill_daily_rollups, claim_migration,
+                                     recompute_watermark_analytics,
+                                     run_migration)
+
+
+def fake_db(mocker: MockerFixture):
+    collection = mocker.MagicMock()
+    collection.insert_one = mocker.AsyncMock()
+    collection.update_one = mocker.AsyncMock()
+    collection.find_one_and_update = mocker.AsyncMock()
+    return {"_migrations": collection}, collection
+
+
+@pytest.mark.asyncio
+async def test_claim_migration_takes_over_stale_claim(mocker: MockerFixture):
+    db, collection = fake_db(mocker)
+    collection.insert_one.side_effect = DuplicateKeyError("E11000")
+    collection.find_one_and_update.return_value = {
+        "_id": 2,
+        "status": "running",
+        "progress": {"last_id": "abc", "converted": 1000},
+    }
+
+    run = await claim_migration(db, 2, "backfill")
+
+    assert run.progress == {"last_id": "abc", "converted": 1000}
+    query, update = collection.find_one_and_update.call_args.args
+    assert query["status"] == {"$ne": "applied"}
+    assert update["$set"]["owner"] == MIGRATION_OWNER
+
+
+@pytest.mark.asyncio
+async def test_claim_migration_skips_live_claim(mocker: MockerFixture):
+    db, collection = fake_db(mocker)
+    collection.insert_one.side_effect = DuplicateKeyError("E11000")
+    collection.find_one_and_update.return_value = None
+
+    assert await claim_migration(db, 2, "backfill") is None
+
+
+@pytest.mark.asyncio
+async def test_run_migration_records_progress_when_interrupted(mocker: MockerFixture):
+    db, collection = fake_db(mocker)
+    started = asyncio.Event()
+
+    async def backfill(db, run: MigrationRun):
+        await run.checkpoint(last_id="abc")
+        started.set()
+        await asyncio.sleep(60)
+
+    task = asyncio.create_task(run_migration(db, MigrationRun(db, 2), "", backfill))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    query, update = collection.update_one.call_args.args
+    assert query == {"_id": 2, "owner": MIGRATION_OWNER}
+    assert update == {"$set": {"status": "interrupted", "heartbeat_at": None}}
+
+
+@pytest.mark.asyncio
+async def test_run_migration_marks_applied(mocker: MockerFixture):
+    db, collection = fake_db(mocker)
+
+    async def create_indexes(db, run: MigrationRun):
+        pass
+
+    await run_migration(db, MigrationRun(db, 1), "", create_indexes)
+
+    update = collection.update_one.call_args.args[1]["$set"]
+    assert update["status"] == "applied"
+    assert isinstance(update["applied_at"], datetime)
+
+
+def fake_rollup_db(mocker: MockerFixture, staging_exists: bool = True):
+    collections = {}
+
+    def collection(name):
+        if name not in collections:
+            collections[name] = mocker.MagicMock()
+            collections[name].aggregate.return_value.to_list = mocker.AsyncMock()
+            collections[name].create_indexes = mocker.AsyncMock()
+            collections[name].rename = mocker.AsyncMock()
+        return collections[name]
+
+    db = mocker.MagicMock()
+    db.__getitem__.side_effect = collection
+    db.list_collection_names = mocker.AsyncMock(
+        return_value=[ROLLUP_STAGING_COLLECTION] if staging_exists else []
+    )
+    return db, collection
+
+
+@pytest.mark.asyncio
+async def test_backfill_daily_rollups_swaps_staging_then_rebuilds_tracked_users(
+    fake_redis, mocker: MockerFixture
+):
+    db, collection = fake_rollup_db(mocker)
+    run = MigrationRun(db, ROLLUP_BACKFILL_VERSION)
+    checkpoint = mocker.patch.object(run, "checkpoint", side_effect=run.progress.update)
+    rebuild_rollups = mocker.patch("app.database.migrations.rebuild_rollups")
+    mocker.patch("app.database.migrations.ROLLUPS_READY_GRACE", 0)
+    await fake_redis.sadd(ROLLUP_BACKFILL_KEY, "u1")
+
+    await backfill_daily_rollups(db, run)
+
+    pipeline = collection(FIDO_TRANSACTIONS_COLLECTION).aggregate.call_args.args[0]
+    assert pipeline[-1] == {"$out": ROLLUP_STAGING_COLLECTION}
+    collection(ROLLUP_STAGING_COLLECTION).rename.assert_called_once_with(
+        FIDO_DAILY_ROLLUP_COLLECTION, dropTarget=True
+    )
+    rebuild_rollups.assert_called_once_with(["u1"])
+    assert [call.kwargs.get("stage") for call in checkpoint.call_args_list] == [
+        "built",
+        "swapped",
+        None,
+        "ready",
+    ]
+    assert not await fake_redis.exists(processing_key(ROLLUP_BACKFILL_KEY))
+
+
+@pytest.mark.asyncio
+async def test_backfill_daily_rollups_resumes_after_the_rename(
+    fake_redis, mocker: MockerFixture
+):
+    db, collection = fake_rollup_db(mocker, staging_exists=False)
+    run = MigrationRun(db, ROLLUP_BACKFILL_VERSION, {"stage": "built"})
+    mocker.patch.object(run, "checkpoint", side_effect=run.progress.update)
+    mocker.patch("app.database.migrations.ROLLUPS_READY_GRACE", 0)
+
+    await backfill_daily_rollups(db, run)
+
+    collection(FIDO_TRANSACTIONS_COLLECTION).aggregate.assert_not_called()
+    collection(ROLLUP_STAGING_COLLECTION).rename.assert_not_called()
+    assert run.progress["stage"] == "ready"
+
+
+@pytest.mark.asyncio
+async def test_recompute_watermark_analytics_resumes_and_recomputes_in_batches(
+    mocker: MockerFixture,
+):
+    db, collection = fake_rollup_db(mocker)
+    cursor = collection(FIDO_ANALYTICS_COLLECTION).find.return_value
+    cursor.sort.return_value.limit.return_value.to_list = mocker.AsyncMock(
+        side_effect=[[{"_id": 5, "user_id": "u1"}, {"_id": 7, "user_id": "u2"}], []]
+    )
+    run = MigrationRun(db, 4, {"last_id": 3, "recomputed": 10})
+    mocker.patch.object(run, "checkpoint", side_effect=run.progress.update)
+    refresh_user_analytics = mocker.patch(
+        "app.database.migrations.refresh_user_analytics"
+    )
+    writer = mocker.patch("app.database.migrations.AnalyticsBatchWriter")
+    writer.return_value.flush = mocker.AsyncMock()
+    mocker.patch("app.database.migrations.asyncio.sleep")
+
+    await recompute_watermark_analytics(db, run)
+
+    first_query = collection(FIDO_ANALYTICS_COLLECTION).find.call_args_list[0].args[0]
+    assert first_query == {"watermark": {"$exists": True}, "_id": {"$gt": 3}}
+    assert refresh_user_analytics.call_args.args[0] == ["u1", "u2"]
+    writer.return_value.flush.assert_called_once()
+    assert run.progress == {"last_id": 7, "recomputed": 12}
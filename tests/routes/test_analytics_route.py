@@ -116,3 +116,122 @@ async def test_get_range_transaction_analytics_not_found(mocker: MockerFixture):
     mock_retrieve_live_transaction_analytics.assert_called_once_with(
         user_id, datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
     )
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_analytics_series_success(mocker: MockerFixture):
+    user_id = "12345"
+    start_date = "2024-10-01T00:00:00"
+    end_date = "2024-10-02T00:00:00"
+    series = {
+        "user_id": user_id,
+        "granularity": "day",
+        "timezone": "Europe/Paris",
+        "buckets": [
+            {
+                "start": "2024-10-01T00:00:00+02:00",
+                "count": 2,
+                "total": 30.0,
+                "average": 15.0,
+                "debit_total": 10.0,
+                "credit_total": 20.0,
+            },
+            {
+                "start": "2024-10-02T00:00:00+02:00",
+                "count": 0,
+                "total": 0.0,
+                "average": 0.0,
+                "debit_total": 0.0,
+                "credit_total": 0.0,
+            },
+        ],
+    }
+    mock_retrieve_analytics_series = mocker.patch(
+        "app.api.routes.analytics.retrieve_analytics_series",
+        return_value=series,
+    )
+
+    response = client.get(
+        f"{PREFIX}/series/{user_id}?start_date={start_date}&end_date={end_date}"
+        "&granularity=day&tz=Europe/Paris"
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "code": 200,
+        "data": series,
+        "message": "Transaction analytics series retrieved successfully",
+    }
+    mock_retrieve_analytics_series.assert_called_once_with(
+        user_id,
+        datetime.fromisoformat(start_date),
+        datetime.fromisoformat(end_date),
+        "day",
+        "Europe/Paris",
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_analytics_series_invalid_granularity(
+    mocker: MockerFixture,
+):
+    mock_retrieve_analytics_series = mocker.patch(
+        "app.api.routes.analytics.retrieve_analytics_series"
+    )
+
+    response = client.get(
+        f"{PREFIX}/series/12345?start_date=2024-10-01&end_date=2024-10-02"
+        "&granularity=minute"
+    )
+
+    assert response.status_code == 422
+    mock_retrieve_analytics_series.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_analytics_batch_success(mocker: MockerFixture):
+    analytics = {
+        "12345": {
+            "status": "found",
+            "analytics": {
+                "user_id": "12345",
+                "average_transaction_value": 100.0,
+                "highest_transactions_day": "2023-10-06",
+                "debit_total": 50.0,
+                "credit_total": 150.0,
+                "last_updated": "2023-10-06T00:00:00",
+            },
+        },
+        "67890": {
+            "status": "not_found",
+            "error": "Transaction analytics not found for user ID 67890",
+        },
+    }
+    mock_retrieve_transaction_analytics_many = mocker.patch(
+        "app.api.routes.analytics.retrieve_transaction_analytics_many",
+        return_value=analytics,
+    )
+
+    response = client.post(f"{PREFIX}/batch", json={"user_ids": ["12345", "67890"]})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "code": 200,
+        "data": analytics,
+        "message": "Transaction analytics retrieved successfully",
+    }
+    mock_retrieve_transaction_analytics_many.assert_called_once_with(
+        ["12345", "67890"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_analytics_batch_empty(mocker: MockerFixture):
+    mock_retrieve_transaction_analytics_many = mocker.patch(
+        "app.api.routes.analytics.retrieve_transaction_analytics_many"
+    )
+
+    response = client.post(f"{PREFIX}/batch", json={"user_ids": []})
+
+    assert response.status_code == 422
+    mock_retrieve_transaction_analytics_many.assert_not_called()
@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+
+from app.main import app
+
+client = TestClient(app)
+PREFIX = "/api/v1/cache"
+
+
+@pytest.mark.asyncio
+async def test_get_cache_stats(mocker: MockerFixture):
+    stats = {
+        "l1": {"hits": 3, "misses": 1, "evictions": 0, "entries": 1, "bytes": 120},
+        "redis": {"hits": 1, "misses": 0},
+    }
+    mocker.patch("app.api.routes.cache.cache_stats", return_value=stats)
+
+    response = client.get(f"{PREFIX}/stats")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "data": stats,
+        "message": "Cache statistics retrieved successfully",
+        "code": 200,
+    }
@@ -0,0 +1,37 @@
+import pytest
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+
+from app.main import app
+
+client = TestClient(app)
+
+
+@pytest.mark.asyncio
+async def test_metrics_label_requests_by_route_template(mocker: MockerFixture):
+    mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction",
+        return_value={"id": "metrics-67890", "transaction_type": "credit"},
+    )
+    client.get("/api/v1/transaction/metrics-67890")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/api/v1/transaction/{id}",status="200"}'
+    ) in body
+    assert "metrics-67890" not in body
+
+
+@pytest.mark.asyncio
+async def test_metrics_label_unknown_paths_as_unmatched():
+    client.get("/no-such-path/12345")
+
+    response = client.get("/metrics")
+
+    assert 'route="unmatched",status="404"' in response.text
+    assert "no-such-path" not in response.text
@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+from starlette.datastructures import Secret
+
+from app.main import app
+from app.utils.request_timing import add_timing
+
+client = TestClient(app)
+PREFIX = "/api/v1/transaction"
+TRANSACTION = {"id": "67890", "transaction_type": "credit"}
+
+
+async def retrieve_transaction(id: str) -> dict:
+    add_timing("mongo", 0.005)
+    add_timing("mongo", 0.0025)
+    return TRANSACTION
+
+
+@pytest.mark.asyncio
+async def test_server_timing_header_breaks_down_request(mocker: MockerFixture):
+    mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction", new=retrieve_transaction
+    )
+
+    response = client.get(f"{PREFIX}/67890")
+
+    assert response.status_code == 200
+    server_timing = response.headers["server-timing"]
+    assert "mongo;dur=7.50" in server_timing
+    assert "serialization;dur=" in server_timing
+    assert "total;dur=" in server_timing
+
+
+@pytest.mark.asyncio
+async def test_profile_header_needs_the_token(mocker: MockerFixture):
+    mocker.patch("app.api.middleware.PROFILING_TOKEN", Secret("let-me-in"))
+    mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction", new=retrieve_transaction
+    )
+
+    response = client.get(f"{PREFIX}/67890", headers={"X-Profile": "guess"})
+
+    assert response.status_code == 200
+    assert response.json()["data"] == TRANSACTION
+
+
+@pytest.mark.asyncio
+async def test_profile_header_with_non_ascii_bytes_is_not_a_match(
+    mocker: MockerFixture,
+):
+    mocker.patch("app.api.middleware.PROFILING_TOKEN", Secret("let-me-in"))
+    mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction", new=retrieve_transaction
+    )
+
+    response = client.get(
+        f"{PREFIX}/67890", headers={"X-Profile": "caf\u00e9".encode()}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["data"] == TRANSACTION
+
+
+@pytest.mark.asyncio
+async def test_profile_header_returns_report(mocker: MockerFixture):
+    pytest.importorskip("pyinstrument")
+    mocker.patch("app.api.middleware.PROFILING_TOKEN", Secret("let-me-in"))
+    mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction", new=retrieve_transaction
+    )
+
+    response = client.get(f"{PREFIX}/67890", headers={"X-Profile": "let-me-in"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert response.headers["x-profiled-status"] == "200"
+    assert "mongo;dur=7.50" in response.headers["server-timing"]
@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+
+from app.main import app
+
+client = TestClient(app)
+PREFIX = "/api/v1/scheduler"
+
+
+@pytest.mark.asyncio
+async def test_get_scheduler_status(mocker: MockerFixture):
+    status = {
+        "leader": "pod-1:42:ab12cd34",
+        "lease_remaining_ms": 24000,
+        "fencing_token": 7,
+        "instance_id": "pod-2:43:ef56ab78",
+        "is_leader": False,
+        "last_runs": {
+            "compute_and_store_analytics": {
+                "instance_id": "pod-1:42:ab12cd34",
+                "fencing_token": 7,
+                "started_at": "2024-10-01T12:00:00",
+                "finished_at": "2024-10-01T12:00:03",
+                "result": {"users": 10, "failures": 0},
+                "error": None,
+            }
+        },
+    }
+    mocker.patch("app.api.routes.scheduler.scheduler_status", return_value=status)
+
+    response = client.get(f"{PREFIX}/status")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "data": status,
+        "message": "Scheduler status retrieved successfully",
+        "code": 200,
+    }
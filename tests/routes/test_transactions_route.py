@@ -10,11 +10,15 @@ from app.api.routes.transactions import (delete_transaction_data,
                                          get_transaction_data,
                                          get_transaction_history,
                                          update_transaction_data)
-from app.exceptions.exceptions import EntityDoesNotExistError, ServiceError
+from app.exceptions.exceptions import (EntityDoesNotExistError,
+                                       InvalidOperationError, ServiceError)
 from app.main import app
 from app.models.analytics_model import AnalyticsModel
 from app.models.transaction_model import (ResponseModel, TransactionModel,
                                           UpdateTransactionModel)
+from app.tasks.background_tasks import (alert_relevant_systems,
+                                        recalculate_credit_scores,
+                                        update_user_statistics)
 
 client = TestClient(app)
 PREFIX = "/api/v1/transaction"
@@ -62,7 +66,7 @@ async def test_get_transaction_history_success(mocker: MockerFixture):
     ]
     mock_retrieve_transaction_history = mocker.patch(
         "app.api.routes.transactions.retrieve_transaction_history",
-        return_value=transaction_history,
+        return_value={"transactions": transaction_history, "next_cursor": None},
     )
 
     response = client.get(f"{PREFIX}/history/{user_id}")
@@ -73,7 +77,79 @@ async def test_get_transaction_history_success(mocker: MockerFixture):
         "message": "Transaction history retrieved successfully",
         "code": 200,
     }
-    mock_retrieve_transaction_history.assert_called_once_with(user_id)
+    assert "X-Next-Cursor" not in response.headers
+    mock_retrieve_transaction_history.assert_called_once_with(
+        user_id, cursor=None, limit=100, include_full_name=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_history_next_page(mocker: MockerFixture):
+    user_id = "12345"
+    transaction_history = [
+        {
+            "id": "67890",
+            "transaction_date": "2023-10-06T00:00:00",
+            "transaction_amount": 100.0,
+            "transaction_type": "credit",
+        }
+    ]
+    mock_retrieve_transaction_history = mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction_history",
+        return_value={"transactions": transaction_history, "next_cursor": "def"},
+    )
+
+    response = client.get(f"{PREFIX}/history/{user_id}?cursor=abc&limit=1")
+
+    assert response.status_code == 200
+    assert response.json()["data"] == transaction_history
+    assert response.headers["X-Next-Cursor"] == "def"
+    mock_retrieve_transaction_history.assert_called_once_with(
+        user_id, cursor="abc", limit=1, include_full_name=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_history_with_full_name(mocker: MockerFixture):
+    user_id = "12345"
+    transaction_history = [
+        {
+            "id": "67890",
+            "transaction_date": "2023-10-06T00:00:00",
+            "transaction_amount": 100.0,
+            "transaction_type": "credit",
+            "full_name": "Gerald Lol",
+        }
+    ]
+    mock_retrieve_transaction_history = mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction_history",
+        return_value={"transactions": transaction_history, "next_cursor": None},
+    )
+
+    response = client.get(f"{PREFIX}/history/{user_id}?include_full_name=true")
+
+    assert response.status_code == 200
+    assert response.json()["data"] == transaction_history
+    mock_retrieve_transaction_history.assert_called_once_with(
+        user_id, cursor=None, limit=100, include_full_name=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_transaction_history_invalid_cursor(mocker: MockerFixture):
+    user_id = "12345"
+    mocker.patch(
+        "app.api.routes.transactions.retrieve_transaction_history",
+        side_effect=InvalidOperationError("Invalid history cursor: abc"),
+    )
+
+    response = client.get(f"{PREFIX}/history/{user_id}?cursor=abc")
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "message": "Invalid history cursor: abc",
+        "name": "FidoTransactionsAPI",
+    }
 
 
 @pytest.mark.asyncio
@@ -92,7 +168,9 @@ async def test_get_transaction_history_not_found(mocker: MockerFixture):
         "message": "Transaction history not found for user ID 12345",
         "name": "FidoTransactionsAPI",
     }
-    mock_retrieve_transaction_history.assert_called_once_with(user_id)
+    mock_retrieve_transaction_history.assert_called_once_with(
+        user_id, cursor=None, limit=100, include_full_name=False
+    )
 
 
 @pytest.mark.asyncio
@@ -110,7 +188,9 @@ async def test_get_transaction_history_service_error(mocker: MockerFixture):
         "message": "Service is unavailable, please try again later",
         "name": "FidoTransactionsAPI",
     }
-    mock_retrieve_transaction_history.assert_called_once_with(user_id)
+    mock_retrieve_transaction_history.assert_called_once_with(
+        user_id, cursor=None, limit=100, include_full_name=False
+    )
 
 
 @pytest.mark.asyncio
@@ -212,3 +292,219 @@ async def test_delete_transaction_data_service_error(mocker: MockerFixture):
         "name": "FidoTransactionsAPI",
     }
     mock_delete_transaction.assert_called_once_with(transaction_id)
+
+
+@pytest.mark.asyncio
+async def test_add_transaction_records_bulk_json_array(mocker: MockerFixture):
+    records = [
+        {
+            "user_id": "12345",
+            "full_name": "Gerald Lol",
+            "transaction_amount": 100.0,
+            "transaction_type": "credit",
+        },
+        {"user_id": "12345", "transaction_amount": 50.0},
+    ]
+    results = [
+        {"index": 0, "status": "created", "id": "67890", "user_id": "12345"},
+        {"index": 1, "status": "invalid", "error": "full_name: Field required"},
+    ]
+    mock_add_transactions_bulk = mocker.patch(
+        "app.api.routes.transactions.add_transactions_bulk", return_value=results
+    )
+    mocker.patch("app.api.routes.transactions.check_capacity")
+    mock_enqueue_many = mocker.patch("app.api.routes.transactions.enqueue_many")
+
+    response = client.post(f"{PREFIX}/bulk", json=records)
+
+    assert response.status_code == 207
+    assert response.json() == {
+        "data": {"created": 1, "failed": 1, "results": results},
+        "message": "Bulk transactions processed",
+        "code": 207,
+    }
+    mock_add_transactions_bulk.assert_called_once_with(list(enumerate(records)))
+    mock_enqueue_many.assert_called_once_with(
+        [
+            (update_user_statistics, "12345"),
+            (recalculate_credit_scores, "12345"),
+            (alert_relevant_systems, ["67890"]),
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_transaction_records_bulk_ndjson(mocker: MockerFixture):
+    lines = [
+        b'{"user_id": "1", "full_name": "A", "transaction_amount": 1, "transaction_type": "debit"}',
+        b'{"user_id": "2", "full_name": "B", "transaction_amount": 2, "transaction_type": "credit"}',
+    ]
+    results = [
+        {"index": 0, "status": "created", "id": "a", "user_id": "1"},
+        {"index": 1, "status": "created", "id": "b", "user_id": "2"},
+    ]
+    mock_add_transactions_bulk = mocker.patch(
+        "app.api.routes.transactions.add_transactions_bulk", return_value=results
+    )
+    mocker.patch("app.api.routes.transactions.check_capacity")
+    mocker.patch("app.api.routes.transactions.enqueue_many")
+
+    response = client.post(
+        f"{PREFIX}/bulk",
+        content=b"\n".join(lines) + b"\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 201
+    assert response.json()["data"] == {"created": 2, "failed": 0, "results": results}
+    mock_add_transactions_bulk.assert_called_once_with(list(enumerate(lines)))
+
+
+@pytest.mark.asyncio
+async def test_add_transaction_records_bulk_chunk_failure(mocker: MockerFixture):
+    records = [{"user_id": str(index)} for index in range(3)]
+    results = [
+        {"index": 0, "status": "created", "id": "a", "user_id": "0"},
+        {"index": 1, "status": "created", "id": "b", "user_id": "1"},
+    ]
+    mocker.patch("app.api.routes.transactions.BULK_INGEST_CHUNK_SIZE", 2)
+    mock_add_transactions_bulk = mocker.patch(
+        "app.api.routes.transactions.add_transactions_bulk",
+        side_effect=[results, Exception("Database error")],
+    )
+    mocker.patch("app.api.routes.transactions.check_capacity")
+    mock_enqueue_many = mocker.patch("app.api.routes.transactions.enqueue_many")
+
+    response = client.post(f"{PREFIX}/bulk", json=records)
+
+    assert response.status_code == 207
+    assert response.json()["data"] == {
+        "created": 2,
+        "failed": 1,
+        "results": results
+        + [
+            {
+                "index": 2,
+                "status": "failed",
+                "error": "An error occurred while storing the record",
+            }
+        ],
+    }
+    assert mock_add_transactions_bulk.call_count == 2
+    # Side effects still run for the chunk that was stored
+    tasks = mock_enqueue_many.call_args.args[0]
+    assert (alert_relevant_systems, ["a", "b"]) in tasks
+
+
+@pytest.mark.asyncio
+async def test_add_transaction_records_bulk_rejects_non_array(mocker: MockerFixture):
+    mock_add_transactions_bulk = mocker.patch(
+        "app.api.routes.transactions.add_transactions_bulk"
+    )
+    mocker.patch("app.api.routes.transactions.check_capacity")
+
+    response = client.post(f"{PREFIX}/bulk", json={"user_id": "12345"})
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "message": "Request body must be a JSON array or NDJSON",
+        "name": "FidoTransactionsAPI",
+    }
+    mock_add_transactions_bulk.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_add_transaction_records_bulk_queue_full(mocker: MockerFixture):
+    mocker.patch(
+        "app.api.routes.transactions.check_capacity",
+        side_effect=ServiceError("Too many tasks are queued, please try again later"),
+    )
+    mock_add_transactions_bulk = mocker.patch(
+        "app.api.routes.transactions.add_transactions_bulk"
+    )
+
+    response = client.post(f"{PREFIX}/bulk", json=[{"user_id": "12345"}])
+
+    assert response.status_code == 503
+    assert response.json() == {
+        "message": "Too many tasks are queued, please try again later",
+        "name": "FidoTransactionsAPI",
+    }
+    mock_add_transactions_bulk.assert_not_called()
+
+
+EXPORT_BATCHES = [
+    [
+        {
+            "_id": "67890",
+            "transaction_date": datetime(2023, 10, 6),
+            "transaction_amount": "100.50",
+            "transaction_type": "credit",
+        }
+    ],
+    [
+        {
+            "_id": "67891",
+            "transaction_date": "2023-10-07T00:00:00",
+            "transaction_amount": "20",
+            "transaction_type": "debit",
+        }
+    ],
+]
+
+
+async def fake_export(user_id, start_date=None, end_date=None):
+    for batch in EXPORT_BATCHES:
+        yield batch
+
+
+@pytest.mark.asyncio
+async def test_export_transaction_history_ndjson(mocker: MockerFixture):
+    mock_iter_transaction_export = mocker.patch(
+        "app.api.routes.transactions.iter_transaction_export",
+        side_effect=fake_export,
+    )
+
+    response = client.get(
+        f"{PREFIX}/history/12345/export?from=2023-10-01T00:00:00&gzip=true"
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-encoding"] == "gzip"
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {
+            "id": "67890",
+            "transaction_date": "2023-10-06T00:00:00",
+            "transaction_amount": "100.50",
+            "transaction_type": "credit",
+        },
+        {
+            "id": "67891",
+            "transaction_date": "2023-10-07T00:00:00",
+            "transaction_amount": "20",
+            "transaction_type": "debit",
+        },
+    ]
+    mock_iter_transaction_export.assert_called_once_with(
+        "12345", datetime(2023, 10, 1), None
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_transaction_history_csv(mocker: MockerFixture):
+    mocker.patch(
+        "app.api.routes.transactions.iter_transaction_export",
+        side_effect=fake_export,
+    )
+
+    response = client.get(f"{PREFIX}/history/12345/export?format=csv")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "content-encoding" not in response.headers
+    assert response.text.splitlines() == [
+        "id,transaction_date,transaction_amount,transaction_type",
+        "67890,2023-10-06T00:00:00,100.50,credit",
+        "67891,2023-10-07T00:00:00,20,debit",
+    ]
@@ -0,0 +1,85 @@
+import pytest
+from bson import ObjectId
+from pytest_mock import MockerFixture
+
+from app.tasks.analytics_feed import RESUME_TOKEN_KEY, ChangeStreamFeed
+
+
+class FakeChangeStream:
+    """Hands out `events`, then reports no new events."""
+
+    def __init__(self, events: list):
+        self.events = list(events)
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def try_next(self):
+        if not self.events:
+            return None
+        event = self.events.pop(0)
+        self.resume_token = event["_id"]
+        return event
+
+
+def event(token: str, operation: str, key=None) -> dict:
+    change = {"_id": {"_data": token}, "operationType": operation}
+    if key is not None:
+        change["documentKey"] = {"_id": key}
+    return change
+
+
+@pytest.mark.asyncio
+async def test_change_stream_feed_reads_users_from_rollup_keys(
+    fake_redis, mocker: MockerFixture
+):
+    rollups = mocker.patch("app.tasks.analytics_feed.rollup_collection")
+    rollups.watch.return_value = FakeChangeStream(
+        [
+            event("1", "insert", {"user_id": "u1", "day": "2024-10-08"}),
+            event("2", "delete", {"user_id": "u2", "day": "2024-10-08"}),
+            event("3", "update", ObjectId()),
+        ]
+    )
+
+    batches = ChangeStreamFeed().batches()
+    user_ids, token = await batches.__anext__()
+
+    assert user_ids == ["u1", "u2"]
+    assert token == {"_data": "3"}
+    assert rollups.watch.call_args.kwargs["start_after"] is None
+    await batches.aclose()
+
+
+@pytest.mark.asyncio
+async def test_change_stream_feed_reopens_after_invalidate(
+    fake_redis, mocker: MockerFixture
+):
+    rollups = mocker.patch("app.tasks.analytics_feed.rollup_collection")
+    rollups.watch.side_effect = [
+        FakeChangeStream(
+            [
+                event("1", "insert", {"user_id": "u1", "day": "2024-10-08"}),
+                event("2", "invalidate"),
+            ]
+        ),
+        FakeChangeStream(
+            [event("3", "insert", {"user_id": "u2", "day": "2024-10-08"})]
+        ),
+    ]
+    feed = ChangeStreamFeed()
+    batches = feed.batches()
+
+    user_ids, token = await batches.__anext__()
+    assert user_ids == ["u1"]
+    await feed.commit(token)
+
+    user_ids, _ = await batches.__anext__()
+    assert user_ids == ["u2"]
+    assert await fake_redis.get(RESUME_TOKEN_KEY) == b"2"
+    assert rollups.watch.call_args.kwargs["start_after"] == {"_data": "2"}
+    await batches.aclose()
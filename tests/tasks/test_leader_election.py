@@ -0,0 +1,51 @@
+import pytest
+from pytest_mock import MockerFixture
+
+from app.tasks.leader_election import (FENCING_TOKEN_KEY, LEADER_KEY,
+                                       StaleLeaderError, check_fencing_token,
+                                       election, leader_only)
+
+
+@pytest.fixture
+def leader(fake_redis, mocker: MockerFixture):
+    """This process holds the lease under fencing token 1."""
+    mocker.patch.object(election, "token", 1)
+    return fake_redis
+
+
+@pytest.mark.asyncio
+async def test_check_fencing_token_outside_scheduled_jobs(fake_redis):
+    await check_fencing_token()
+
+
+@pytest.mark.asyncio
+async def test_leader_job_writes_under_current_token(leader):
+    await leader.set(LEADER_KEY, election.instance_id)
+    await leader.set(FENCING_TOKEN_KEY, 1)
+
+    @leader_only("job")
+    async def job():
+        await check_fencing_token()
+        return "done"
+
+    assert await job() == "done"
+    assert await leader.hexists("scheduler:last_run", "job")
+
+
+@pytest.mark.asyncio
+async def test_deposed_leader_job_stops_before_writing(leader):
+    await leader.set(LEADER_KEY, election.instance_id)
+    await leader.set(FENCING_TOKEN_KEY, 1)
+    writes = []
+
+    @leader_only("job")
+    async def job():
+        # Another process takes over while this job is running
+        await leader.incr(FENCING_TOKEN_KEY)
+        await check_fencing_token()
+        writes.append("rollups")
+
+    with pytest.raises(StaleLeaderError):
+        await job()
+    assert writes == []
+    assert not await leader.hexists("scheduler:last_run", "job")
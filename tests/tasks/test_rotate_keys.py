@@ -0,0 +1,66 @@
+import pytest
+from cryptography.fernet import Fernet
+from pytest_mock import MockerFixture
+
+from app.tasks.rotate_keys import rotate_full_names
+from app.utils import encryption_utils
+from app.utils.crypto_service import CryptoService
+from app.utils.encryption_utils import configure_keys, decrypt_data, key_id
+
+OLD_KEY = Fernet.generate_key().decode()
+NEW_KEY = Fernet.generate_key().decode()
+
+
+@pytest.fixture
+def key_ring(mocker: MockerFixture):
+    """Key `k2` was just prepended to `k1`."""
+    original = encryption_utils.raw_keys_by_id
+    configure_keys({"k2": NEW_KEY, "k1": OLD_KEY})
+    mocker.patch("app.tasks.rotate_keys.PRIMARY_KEY_ID", "k2")
+    service = CryptoService(executor="thread", workers=1)
+    mocker.patch("app.tasks.rotate_keys.crypto_service", service)
+    yield
+    service.shutdown()
+    configure_keys(original)
+
+
+def old_name(name: str) -> str:
+    return "k1:" + Fernet(OLD_KEY.encode()).encrypt(name.encode()).decode()
+
+
+@pytest.mark.asyncio
+async def test_rotate_full_names_rewrites_each_batch(key_ring, mocker: MockerFixture):
+    batches = [
+        [
+            {"_id": 1, "full_name": old_name("A")},
+            {"_id": 2, "full_name": old_name("B")},
+        ],
+        [{"_id": 3, "full_name": old_name("C")}],
+        [],
+    ]
+    collection = mocker.patch("app.tasks.rotate_keys.transaction_collection")
+    cursor = collection.find.return_value.sort.return_value.limit.return_value
+    cursor.to_list = mocker.AsyncMock(side_effect=batches)
+    collection.bulk_write = mocker.AsyncMock()
+
+    assert await rotate_full_names(batch_size=2) == 3
+
+    queries = [call.args[0] for call in collection.find.call_args_list]
+    assert queries[0]["full_name"]["$not"].pattern == "^k2:"
+    assert "_id" not in queries[0]
+    assert queries[1]["_id"] == {"$gt": 2}
+    assert queries[2]["_id"] == {"$gt": 3}
+
+    updates = [
+        update
+        for call in collection.bulk_write.call_args_list
+        for update in call.args[0]
+    ]
+    documents = batches[0] + batches[1]
+    for update, document in zip(updates, documents):
+        # Matched on the old ciphertext, so concurrent rewrites are kept
+        assert update._filter == document
+        name = update._doc["$set"]["full_name"]
+        assert key_id(name) == "k2"
+        assert decrypt_data(name) == decrypt_data(document["full_name"])
+    assert len(updates) == 3
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.exceptions.exceptions import ServiceError
+from app.tasks.task_queue import (DEAD_LETTER_STREAM, DELAYED_TASKS_KEY,
+                                  TASK_STREAM, TASKS, check_capacity,
+                                  delayed_member, enqueue_many, task_fields)
+from app.tasks.worker import TaskWorker, retry_delay
+
+
+@pytest.fixture
+def tasks(mocker: MockerFixture):
+    """The task registry, holding only the tasks a test registers."""
+    mocker.patch.dict(TASKS, clear=True)
+    return TASKS
+
+
+async def next_batch(worker: TaskWorker) -> list:
+    batches = worker.batches()
+    entries = await asyncio.wait_for(batches.__anext__(), timeout=5)
+    await batches.aclose()
+    return entries
+
+
+async def run_queued(worker: TaskWorker):
+    for entry_id, fields in await next_batch(worker):
+        await worker.run_task(entry_id, fields)
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_queued_task_and_removes_it(fake_redis, tasks):
+    calls = []
+
+    async def send_receipt(user_id, amount):
+        calls.append((user_id, amount))
+
+    tasks["send_receipt"] = send_receipt
+    worker = TaskWorker("test")
+    await worker.setup()
+
+    await enqueue_many([(send_receipt, "u1", 10.5)])
+    await run_queued(worker)
+
+    assert calls == [("u1", 10.5)]
+    assert worker.stats == {"done": 1, "retried": 0, "dead": 0}
+    assert await fake_redis.xlen(TASK_STREAM) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_task_is_scheduled_for_retry(fake_redis, tasks):
+    async def send_receipt(user_id):
+        raise RuntimeError("smtp down")
+
+    tasks["send_receipt"] = send_receipt
+    worker = TaskWorker("test")
+    await worker.setup()
+
+    await enqueue_many([(send_receipt, "u1")])
+    started = time.time()
+    await run_queued(worker)
+
+    [(member, due_at)] = await fake_redis.zrange(
+        DELAYED_TASKS_KEY, 0, -1, withscores=True
+    )
+    assert b'"attempts":1' in member
+    assert due_at == pytest.approx(started + retry_delay(1), abs=1)
+    assert worker.stats["retried"] == 1
+    assert await fake_redis.xlen(TASK_STREAM) == 0
+
+
+@pytest.mark.asyncio
+async def test_task_out_of_attempts_is_dead_lettered(
+    fake_redis, tasks, mocker: MockerFixture
+):
+    async def send_receipt(user_id):
+        raise RuntimeError("smtp down")
+
+    tasks["send_receipt"] = send_receipt
+    mocker.patch("app.tasks.worker.TASK_MAX_ATTEMPTS", 2)
+    worker = TaskWorker("test")
+    await worker.setup()
+
+    await fake_redis.xadd(TASK_STREAM, task_fields("send_receipt", '["u1"]', 1))
+    await run_queued(worker)
+
+    [(_, dead)] = await fake_redis.xrange(DEAD_LETTER_STREAM)
+    assert dead[b"task"] == b"send_receipt"
+    assert dead[b"attempts"] == b"2"
+    assert b"smtp down" in dead[b"error"]
+    assert not await fake_redis.zcard(DELAYED_TASKS_KEY)
+    assert worker.stats["dead"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_task_is_dead_lettered_without_retry(fake_redis, tasks):
+    worker = TaskWorker("test")
+    await worker.setup()
+
+    await fake_redis.xadd(TASK_STREAM, task_fields("removed_task", ["u1"]))
+    await run_queued(worker)
+
+    assert await fake_redis.xlen(DEAD_LETTER_STREAM) == 1
+    assert not await fake_redis.zcard(DELAYED_TASKS_KEY)
+
+
+@pytest.mark.asyncio
+async def test_due_retries_are_promoted_to_the_stream(fake_redis):
+    due = delayed_member(task_fields("send_receipt", '["u1"]', 1))
+    later = delayed_member(task_fields("send_receipt", '["u2"]', 1))
+    await fake_redis.zadd(
+        DELAYED_TASKS_KEY, {due: time.time() - 1, later: time.time() + 60}
+    )
+
+    await TaskWorker("test").promote_due_retries()
+
+    [(_, fields)] = await fake_redis.xrange(TASK_STREAM)
+    assert fields == {b"task": b"send_receipt", b"args": b'["u1"]', b"attempts": b"1"}
+    assert await fake_redis.zrange(DELAYED_TASKS_KEY, 0, -1) == [later.encode()]
+
+
+def test_retry_delay_doubles_up_to_the_maximum(mocker: MockerFixture):
+    mocker.patch("app.tasks.worker.TASK_RETRY_BASE_DELAY", 1.0)
+    mocker.patch("app.tasks.worker.TASK_RETRY_MAX_DELAY", 5.0)
+
+    assert [retry_delay(attempts) for attempts in range(1, 5)] == [1, 2, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_check_capacity_refuses_work_when_queue_is_full(
+    fake_redis, mocker: MockerFixture
+):
+    mocker.patch("app.tasks.task_queue.TASK_QUEUE_MAX_DEPTH", 2)
+    await fake_redis.xadd(TASK_STREAM, task_fields("send_receipt", ["u1"]))
+    await check_capacity()
+
+    await fake_redis.xadd(TASK_STREAM, task_fields("send_receipt", ["u2"]))
+    with pytest.raises(ServiceError):
+        await check_capacity()
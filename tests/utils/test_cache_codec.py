@@ -0,0 +1,115 @@
+from datetime import datetime
+
+import msgpack
+import pytest
+from bson import ObjectId
+from pytest_mock import MockerFixture
+
+from app.utils import cache_codec
+from app.utils.cache_codec import (COMPRESSION_NONE, COMPRESSION_ZSTD,
+                                   HEADER_BASE, TABLE_EXT, CacheDecodeError,
+                                   decode, encode)
+from app.utils.cache_utils import decode_envelope, encode_envelope
+from app.utils.serialization import dumps
+
+HISTORY_PAGE = {
+    "user_id": "1",
+    "transactions": [
+        {
+            "_id": "65f0c0ffee0000000000000%d" % index,
+            "transaction_amount": 10.5 * index,
+            "transaction_type": "debit" if index % 2 else "credit",
+            "tags": ["rent", {"note": None}],
+        }
+        for index in range(50)
+    ],
+    "next_cursor": None,
+}
+
+
+def round_trip(value):
+    return decode(encode(value)[0])[0]
+
+
+def test_round_trip():
+    assert round_trip(HISTORY_PAGE) == HISTORY_PAGE
+
+
+def test_round_trip_encodes_bson_and_dates_as_json_does():
+    object_id = ObjectId()
+    value = {"_id": object_id, "date": datetime(2024, 3, 1, 12, 30)}
+
+    assert round_trip(value) == {"_id": str(object_id), "date": "2024-03-01T12:30:00"}
+
+
+def test_empty_rows_keep_their_count():
+    assert round_trip({"transactions": [{}, {}]}) == {"transactions": [{}, {}]}
+
+
+def test_rows_of_different_shapes_are_not_packed_as_a_table():
+    rows = [{"a": 1}, {"b": 2}]
+
+    assert round_trip(rows) == rows
+
+
+def test_binary_payload_starts_with_a_version_header():
+    payload, _ = encode(HISTORY_PAGE)
+
+    assert HEADER_BASE <= payload[0] < 0x20
+
+
+def test_json_payloads_are_still_read(mocker: MockerFixture):
+    assert decode(dumps(HISTORY_PAGE))[0] == HISTORY_PAGE
+    assert decode(b"\n[1,2]")[0] == [1, 2]
+
+    mocker.patch("app.utils.cache_codec.CACHE_CODEC", "json")
+    payload, _ = encode(HISTORY_PAGE)
+    assert payload == dumps(HISTORY_PAGE)
+    assert decode(payload)[0] == HISTORY_PAGE
+
+
+@pytest.mark.skipif(
+    COMPRESSION_ZSTD not in cache_codec.COMPRESSORS, reason="zstandard not installed"
+)
+def test_compresses_bodies_above_threshold(mocker: MockerFixture):
+    mocker.patch("app.utils.cache_codec.compression", COMPRESSION_ZSTD)
+    mocker.patch("app.utils.cache_codec.CACHE_COMPRESSION_THRESHOLD", 256)
+
+    payload, size = encode(HISTORY_PAGE)
+    small_payload, _ = encode({"user_id": "1"})
+
+    assert payload[0] & 0x03 == COMPRESSION_ZSTD
+    assert len(payload) < size
+    assert decode(payload) == (HISTORY_PAGE, size)
+    assert small_payload[0] & 0x03 == COMPRESSION_NONE
+
+
+def test_unknown_codec_version_cannot_be_decoded():
+    payload, _ = encode(HISTORY_PAGE)
+    newer = bytes([payload[0] + (1 << 2)]) + payload[1:]
+
+    with pytest.raises(CacheDecodeError):
+        decode(newer)
+
+
+def test_missing_compression_library_cannot_be_decoded(mocker: MockerFixture):
+    mocker.patch.dict("app.utils.cache_codec.COMPRESSORS", clear=True)
+    payload = bytes([HEADER_BASE | COMPRESSION_ZSTD]) + b"compressed"
+
+    with pytest.raises(CacheDecodeError):
+        decode(payload)
+
+
+def test_unknown_extension_type_cannot_be_decoded():
+    body = msgpack.packb(msgpack.ExtType(TABLE_EXT + 1, b""))
+
+    with pytest.raises(CacheDecodeError):
+        decode(bytes([HEADER_BASE]) + body)
+
+
+def test_unreadable_cache_entry_is_treated_as_a_miss():
+    payload = encode_envelope(HISTORY_PAGE, compute_time=0.1)
+    newer = bytes([payload[0] + (1 << 2)]) + payload[1:]
+
+    assert decode_envelope(payload)["v"] == HISTORY_PAGE
+    assert decode_envelope(newer) is None
@@ -0,0 +1,217 @@
+import asyncio
+import time
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.utils.cache_codec import encode
+from app.utils.cache_utils import (bump_cache_generation, cached_load,
+                                   cached_load_many, decode_envelope,
+                                   encode_envelope, inflight, local_cache,
+                                   needs_refresh)
+from app.utils.local_cache import LocalCache
+
+KEY = "transaction_analytics:u1"
+REDIS_KEY = f"{KEY}:g0"
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    local_cache.clear()
+    inflight.clear()
+    yield
+    local_cache.clear()
+    inflight.clear()
+
+
+class Loader:
+    """Counts calls and returns `value`, after `delay` seconds."""
+
+    def __init__(self, value, delay: float = 0.0):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.value
+
+
+def envelope_payload(value, expires_in: float, compute_time: float = 0.0) -> bytes:
+    payload, _ = encode(
+        {"v": value, "exp": time.time() + expires_in, "d": compute_time}
+    )
+    return payload
+
+
+async def cached_value(fake_redis, redis_key: str = REDIS_KEY):
+    payload = await fake_redis.get(redis_key)
+    return decode_envelope(payload)["v"] if payload else None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load(fake_redis):
+    loader = Loader({"count": 1}, delay=0.01)
+
+    values = await asyncio.gather(*(cached_load("u1", KEY, loader) for _ in range(5)))
+
+    assert loader.calls == 1
+    assert values == [{"count": 1}] * 5
+    assert await cached_value(fake_redis) == {"count": 1}
+
+
+@pytest.mark.asyncio
+async def test_miss_waits_for_the_process_holding_the_lock(
+    fake_redis, mocker: MockerFixture
+):
+    mocker.patch("app.utils.cache_utils.CACHE_LOCK_POLL_INTERVAL", 0.01)
+    await fake_redis.set(f"lock:{REDIS_KEY}", "other-process")
+    loader = Loader({"count": 1})
+
+    async def other_process_stores_value():
+        await asyncio.sleep(0.03)
+        await fake_redis.set(REDIS_KEY, encode_envelope({"count": 2}, 0.0))
+
+    value, _ = await asyncio.gather(
+        cached_load("u1", KEY, loader), other_process_stores_value()
+    )
+
+    assert value == {"count": 2}
+    assert loader.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_miss_loads_itself_when_waiting_times_out(
+    fake_redis, mocker: MockerFixture
+):
+    mocker.patch("app.utils.cache_utils.CACHE_LOCK_POLL_INTERVAL", 0.01)
+    mocker.patch("app.utils.cache_utils.CACHE_LOCK_TIMEOUT_MS", 50)
+    await fake_redis.set(f"lock:{REDIS_KEY}", "other-process")
+    loader = Loader({"count": 1})
+
+    value = await cached_load("u1", KEY, loader)
+
+    assert value == {"count": 1}
+    assert loader.calls == 1
+    assert await cached_value(fake_redis) == {"count": 1}
+    # The other process's lock is left alone
+    assert await fake_redis.get(f"lock:{REDIS_KEY}") == b"other-process"
+
+
+@pytest.mark.asyncio
+async def test_stale_value_is_served_while_refreshing(fake_redis):
+    await fake_redis.set(REDIS_KEY, envelope_payload({"count": 1}, expires_in=-1))
+    loader = Loader({"count": 2})
+
+    value = await cached_load("u1", KEY, loader)
+    await inflight[(REDIS_KEY, False)]
+
+    assert value == {"count": 1}
+    assert loader.calls == 1
+    assert await cached_value(fake_redis) == {"count": 2}
+    assert await cached_load("u1", KEY, loader) == {"count": 2}
+
+
+@pytest.mark.asyncio
+async def test_miss_does_not_join_a_background_refresh(
+    fake_redis, mocker: MockerFixture
+):
+    mocker.patch("app.utils.cache_utils.CACHE_LOCK_POLL_INTERVAL", 0.01)
+    mocker.patch("app.utils.cache_utils.CACHE_LOCK_TIMEOUT_MS", 50)
+    await fake_redis.set(REDIS_KEY, envelope_payload({"count": 1}, expires_in=-1))
+    await fake_redis.set(f"lock:{REDIS_KEY}", "other-process")
+    loader = Loader({"count": 2}, delay=0.01)
+
+    assert await cached_load("u1", KEY, loader) == {"count": 1}
+    background = inflight[(REDIS_KEY, False)]
+    # The entry is evicted while the background refresh is still in flight
+    await fake_redis.delete(REDIS_KEY)
+
+    assert await cached_load("u1", KEY, loader) == {"count": 2}
+    # The background refresh gave up on the other process's lock
+    assert await background is None
+    assert loader.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_values_are_refreshed_early(fake_redis, mocker: MockerFixture):
+    envelope = {"v": {}, "exp": time.time() + 10, "d": 5.0}
+    random = mocker.patch("app.utils.cache_utils.random.random")
+
+    random.return_value = 1e-6
+    assert needs_refresh(envelope)
+    assert not needs_refresh({**envelope, "d": 0.0})
+    random.return_value = 0.99
+    assert not needs_refresh(envelope)
+
+    # A value picked for early refresh is still served
+    random.return_value = 1e-6
+    await fake_redis.set(
+        REDIS_KEY, envelope_payload({"count": 1}, expires_in=10, compute_time=5.0)
+    )
+    loader = Loader({"count": 2})
+    assert await cached_load("u1", KEY, loader) == {"count": 1}
+    await inflight[(REDIS_KEY, False)]
+    assert loader.calls == 1
+    assert await cached_value(fake_redis) == {"count": 2}
+
+
+@pytest.mark.asyncio
+async def test_generation_bump_invalidates_local_and_redis_entries(fake_redis):
+    loader = Loader({"count": 1})
+    assert await cached_load("u1", KEY, loader) == {"count": 1}
+    await fake_redis.delete(REDIS_KEY)
+    # Served from the in-process cache, without Redis
+    assert await cached_load("u1", KEY, loader) == {"count": 1}
+    assert loader.calls == 1
+
+    loader.value = {"count": 2}
+    await bump_cache_generation("u1")
+
+    assert local_cache.get(KEY) is None
+    assert await cached_load("u1", KEY, loader) == {"count": 2}
+    assert loader.calls == 2
+    assert await cached_value(fake_redis, f"{KEY}:g1") == {"count": 2}
+
+
+def test_local_cache_rejects_values_fetched_before_invalidation():
+    cache = LocalCache(max_bytes=1024, ttl=30)
+    started_at = time.monotonic()
+    cache.invalidate("u1")
+
+    cache.set("u1", KEY, {"count": 1}, 10, started_at)
+
+    assert cache.get(KEY) is None
+    cache.set("u1", KEY, {"count": 1}, 10, time.monotonic())
+    assert cache.get(KEY) == {"count": 1}
+
+
+@pytest.mark.asyncio
+async def test_cached_load_many_loads_only_misses_in_one_call(fake_redis):
+    keys = {
+        user_id: f"transaction_analytics:{user_id}" for user_id in ("u1", "u2", "u3")
+    }
+    await fake_redis.set(
+        "transaction_analytics:u1:g0", envelope_payload({"user": "u1"}, expires_in=60)
+    )
+    await fake_redis.set(
+        "transaction_analytics:u2:g0", envelope_payload({"user": "old"}, expires_in=-1)
+    )
+    calls = []
+
+    async def loader(user_ids):
+        calls.append(user_ids)
+        # Nothing is found for u3
+        return {user_id: {"user": user_id} for user_id in user_ids if user_id == "u2"}
+
+    values = await cached_load_many(keys, loader)
+
+    assert values == {"u1": {"user": "u1"}, "u2": {"user": "u2"}}
+    assert calls == [["u2", "u3"]]
+    assert await cached_value(fake_redis, "transaction_analytics:u2:g0") == {
+        "user": "u2"
+    }
+    # Now all from the in-process cache
+    assert await cached_load_many(keys, loader) == values
+    assert calls == [["u2", "u3"], ["u3"]]
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.utils.crypto_service import CryptoService
+
+
+@pytest.fixture
+def service():
+    service = CryptoService(executor="thread", workers=4, batch_size=3, max_pending=1)
+    yield service
+    service.shutdown()
+
+
+class BatchFunc:
+    """Records each batch it is called with and the most batches run at once."""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.batches = []
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, values: list) -> list:
+        with self.lock:
+            self.batches.append(values)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return [value.upper() for value in values]
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_run_one_coalesces_values_into_one_batch(service):
+    func = BatchFunc()
+
+    values = await asyncio.gather(*(service.run_one(func, value) for value in "ab"))
+
+    assert values == ["A", "B"]
+    assert func.batches == [["a", "b"]]
+
+
+@pytest.mark.asyncio
+async def test_run_one_flushes_full_batches_early(service):
+    func = BatchFunc()
+
+    values = await asyncio.gather(*(service.run_one(func, value) for value in "abcde"))
+
+    assert values == ["A", "B", "C", "D", "E"]
+    assert func.batches == [["a", "b", "c"], ["d", "e"]]
+
+
+@pytest.mark.asyncio
+async def test_batches_beyond_max_pending_wait_for_a_slot(service):
+    func = BatchFunc(delay=0.02)
+
+    values = await service.run_many(func, list("abcdefg"))
+
+    assert values == list("ABCDEFG")
+    assert len(func.batches) == 3
+    # Four workers, but only one batch queued on the pool at a time
+    assert func.most_running == 1
+
+
+@pytest.mark.asyncio
+async def test_run_one_failure_reaches_every_waiter(service):
+    func = BatchFunc(error=ValueError("bad token"))
+
+    results = await asyncio.gather(
+        *(service.run_one(func, value) for value in "ab"), return_exceptions=True
+    )
+
+    assert len(func.batches) == 1
+    assert [str(result) for result in results] == ["bad token", "bad token"]
+    assert all(isinstance(result, ValueError) for result in results)
@@ -0,0 +1,59 @@
+import pytest
+from cryptography.fernet import Fernet
+
+from app.utils import encryption_utils
+from app.utils.encryption_utils import (configure_keys, decrypt_data,
+                                        encrypt_data, key_id, rotate_data)
+
+OLD_KEY = Fernet.generate_key().decode()
+NEW_KEY = Fernet.generate_key().decode()
+
+
+@pytest.fixture
+def key_ring():
+    """Key `k2` is primary, with `k1` still readable."""
+    original = encryption_utils.raw_keys_by_id
+    configure_keys({"k2": NEW_KEY, "k1": OLD_KEY})
+    yield
+    configure_keys(original)
+
+
+def test_encrypt_prefixes_the_primary_key_id(key_ring):
+    encrypted = encrypt_data("Gerald Lol")
+
+    assert key_id(encrypted) == "k2"
+    assert decrypt_data(encrypted) == "Gerald Lol"
+    token = encrypted.partition(":")[2]
+    assert Fernet(NEW_KEY.encode()).decrypt(token.encode()) == b"Gerald Lol"
+
+
+def test_decrypt_uses_the_key_a_value_was_written_with(key_ring):
+    token = Fernet(OLD_KEY.encode()).encrypt(b"Gerald Lol").decode()
+
+    assert decrypt_data(f"k1:{token}") == "Gerald Lol"
+
+
+def test_decrypt_tries_every_key_for_unprefixed_values(key_ring):
+    token = Fernet(OLD_KEY.encode()).encrypt(b"Gerald Lol").decode()
+
+    assert key_id(token) is None
+    assert decrypt_data(token) == "Gerald Lol"
+
+
+def test_decrypt_rejects_unknown_key_ids(key_ring):
+    token = Fernet(OLD_KEY.encode()).encrypt(b"Gerald Lol").decode()
+
+    with pytest.raises(ValueError, match="Unknown encryption key ID: k0"):
+        decrypt_data(f"k0:{token}")
+
+
+def test_rotate_data_re_encrypts_under_the_primary_key(key_ring):
+    token = Fernet(OLD_KEY.encode()).encrypt(b"Gerald Lol").decode()
+
+    for value in (f"k1:{token}", token):
+        rotated = rotate_data(value)
+        assert key_id(rotated) == "k2"
+        assert decrypt_data(rotated) == "Gerald Lol"
+
+    current = encrypt_data("Gerald Lol")
+    assert rotate_data(current) == current
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from app.utils.redis_streams import create_group, group_batches
+
+STREAM = "test:stream"
+GROUP = "test"
+
+
+async def read_batches(fake_redis, consumer: str, batches: int, claim_idle_ms=60000):
+    """Values of `batches` batches read by `consumer`, each acknowledged."""
+    reader = group_batches(STREAM, GROUP, consumer, 10, claim_idle_ms, 10)
+    values = []
+    for _ in range(batches):
+        entries = await asyncio.wait_for(reader.__anext__(), 5)
+        values.append([fields[b"n"] for _, fields in entries])
+        if entries:
+            await fake_redis.xack(STREAM, GROUP, *(entry_id for entry_id, _ in entries))
+    await reader.aclose()
+    return values
+
+
+@pytest.mark.asyncio
+async def test_create_group_twice(fake_redis):
+    await create_group(STREAM, GROUP)
+    await create_group(STREAM, GROUP)
+
+    [group] = await fake_redis.xinfo_groups(STREAM)
+    assert group["name"] == GROUP.encode()
+
+
+@pytest.mark.asyncio
+async def test_own_pending_entries_come_before_new_ones(fake_redis):
+    await create_group(STREAM, GROUP)
+    await fake_redis.xadd(STREAM, {"n": 1})
+    # Read but never acknowledged, as by a consumer that restarted
+    await fake_redis.xreadgroup(GROUP, "a", {STREAM: ">"}, count=1)
+    await fake_redis.xadd(STREAM, {"n": 2})
+
+    # An idle read yields an empty batch
+    assert await read_batches(fake_redis, "a", 3) == [[b"1"], [b"2"], []]
+
+
+@pytest.mark.asyncio
+async def test_entries_left_by_another_consumer_are_claimed(fake_redis):
+    await create_group(STREAM, GROUP)
+    await fake_redis.xadd(STREAM, {"n": 1})
+    await fake_redis.xreadgroup(GROUP, "dead", {STREAM: ">"}, count=1)
+
+    reader = group_batches(STREAM, GROUP, "b", 10, 0, 10)
+    [(entry_id, fields)] = await asyncio.wait_for(reader.__anext__(), 5)
+    await reader.aclose()
+
+    assert fields == {b"n": b"1"}
+    [pending] = await fake_redis.xpending_range(STREAM, GROUP, "-", "+", 10)
+    assert (pending["message_id"], pending["consumer"]) == (entry_id, b"b")
@@ -0,0 +1,60 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import orjson
+import pytest
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+
+from app.utils.serialization import SERIALIZERS, to_jsonable
+
+OBJECT_ID = ObjectId("65f0c0ffee00000000000001")
+
+TRANSACTION = {
+    "_id": OBJECT_ID,
+    "user_id": "u1",
+    "transaction_amount": Decimal128("250.50"),
+    "fee": Decimal("1.25"),
+    "transaction_date": datetime(2024, 10, 8, 9, 30, 0, 125000),
+    "day": date(2024, 10, 8),
+    "tags": [None, True, 3],
+}
+
+EXPECTED = {
+    "_id": "65f0c0ffee00000000000001",
+    "user_id": "u1",
+    "transaction_amount": 250.5,
+    "fee": 1.25,
+    "transaction_date": "2024-10-08T09:30:00.125000",
+    "day": "2024-10-08",
+    "tags": [None, True, 3],
+}
+
+
+@pytest.mark.parametrize("name", SERIALIZERS)
+def test_bson_values_serialize_to_json(name):
+    serializer = SERIALIZERS[name]
+
+    assert serializer.loads(serializer.dumps(TRANSACTION)) == EXPECTED
+
+
+def test_serializers_produce_the_same_json():
+    payloads = {
+        name: serializer.dumps(TRANSACTION) for name, serializer in SERIALIZERS.items()
+    }
+
+    assert payloads["orjson"] == payloads["json"]
+    assert orjson.loads(payloads["json"]) == EXPECTED
+
+
+@pytest.mark.parametrize("name", SERIALIZERS)
+def test_unknown_types_are_rejected(name):
+    with pytest.raises(TypeError):
+        SERIALIZERS[name].dumps({"value": object()})
+
+
+def test_to_jsonable_reads_back_as_json():
+    assert to_jsonable({"_id": OBJECT_ID, "amount": Decimal128("1.5")}) == {
+        "_id": "65f0c0ffee00000000000001",
+        "amount": 1.5,
+    }